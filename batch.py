@@ -0,0 +1,193 @@
+import sys, os, glob, csv, json, time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse as argp
+
+import beamplanning as bp
+from validator import find_violations, format_violation
+
+#%% Parameters
+
+# Where solutions are written when --output-dir isn't given.
+default_output_dir = 'Solutions'
+
+# Appended to a scenario's name to name its solution file.
+solution_suffix = '_solution.txt'
+
+# Columns of the CSV report, in order.
+report_columns = ['scenario', 'users', 'sats', 'interferers', 'coverage', 'read_s', 'plan_s', 'validate_s',
+                  'wall_s', 'valid', 'violations', 'first_violation', 'output', 'error']
+
+#%% Inputs
+
+def expand_inputs(paths: list) -> list:
+    """
+    Returns: the scenario files named by paths, each a file, a directory
+    (its *.txt files) or a glob pattern, in order and without repeats.
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = sorted(glob.glob(os.path.join(path, '*.txt')))
+        elif glob.has_magic(path):
+            found = sorted(name for name in glob.glob(path) if os.path.isfile(name))
+        else:
+            found = [path]
+        filenames.extend(name for name in found if name not in filenames)
+    return filenames
+
+
+def output_path(output_dir: str, filename: str) -> str:
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(output_dir, stem + solution_suffix)
+
+#%% Running one scenario
+
+def run_scenario(filename: str, settings: dict) -> dict:
+    """
+    Reads, plans and validates one scenario, and writes its solution to its
+    own file in settings['output_dir'].
+
+    Returns: a dict with one value per report column.
+    """
+    row = dict.fromkeys(report_columns)
+    row.update(scenario=os.path.basename(filename), valid=False)
+    start = time.perf_counter()
+    scenario = {}
+    if not bp.read_scenario(filename, scenario, settings['use_cache']):
+        row['error'] = 'unreadable scenario'
+        return row
+    read_done = time.perf_counter()
+    row.update(users=len(scenario['users']), sats=len(scenario['sats']), interferers=len(scenario['interferers']),
+               read_s=read_done - start)
+
+    coverage, solution = bp.planning_optimizer(scenario, settings['planner'], settings['restarts'], 1, None,
+                                               settings['seed'], settings['improve'], settings['partition'])
+    plan_done = time.perf_counter()
+    row['output'] = output_path(settings['output_dir'], filename)
+    bp.output_results(solution, row['output'])
+    write_done = time.perf_counter()
+    violations = find_violations(scenario, solution)
+    validate_done = time.perf_counter()
+
+    row.update(coverage=coverage, plan_s=plan_done - read_done, validate_s=validate_done - write_done,
+               wall_s=validate_done - start, valid=not violations, violations=len(violations),
+               first_violation=format_violation(violations[0]) if violations else None)
+    return row
+
+
+def try_scenario(args) -> dict:
+    """
+    Runs run_scenario(*args). Returns: its row, or a row with the error it
+    raised, so one bad scenario doesn't stop the batch.
+    """
+    filename, settings = args
+    try:
+        return run_scenario(filename, settings)
+    except Exception as error:
+        row = dict.fromkeys(report_columns)
+        row.update(scenario=os.path.basename(filename), valid=False, error=f"{type(error).__name__}: {error}")
+        return row
+
+
+def run_batch(filenames: list, settings: dict, workers: int = 1):
+    """
+    Runs run_scenario over filenames on workers processes.
+
+    Yields: (filename, report row) for each scenario as it finishes.
+    """
+    if workers <= 1 or len(filenames) <= 1:
+        for filename in filenames:
+            yield filename, try_scenario((filename, settings))
+        return
+    start_method = 'fork' if 'fork' in mp.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(start_method)) as pool:
+        futures = {pool.submit(try_scenario, (filename, settings)): filename for filename in filenames}
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                row = future.result()
+            except Exception as error:
+                # The worker itself died, e.g. killed for running out of memory.
+                row = dict.fromkeys(report_columns)
+                row.update(scenario=os.path.basename(filename), valid=False, error=f"{type(error).__name__}: {error}")
+            yield filename, row
+
+#%% Reports
+
+def print_table(rows: list, stream=sys.stdout):
+    print(f"{'scenario':40s} {'users':>7s} {'coverage':>8s} {'plan s':>8s} {'valid s':>8s} {'wall s':>8s} result",
+          file=stream)
+    for row in rows:
+        if row['error']:
+            print(f"{row['scenario']:40s} {'-':>7s} {'-':>8s} {'-':>8s} {'-':>8s} {'-':>8s} FAIL ({row['error']})",
+                  file=stream)
+            continue
+        result = 'pass' if row['valid'] else f"FAIL ({row['violations']} violations)"
+        print(f"{row['scenario']:40s} {row['users']:7d} {row['coverage']:8.4f} {row['plan_s']:8.3f} "
+              f"{row['validate_s']:8.3f} {row['wall_s']:8.3f} {result}", file=stream)
+    passed = sum(1 for row in rows if row['valid'])
+    print(f"{passed} of {len(rows)} scenarios passed", file=stream)
+
+
+def write_csv(path: str, rows: list):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=report_columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+#%% Main
+
+def main() -> int:
+    """
+    Entry point. Plans and validates every scenario given, writing each
+    solution to its own file, then prints one table of the results.
+
+    Returns: exit code, 1 if any scenario failed or was invalid.
+    """
+    argu = argp.ArgumentParser(prog=f"python3.7 {sys.argv[0]}", description='Starlink beam-planning batch runner')
+    argu.add_argument('inputs', nargs='+', metavar='SCENARIOS',
+                      help='Scenario files, directories of them, or glob patterns.')
+    argu.add_argument('--output-dir', default=default_output_dir,
+                      help=f'Where to write each scenario\'s solution, as <name>{solution_suffix} '
+                           f'(default: {default_output_dir}).')
+    argu.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                      help='Scenarios planned at once (default: one per CPU).')
+    argu.add_argument('--planner', choices=bp.planners, default='greedy', help='Planning algorithm (default: greedy).')
+    argu.add_argument('--restarts', type=int, default=1, help='Randomized greedy restarts per scenario (default: 1).')
+    argu.add_argument('--seed', type=int, default=0, help='Planner seed (default: 0).')
+    argu.add_argument('--improve', type=float, default=0.0, help='Seconds of local search per scenario (default: 0).')
+    argu.add_argument('--partition', action='store_true', help='Plan separate regions independently and merge them.')
+    argu.add_argument('--no-cache', dest='use_cache', action='store_false', help="Don't use scenario binary caches.")
+    argu.add_argument('--json', help='Also write the results as JSON to this file.')
+    argu.add_argument('--csv', help='Also write the results as CSV to this file.')
+    argup = argu.parse_args()
+
+    filenames = expand_inputs(argup.inputs)
+    if not filenames:
+        print("No scenarios found.", file=sys.stderr)
+        return -1
+    os.makedirs(argup.output_dir, exist_ok=True)
+    settings = {'planner': argup.planner, 'restarts': argup.restarts, 'seed': argup.seed, 'improve': argup.improve,
+                'partition': argup.partition, 'use_cache': argup.use_cache, 'output_dir': argup.output_dir}
+
+    results = {}
+    for filename, row in run_batch(filenames, settings, argup.workers):
+        status = row['error'] or ('pass' if row['valid'] else 'FAIL')
+        print(f"[{len(results) + 1}/{len(filenames)}] {filename}: {status}", file=sys.stderr)
+        results[filename] = row
+    # Report in input order, whatever order the workers finished in.
+    rows = [results[filename] for filename in filenames]
+    print_table(rows)
+
+    if argup.json:
+        with open(argup.json, 'w') as f:
+            json.dump({'settings': settings, 'results': rows}, f, indent=2)
+            f.write('\n')
+    if argup.csv:
+        write_csv(argup.csv, rows)
+    return 0 if all(row['valid'] for row in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
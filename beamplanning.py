@@ -1,8 +1,10 @@
-import sys, random, copy
+import sys, random, time
 from collections import namedtuple
 from math import sqrt, acos, degrees, floor
 import argparse as argp
 
+import instrumentation
+
 #%% Parameters
 
 # A type for our 3D points.
@@ -62,49 +64,25 @@ def read_object(object_type:str, line:str, dest:dict) -> bool:
         dest[ident] = Vector3(x, y, z)
         return True
     
-def read_scenario(filename:str, scenario:dict) -> bool:
+def read_scenario(filename:str, scenario:dict, use_cache:bool=True) -> bool:
     """
     Given a filename of a scenario file, and a dictionary to populate, populates
     the dictionary with the contents of the file, doing some validation along
     the way.
 
+    The file is streamed straight into typed arrays, and those are cached in
+    a binary sidecar file, so re-reading an unchanged scenario skips parsing.
+
     Returns: Success or failure.
     """
+    from scenario_loader import load_scenario_arrays
 
     #print("Reading scenario file " + filename) 
 
-    scenariofile_lines = open(filename).readlines()
-    scenario['sats'] = {}
-    scenario['users'] = {}
-    scenario['interferers'] = {}
-    for line in scenariofile_lines:
-        if "#" in line:
-            # Comment.
-            continue
-
-        elif line.strip() == "":
-            # Whitespace or empty line.
-            continue
-
-        elif "interferer" in line:
-            # Read a non-starlink-sat object.
-            if not read_object('interferer', line, scenario['interferers']):
-                return False
-
-        elif "sat" in line:
-            # Read a sat object.
-            if not read_object('sat', line, scenario['sats']):
-                return False
-
-        elif "user" in line:
-            # Read a user object.
-            if not read_object('user', line, scenario['users']):
-                return False
-
-        else:
-            print("Invalid line! " + line)
-            return False
-
+    arrays = load_scenario_arrays(filename, use_cache)
+    if arrays is None:
+        return False
+    arrays.fill_scenario(scenario, Vector3)
     return True
 
 #%% Calculate Angle and Distance
@@ -151,6 +129,9 @@ def calculate_distance(point_a: Vector3, point_b: Vector3) -> float:
 
 #%% Check Constraints
 
+# The checks below are thin wrappers over validator.py, which does the
+# actual work with batched array math and is shared with evaluate..py.
+
 def check_self_interference(scenario: dict, solution: dict) -> bool:
     """
     Given the scenario and the proposed solution, calculate whether any sat has
@@ -158,41 +139,8 @@ def check_self_interference(scenario: dict, solution: dict) -> bool:
 
     Returns: Success or failure.
     """
-
-    # print("Checking no sat interferes with itself...")
-
-    for sat in solution:
-        # Grab the list of beams per sat, and the sat's location.
-        beams = solution[sat]
-        keys = list(beams.keys())
-        sat_loc = scenario['sats'][sat]
-        # Iterate over all pairs of beams.
-        for i in range(len(beams)):
-            for j in range(i+1, len(beams)):
-                # Grab the colors of each beam, only check for
-                # self interference if they are the same color.
-                color_a = beams[keys[i]][1]
-                color_b = beams[keys[j]][1]
-                if color_a != color_b:
-                    continue
-
-                # Grab the locations of each user.
-                user_a = beams[keys[i]][0]
-                user_b = beams[keys[j]][0]
-                user_a_loc = scenario['users'][user_a]
-                user_b_loc = scenario['users'][user_b]
-
-                # Calculate angle the sat sees from one user to the other.
-                angle = calculate_angle_degrees(sat_loc, user_a_loc, user_b_loc)
-                if angle < self_interference_max:
-                    # Bail if this pair of beams interfere.
-                    # print(f"\tSat {sat} beams {keys[i]} and {keys[j]} interfere.")
-                    # print(f"\t\tBeam angle: {angle} degrees.")
-                    return False
-
-    # Looks good!
-    # print("\tNo satellite self-interferes.")
-    return True
+    from validator import self_interference_violations
+    return not self_interference_violations(scenario, solution)
 
 
 def check_interferer_interference(scenario: dict, solution: dict) -> bool:
@@ -204,63 +152,19 @@ def check_interferer_interference(scenario: dict, solution: dict) -> bool:
 
     Returns: Success or failure.
     """
-
-    # print("Checking no sat interferes with a non-Starlink satellite...")
-
-    for sat in solution:
-        # Iterate over users, by way of satellites.
-        sat_loc = scenario['sats'][sat]
-        for beam in solution[sat]:
-            user = solution[sat][beam][0]
-            user_loc = scenario['users'][user]
-            # Iterate over the non-Starlink satellites.
-            for interferer in scenario['interferers']:
-                interferer_loc = scenario['interferers'][interferer]
-
-                # Calculate the angle the user sees from the Starlink to the not-Starlink.
-                angle = calculate_angle_degrees(user_loc, sat_loc, interferer_loc)
-
-                if angle < non_starlink_interference_max:
-                    # Bail if this link is within the interference threshold.
-                    # print(f"\tSat {sat} beam {beam} interferes with non-Starlink sat {interferer}.")
-                    # print(f"\t\tAngle of separation: {angle} degrees.")
-                    return False
-
-    # Looks good!
-    # print("\tNo satellite interferes with a non-Starlink satellite!")
-    return True
+    from validator import interferer_violations
+    return not interferer_violations(scenario, solution)
 
 
 def check_user_coverage(scenario: dict, solution: dict) -> bool:
     """
-    Given the scenario and the proposed solution, percentage of users covered
-    and verify each covered user is only covered once.
+    Given the scenario and the proposed solution, verify each covered user is
+    only covered once.
 
     Returns: Success or failure.
     """
-
-    # print("Checking user coverage...")
-
-    # Build list of covered users.
-    covered_users = []
-
-    for sat in solution:
-        for beam in solution[sat]:
-            user  = solution[sat][beam][0]
-
-            # Bail if the user is already covered elsewhere.
-            if user in covered_users:
-                # print(f"\tUser {user} is covered multiple times by solution!")
-                return False
-
-            # Otherwise mark the user as covered.
-            covered_users.append(user)
-
-    # Report how many users were covered.
-    total_users_count = len(scenario['users'])
-    covered_users_count = len(covered_users)
-    # print(f"{(covered_users_count / total_users_count) * 100}% of {total_users_count} total users covered.")
-    return True
+    from validator import coverage_violations
+    return not coverage_violations(scenario, solution)
 
 
 def check_user_visibility(scenario: dict, solution: dict) -> bool:
@@ -270,48 +174,25 @@ def check_user_visibility(scenario: dict, solution: dict) -> bool:
 
     Returns: Success or failure.
     """
-
-    # print("Checking each user can see their assigned satellite...")
-
-    for sat in solution:
-        for beam in solution[sat]:
-            user = solution[sat][beam][0]
-
-            # Grab the user and sat's position.
-            user_pos = scenario['users'][user]
-            sat_pos = scenario['sats'][sat]
-
-            # Get the angle, relative to the user, between the sat and the
-            # center of the earth.
-            angle = calculate_angle_degrees(user_pos, origin, sat_pos)
-
-            # User terminals are unable to form beams too far off of from vertical.
-            if angle <= (180.0-max_user_visible_angle):
-
-                # Elevation is relative to horizon, so subtract 90 degrees
-                # to convert from origin-user-sat angle to horizon-user-sat angle.
-                elevation = str(angle - 90)
-                # print(f"\tSat {sat} outside of user {user}'s field of view.")
-                # print(f"\t\t{elevation} degrees elevation.")
-                # print(f"\t\t(Min: {90-max_user_visible_angle} degrees elevation.)")
-
-                return False
-
-    # Looks good!
-    # print("\tAll users' assigned satellites are visible.")
-    return True
+    from validator import visibility_violations
+    return not visibility_violations(scenario, solution)
 
 
 # Check constraints
 
 def check_all_constraints(scenario: dict, solution: dict) -> bool:
-    if not check_user_coverage(scenario, solution):
+    from validator import SolutionLinks, coverage_violations, visibility_violations, \
+        self_interference_violations, interferer_violations
+
+    # Flatten the solution once and share it between the checks.
+    links = SolutionLinks(scenario, solution)
+    if coverage_violations(scenario, links):
         return False
-    if not check_user_visibility(scenario, solution):
+    if visibility_violations(scenario, links):
         return False
-    if not check_self_interference(scenario, solution):
+    if self_interference_violations(scenario, links):
         return False
-    if not check_interferer_interference(scenario, solution):
+    if interferer_violations(scenario, links):
         # print("Solution contained a beam that could interfere with a non-Starlink satellite.")
         return False
     # print("\nSolution passed all checks!\n")
@@ -327,15 +208,15 @@ def cal_coverage_rate(scenario: dict, solution: dict) -> float:
 
     Returns: Coverage rate
     """
-    # Build list of covered users.
-    covered_users = []
+    # Build set of covered users.
+    covered_users = set()
 
     for sat in solution:
         for beam in solution[sat]:
             user  = solution[sat][beam][0]
             if user in covered_users:
                 print("Already covered ! ", user)
-            covered_users.append(user)
+            covered_users.add(user)
 
     # Report how many users were covered.
     total_users_count = len(scenario['users'])
@@ -343,71 +224,115 @@ def cal_coverage_rate(scenario: dict, solution: dict) -> float:
     coverage_rate = covered_users_count / total_users_count
     return coverage_rate
 
-def beam_planning(scenario: dict, usr_list: list, sat_list: list):
-    solution = {}
-    color = valid_color_ids
-    usr_planning_list = copy.deepcopy(usr_list)
-    
+def beam_planning(scenario: dict, usr_list: list, sat_list: list, plan=None, writer=None):
+    """
+    Greedily fills each sat in sat_list with users from usr_list, in order.
+
+    Each sat only considers the users it can see, and each tentative beam is
+    checked incrementally against the beams already on that sat rather than
+    re-validating the whole plan. Colors are picked per sat by graph coloring
+    the sat's users, rather than handed out round-robin.
+
+    plan is an empty feasibility.PlanState to fill; pass one to reuse its
+    precomputed geometry across calls. Each sat's beams are final once the
+    sat has been filled, so if a solution_writer.SolutionWriter is given they
+    are streamed to it as planning goes.
+
+    Returns: solution, coverage rate
+    """
+    if plan is None:
+        from feasibility import PlanState
+        plan = PlanState(scenario)
+    # Only users in usr_list are planned, in usr_list order.
+    usr_rank = {user: i for i, user in enumerate(usr_list)}
+
     for sat_id in sat_list:
-        beam_id = 1
-        beam_dict = {}
-        i = 0
-        while i < len(usr_planning_list):
-            color_id = color[beam_id % 4]
-            beam_dict[beam_id] = (usr_planning_list[i], color_id)
-            solution[sat_id] = beam_dict
-
-            if (check_all_constraints(scenario, solution)):
-                beam_id = beam_id + 1
-                usr_planning_list.remove(usr_planning_list[i])
-                if (beam_id > beams_per_satellite):
-                    break
-            else:
-                solution[sat_id].pop(beam_id)
-    coverage_rate = cal_coverage_rate(scenario, solution)
+        sat_state = plan.sat_state(sat_id)
+        # Only consider the users this sat can actually serve.
+        candidates = [user for user in plan.candidate_users(sat_id) if user in usr_rank]
+        candidates.sort(key=usr_rank.__getitem__)
+        for user in candidates:
+            if user in plan.covered_users:
+                continue
+            if plan.try_assign(user, sat_id) is not None and sat_state.is_full():
+                break
+        if writer is not None and sat_state.beams:
+            writer.write_sat(sat_id, sat_state.beams)
+    solution = plan.solution()
+    coverage_rate = plan.coverage_rate()
     return solution, coverage_rate
 
-def planning_optimizer(scenario: dict):
-    usr_list = [keys for keys in scenario['users']]
-    sat_list = [keys for keys in scenario['sats']]
-    opti_iter_times = 1
-    best_solution = {}
-    best_coverage_rate = 0
-
-    for i in range(opti_iter_times):
-        #print("Optimization iterations: ", i)
-        sat_list = random.sample(sat_list, len(sat_list))
-        usr_list = random.sample(usr_list, len(usr_list))
-        solution, coverage_rate = beam_planning(scenario, usr_list, sat_list)
-        #print(f"{(coverage_rate) * 100}% of total users covered.")
-        if coverage_rate > best_coverage_rate:
-            best_solution = {}
-            best_solution = solution
-            best_coverage_rate = coverage_rate
-        #print(f"{(best_coverage_rate) * 100}% of total users covered finally.")
+# Planner modes selectable with --planner.
+planners = ['greedy', 'matching', 'priority', 'exact']
+
+def planning_optimizer(scenario: dict, planner: str = 'greedy', restarts: int = 1,
+                       workers: int = 1, deadline: float = None, seed: int = None,
+                       improve: float = 0.0, partition: bool = False, context=None,
+                       target: int = None):
+    """
+    Plans the scenario with the chosen planner. The greedy planner runs
+    restarts randomized passes, spread over workers processes, and keeps the
+    best; deadline (seconds of wall-clock time) stops new restarts, or
+    bounds the exact planner's whole run, which then reports its proof gap. With
+    partition, the scenario is instead split into regions that are planned
+    separately, on workers processes, and merged; the exact planner's
+    deadline is then split across the regions. The best plan is then
+    improved by local search for improve seconds.
+
+    context is an optimizer.PlanningContext for scenario, built if not given.
+    target is an upper bound on the users covered, e.g. from bounds.py;
+    restarts and local search stop early once the best plan reaches it.
+
+    Returns: best coverage rate, best solution as a compact.BeamTable, which
+    reads like the usual solution[sat_id][beam_id] = (user_id, color_id) dict
+    """
+    from compact import BeamTable
+    from optimizer import PlanningContext, run_restarts
+
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    if context is None:
+        context = PlanningContext(scenario)
+    with instrumentation.phase('plan'):
+        if partition:
+            from partition import partitioned_planning
+            best_solution, best_coverage_rate = partitioned_planning(context, planner, workers, seed, deadline)
+        elif planner == 'matching':
+            from matching import matching_planning
+            best_solution, best_coverage_rate = matching_planning(scenario, context.new_plan())
+        elif planner == 'priority':
+            from priority import priority_planning
+            best_solution, best_coverage_rate = priority_planning(scenario, context.new_plan(), seed)
+        elif planner == 'exact':
+            from exact import exact_planning
+            best_solution, best_coverage_rate, _ = exact_planning(scenario, context.new_plan(), seed, deadline)
+        else:
+            if deadline is not None:
+                deadline = time.monotonic() + deadline
+            best_coverage_rate, best_solution = run_restarts(context, restarts, workers, deadline, seed, target)
+    best_solution = BeamTable.from_solution(context.geometry, best_solution)
+
+    reached = target is not None and round(best_coverage_rate * len(scenario['users'])) >= target
+    if improve > 0 and not reached:
+        from local_search import improve as local_search
+        with instrumentation.phase('improve'):
+            plan = context.new_plan()
+            plan.load_solution(best_solution)
+            for best_coverage_rate in local_search(plan, time.monotonic() + improve, seed):
+                if target is not None and len(plan.covered_users) >= target:
+                    break
+            best_solution = BeamTable.from_plan(plan)
     return best_coverage_rate, best_solution
 
-def output_results(best_solution: dict, filename):
-    for sat_id in best_solution:
-        for beam_id in best_solution[sat_id]:
-            print("sat", sat_id, "beam", beam_id, "user", best_solution[sat_id][beam_id][0], "color", best_solution[sat_id][beam_id][1])
-            with open("solution.txt", "a") as f:
-                f.write("sat"),
-                f.write(" ")
-                f.write(sat_id)
-                f.write(" ")
-                f.write("beam")
-                f.write(" ")
-                f.write(str(beam_id))
-                f.write(" ")
-                f.write("user")
-                f.write(" ")
-                f.write(best_solution[sat_id][beam_id][0])
-                f.write(" ")
-                f.write("color")
-                f.write(" ")
-                f.write(best_solution[sat_id][beam_id][1])
-                f.write("\n")
+def output_results(best_solution: dict, destination: str = '-'):
+    """
+    Writes the solution to destination, a file path or '-' for stdout. A file
+    is replaced as a whole, never appended to.
+    """
+    from solution_writer import SolutionWriter
+
+    with instrumentation.phase('output'), SolutionWriter(destination) as writer:
+        writer.write_solution(best_solution)
     
 
 #%% Main
@@ -422,7 +347,41 @@ def main() -> int:
     # Make sure args are valid.
     argu=argp.ArgumentParser(prog=f"python3.7 {sys.argv[0]}",description='Starlink beam-planning solution')
     argu.add_argument('scenario',metavar='/path/to/scenario.txt',help='Test input scenario.')
+    argu.add_argument('--planner',choices=planners,default='greedy',help='Planning algorithm (default: greedy).')
+    argu.add_argument('--restarts',type=int,default=1,help='Randomized greedy restarts to run (default: 1).')
+    argu.add_argument('--workers',type=int,default=1,help='Processes to spread restarts over (default: 1).')
+    argu.add_argument('--deadline',type=float,default=None,help='Seconds after which no new restart is started, or the exact search stops.')
+    argu.add_argument('--seed',type=int,default=None,help='Seed for the first restart; later ones use seed+1, seed+2, ...')
+    argu.add_argument('--improve',type=float,default=0.0,help='Seconds of local search to run on the best plan (default: 0).')
+    argu.add_argument('--partition',action='store_true',help='Plan separate regions of the scenario independently and merge them.')
+    argu.add_argument('--no-cache',dest='use_cache',action='store_false',help="Don't read or write the scenario's binary cache.")
+    argu.add_argument('--output',default='-',help="Where to write the solution: a file, replaced atomically, or '-' for stdout (default).")
+    argu.add_argument('--stream',action='store_true',help='Run a single greedy pass, writing each sat\'s beams as soon as it is planned.')
+    argu.add_argument('--compare',action='store_true',help='Also run one greedy pass with the same seed and report how the chosen planner compares with it.')
+    argu.add_argument('--bound',action='store_true',help='Work out an upper bound on coverage first, stop restarts and local search once it is reached, and report the gap to it.')
+    argu.add_argument('--stats',nargs='?',const='-',default=None,help="Record phase times and constraint-check counts and write them as JSON to this file, or stderr if none is given.")
+    argu.add_argument('--profile',choices=['cprofile','sample'],default=None,help='Profile the run and add the hottest functions to the --stats summary.')
     argup=argu.parse_args()
+
+    if argup.stats is not None or argup.profile is not None:
+        instrumentation.enable()
+        instrumentation.reset()
+    if argup.profile is not None:
+        instrumentation.start_profile(argup.profile)
+    try:
+        return run(argup)
+    finally:
+        if instrumentation.enabled:
+            profile = instrumentation.stop_profile()
+            instrumentation.write_summary(argup.stats if argup.stats is not None else '-', profile)
+
+
+def run(argup) -> int:
+    """
+    Plans the scenario named on the command line and writes the solution.
+
+    Returns: exit code.
+    """
     
     #path = r'C:\Users\liaowenjun\Desktop\starlink\beam-planning\test_cases\\'
     filename = argup.scenario
@@ -430,11 +389,48 @@ def main() -> int:
     scenario = {}
     # solution format: solution[sat_id][beam_id] = (user_id, color_id)
        
-    read_scenario(filename, scenario)
+    with instrumentation.phase('read'):
+        if not read_scenario(filename, scenario, argup.use_cache):
+            return -1
+
+    if argup.stream:
+        from solution_writer import SolutionWriter
+        rng = random.Random(argup.seed)
+        with instrumentation.phase('plan'), SolutionWriter(argup.output) as writer:
+            beam_planning(scenario, rng.sample(list(scenario['users']), len(scenario['users'])),
+                          rng.sample(list(scenario['sats']), len(scenario['sats'])), writer=writer)
+        return 0
      
-    best_coverage_rate, best_solution = planning_optimizer(scenario)
+    from optimizer import PlanningContext
+    context, bound = PlanningContext(scenario), None
+    if argup.bound:
+        from bounds import coverage_bound
+        with instrumentation.phase('bound'):
+            bound = coverage_bound(context)
+
+    best_coverage_rate, best_solution = planning_optimizer(scenario, argup.planner, argup.restarts,
+                                                           argup.workers, argup.deadline, argup.seed,
+                                                           argup.improve, argup.partition, context,
+                                                           bound.users if bound is not None else None)
+    if bound is not None:
+        print(f"{bound.describe()}; gap {bound.gap(best_coverage_rate) * 100:.2f}% "
+              f"({bound.users - round(best_coverage_rate * bound.n_users)} users)", file=sys.stderr)
+
+    if argup.compare and argup.planner != 'greedy':
+        # Report how the chosen planner compares with a greedy pass. Only the
+        # pass's time is recorded, so its checks don't mix into the stats.
+        recording = instrumentation.enabled
+        with instrumentation.phase('compare'):
+            instrumentation.enable(False)
+            try:
+                greedy_coverage_rate, _ = planning_optimizer(scenario, 'greedy', seed=argup.seed, context=context)
+            finally:
+                instrumentation.enable(recording)
+        print(f"{argup.planner}: {best_coverage_rate * 100:.2f}% of {len(scenario['users'])} users covered "
+              f"(greedy: {greedy_coverage_rate * 100:.2f}%)", file=sys.stderr)
               
-    output_results(best_solution, filename)
+    output_results(best_solution, argup.output)
+    return 0
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+import sys, os, glob, csv, json, time, queue
+import multiprocessing as mp
+import argparse as argp
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then left out.
+    resource = None
+
+import beamplanning as bp
+import instrumentation
+from validator import find_violations
+
+#%% Parameters
+
+# Scenarios benchmarked when none are given.
+default_scenarios = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases', '*.txt')
+
+# Seed every planner run starts from, so runs are repeatable.
+default_seed = 0
+
+# Relative slowdown in planning throughput (users per second) flagged as a regression.
+default_time_tolerance = 0.25
+
+# Drop in coverage rate flagged as a regression.
+default_coverage_tolerance = 0.0
+
+# Columns of the CSV report, in order.
+report_columns = ['scenario', 'users', 'sats', 'interferers', 'read_s', 'plan_s', 'validate_s', 'wall_s',
+                  'users_per_s', 'peak_rss_kb', 'link_accepted', 'link_rejected', 'color_accepted',
+                  'color_rejected', 'recolor_accepted', 'recolor_rejected', 'coverage', 'valid', 'violations']
+
+#%% Running one scenario
+
+def peak_rss_kb():
+    """
+    Returns: the peak resident set size of this process and its finished
+    children, in KB, or None where the resource module is missing. It
+    includes the interpreter and the modules imported, about 30 MB.
+    """
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS, KB elsewhere.
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def benchmark_scenario(filename: str, settings: dict) -> dict:
+    """
+    Reads, plans and validates one scenario with the given planner settings.
+
+    Returns: a dict with one value per report column, or None if the scenario can't be read.
+    """
+    instrumentation.enable()
+    instrumentation.reset()
+    start = time.perf_counter()
+    scenario = {}
+    if not bp.read_scenario(filename, scenario, settings['use_cache']):
+        return None
+    read_done = time.perf_counter()
+    coverage, solution = bp.planning_optimizer(scenario, settings['planner'], settings['restarts'], 1,
+                                               None, settings['seed'], settings['improve'],
+                                               settings['partition'])
+    plan_done = time.perf_counter()
+    violations = find_violations(scenario, solution)
+    validate_done = time.perf_counter()
+
+    plan_s = plan_done - read_done
+    counts = {name: instrumentation.checks.get(name, [0, 0]) for name in ['link', 'color', 'recolor']}
+    return {
+        'scenario': os.path.basename(filename),
+        'users': len(scenario['users']),
+        'sats': len(scenario['sats']),
+        'interferers': len(scenario['interferers']),
+        'read_s': read_done - start,
+        'plan_s': plan_s,
+        'validate_s': validate_done - plan_done,
+        'wall_s': validate_done - start,
+        'users_per_s': len(scenario['users']) / plan_s if plan_s > 0 else None,
+        'peak_rss_kb': peak_rss_kb(),
+        'link_accepted': counts['link'][0],
+        'link_rejected': counts['link'][1],
+        'color_accepted': counts['color'][0],
+        'color_rejected': counts['color'][1],
+        'recolor_accepted': counts['recolor'][0],
+        'recolor_rejected': counts['recolor'][1],
+        'coverage': coverage,
+        'valid': not violations,
+        'violations': len(violations),
+    }
+
+
+def scenario_worker(filename: str, settings: dict, results):
+    result = None
+    try:
+        result = benchmark_scenario(filename, settings)
+    finally:
+        results.put(result)
+
+
+def run_isolated(filename: str, settings: dict) -> dict:
+    """
+    Benchmarks one scenario in a fresh process, so each scenario's peak RSS
+    and check counts are its own. The process is spawned, not forked: a
+    forked child's peak RSS would count the pages it shares with this one.
+
+    Returns: the benchmark_scenario result, or None on failure.
+    """
+    context = mp.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=scenario_worker, args=(filename, settings, results))
+    process.start()
+    result = None
+    while True:
+        try:
+            result = results.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                # Killed before reporting back, e.g. out of memory.
+                break
+    process.join()
+    return result
+
+#%% Reports
+
+def write_json(path: str, settings: dict, rows: list):
+    with open(path, 'w') as f:
+        json.dump({'settings': settings, 'results': rows}, f, indent=2)
+        f.write('\n')
+
+
+def write_csv(path: str, rows: list):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=report_columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_table(rows: list):
+    print(f"{'scenario':40s} {'users':>6s} {'plan s':>8s} {'users/s':>9s} {'rss MB':>7s} "
+          f"{'checks':>9s} {'coverage':>8s} valid")
+    for row in rows:
+        rss = f"{row['peak_rss_kb'] / 1024:7.1f}" if row['peak_rss_kb'] is not None else f"{'-':>7s}"
+        checks = row['link_accepted'] + row['link_rejected'] + row['color_accepted'] + row['color_rejected']
+        rate = f"{row['users_per_s']:9.0f}" if row['users_per_s'] is not None else f"{'-':>9s}"
+        print(f"{row['scenario']:40s} {row['users']:6d} {row['plan_s']:8.3f} {rate} {rss} "
+              f"{checks:9d} {row['coverage']:8.4f} {row['valid']}")
+
+
+def compare_to_baseline(rows: list, baseline: dict, time_tolerance: float, coverage_tolerance: float) -> list:
+    """
+    Compares rows against a saved JSON report, scenario by scenario; scenarios
+    only in one of them are skipped.
+
+    Returns: one message per regression: an invalid plan,
+    coverage lower by more than coverage_tolerance, or users/s lower by more
+    than time_tolerance (a fraction of the baseline).
+    """
+    before = {row['scenario']: row for row in baseline['results']}
+    regressions = []
+    for row in rows:
+        old = before.get(row['scenario'])
+        if old is None:
+            continue
+        name = row['scenario']
+        if not row['valid'] and old['valid']:
+            regressions.append(f"{name}: plan is no longer valid ({row['violations']} violations)")
+        if row['coverage'] < old['coverage'] - coverage_tolerance:
+            regressions.append(f"{name}: coverage {old['coverage']:.4f} -> {row['coverage']:.4f}")
+        if old['users_per_s'] and row['users_per_s'] is not None \
+                and row['users_per_s'] < old['users_per_s'] * (1 - time_tolerance):
+            regressions.append(f"{name}: throughput {old['users_per_s']:.0f} -> {row['users_per_s']:.0f} users/s")
+    return regressions
+
+#%% Main
+
+def main() -> int:
+    """
+    Entry point. Benchmarks the planner over a set of scenarios, writes the
+    reports and optionally compares them with a baseline.
+
+    Returns: exit code, 1 if a regression or invalid plan was found.
+    """
+    argu = argp.ArgumentParser(prog=f"python3.7 {sys.argv[0]}", description='Starlink beam-planning benchmark')
+    argu.add_argument('scenarios', nargs='*', metavar='/path/to/scenario.txt',
+                      help='Scenarios to benchmark (default: test_cases/*.txt).')
+    argu.add_argument('--planner', choices=bp.planners, default='greedy', help='Planning algorithm (default: greedy).')
+    argu.add_argument('--restarts', type=int, default=1, help='Randomized greedy restarts per scenario (default: 1).')
+    argu.add_argument('--seed', type=int, default=default_seed, help=f'Planner seed (default: {default_seed}).')
+    argu.add_argument('--improve', type=float, default=0.0, help='Seconds of local search per scenario (default: 0).')
+    argu.add_argument('--partition', action='store_true', help='Plan separate regions independently and merge them.')
+    argu.add_argument('--no-cache', dest='use_cache', action='store_false', help="Don't use scenario binary caches.")
+    argu.add_argument('--json', help='Write the report as JSON to this file.')
+    argu.add_argument('--csv', help='Write the report as CSV to this file.')
+    argu.add_argument('--compare', metavar='BASELINE.json', help='Flag regressions against a saved JSON report.')
+    argu.add_argument('--time-tolerance', type=float, default=default_time_tolerance,
+                      help=f'Allowed throughput drop, as a fraction (default: {default_time_tolerance}).')
+    argu.add_argument('--coverage-tolerance', type=float, default=default_coverage_tolerance,
+                      help=f'Allowed coverage drop (default: {default_coverage_tolerance}).')
+    argup = argu.parse_args()
+
+    filenames = argup.scenarios or sorted(glob.glob(default_scenarios))
+    settings = {'planner': argup.planner, 'restarts': argup.restarts, 'seed': argup.seed,
+                'improve': argup.improve, 'partition': argup.partition, 'use_cache': argup.use_cache}
+
+    rows = []
+    failed = False
+    for filename in filenames:
+        row = run_isolated(filename, settings)
+        if row is None:
+            print(f"{filename}: failed", file=sys.stderr)
+            failed = True
+            continue
+        failed = failed or not row['valid']
+        rows.append(row)
+    print_table(rows)
+
+    if argup.json:
+        write_json(argup.json, settings, rows)
+    if argup.csv:
+        write_csv(argup.csv, rows)
+
+    if argup.compare:
+        with open(argup.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(rows, baseline, argup.time_tolerance, argup.coverage_tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if not regressions:
+            print(f"No regressions against {argup.compare}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import sys, time
+import argparse as argp
+
+import numpy as np
+
+import beamplanning as bp
+from beamplanning import beams_per_satellite, valid_color_ids
+from geometry import cos_self_interference_max, cos_margin
+from matching import FlowNetwork
+
+#%% Clique cover
+
+def conflict_cliques(directions: np.ndarray) -> list:
+    """
+    Greedily covers a sat's users with cliques of the 10 degree conflict
+    graph: sets of users pointed pairwise within self_interference_max of
+    each other, as seen from the sat. A pair only counts as conflicting when
+    it's clearly inside the limit, so the cliques are safe to bound with.
+
+    Returns: lists of indexes into directions, one per clique of more than
+    len(valid_color_ids) users; at most that many of each can share the sat.
+    """
+    n_colors = len(valid_color_ids)
+    if len(directions) <= n_colors:
+        return []
+    conflicts = directions @ directions.T > cos_self_interference_max + cos_margin
+    degree = conflicts.sum(axis=1) - 1
+    if degree.max() < n_colors:
+        return []
+    free = np.ones(len(directions), dtype=bool)
+    cliques = []
+    for user in np.argsort(-degree, kind='stable').tolist():
+        if not free[user] or degree[user] < n_colors:
+            continue
+        clique = [user]
+        members = conflicts[user].copy()
+        candidates = np.flatnonzero(members & free)
+        for other in candidates[np.argsort(-degree[candidates], kind='stable')].tolist():
+            if other != user and members[other]:
+                clique.append(other)
+                members &= conflicts[other]
+        if len(clique) > n_colors:
+            free[clique] = False
+            cliques.append(clique)
+    return cliques
+
+#%% Bounds
+
+class CoverageBound:
+    """
+    Upper bounds on how many users any valid plan can cover:
+
+      capacity: users with a link, capped by the sats with a link times
+                beams_per_satellite.
+      flow:     the max-flow assignment of users to the sats they can see,
+                beams_per_satellite per sat, ignoring colors.
+      color:    the same max flow, with each sat's conflict cliques also
+                limited to one user per color.
+
+    Each is at least as tight as the one before it.
+    """
+
+    def __init__(self, n_users: int):
+        self.n_users = n_users
+        self.capacity = n_users
+        self.flow = n_users
+        self.color = n_users
+        self.elapsed_s = 0.0
+
+    @property
+    def users(self) -> int:
+        return min(self.capacity, self.flow, self.color)
+
+    @property
+    def rate(self) -> float:
+        return self.users / self.n_users if self.n_users else 0.0
+
+    def gap(self, coverage_rate: float) -> float:
+        """
+        Returns: how far coverage_rate is below the bound, as a rate.
+        """
+        return max(0.0, self.rate - coverage_rate)
+
+    def reached(self, coverage_rate: float) -> bool:
+        return round(coverage_rate * self.n_users) >= self.users
+
+    def describe(self) -> str:
+        return (f"bound {self.users} users ({self.rate * 100:.2f}%): capacity {self.capacity}, "
+                f"flow {self.flow}, color {self.color}")
+
+
+def link_flow(visibility, n_users: int, n_sats: int, cliques: dict = None) -> int:
+    """
+    Returns: the max flow from users through the sats they can see, each sat
+    taking beams_per_satellite. With cliques[sat] = lists of user rows, each
+    of those cliques also passes at most len(valid_color_ids) users to its sat.
+    """
+    cliques = cliques or {}
+    n_groups = sum(len(groups) for groups in cliques.values())
+    source = n_users + n_sats + n_groups
+    sink = source + 1
+    network = FlowNetwork(sink + 1)
+    grouped = {}
+    group = n_users + n_sats
+    for sat, groups in cliques.items():
+        for members in groups:
+            network.add_edge(group, n_users + sat, len(valid_color_ids))
+            for user in members:
+                grouped[user, sat] = group
+            group += 1
+    for user in range(n_users):
+        sats = visibility.sats_for_user(user).tolist()
+        if not sats:
+            continue
+        network.add_edge(source, user, 1)
+        for sat in sats:
+            network.add_edge(user, grouped.get((user, sat), n_users + sat), 1)
+    for sat in range(n_sats):
+        if len(visibility.users_for_sat(sat)):
+            network.add_edge(n_users + sat, sink, beams_per_satellite)
+    return network.max_flow(source, sink)
+
+
+def coverage_bound(context, flow: bool = True) -> CoverageBound:
+    """
+    Bounds the coverage of context's scenario, an optimizer.PlanningContext.
+    Without flow, only the capacity bound is worked out.
+
+    Returns: a CoverageBound.
+    """
+    start = time.perf_counter()
+    geometry = context.geometry
+    visibility = context.visibility
+    n_users = len(geometry.user_ids)
+    n_sats = len(geometry.sat_ids)
+    bound = CoverageBound(n_users)
+
+    linked_users = sum(1 for user in range(n_users) if len(visibility.sats_for_user(user)))
+    linked_sats = sum(1 for sat in range(n_sats) if len(visibility.users_for_sat(sat)))
+    bound.capacity = min(linked_users, linked_sats * beams_per_satellite)
+
+    if flow and bound.capacity:
+        bound.flow = link_flow(visibility, n_users, n_sats)
+        cliques = {}
+        for sat in range(n_sats):
+            users = visibility.users_for_sat(sat)
+            groups = conflict_cliques(geometry.sat_user_directions(sat, users))
+            if groups:
+                cliques[sat] = [users[members].tolist() for members in groups]
+        bound.color = link_flow(visibility, n_users, n_sats, cliques) if cliques else bound.flow
+    elif not bound.capacity:
+        bound.flow = bound.color = 0
+    bound.elapsed_s = time.perf_counter() - start
+    return bound
+
+#%% Main
+
+def main() -> int:
+    """
+    Entry point. Prints the coverage bounds of a scenario.
+
+    Returns: exit code.
+    """
+    from optimizer import PlanningContext
+
+    argu = argp.ArgumentParser(prog=f"python3.7 {sys.argv[0]}", description='Starlink beam-planning coverage bounds')
+    argu.add_argument('scenario', metavar='/path/to/scenario.txt', help='Test input scenario.')
+    argu.add_argument('--no-cache', dest='use_cache', action='store_false', help="Don't use the scenario binary cache.")
+    argup = argu.parse_args()
+
+    scenario = {}
+    if not bp.read_scenario(argup.scenario, scenario, argup.use_cache):
+        return -1
+    bound = coverage_bound(PlanningContext(scenario))
+    print(f"{bound.describe()}, of {bound.n_users} users, in {bound.elapsed_s:.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
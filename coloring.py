@@ -0,0 +1,82 @@
+import numpy as np
+
+from geometry import cos_self_interference_max, cos_margin
+
+#%% Parameters
+
+# Most search steps the backtracking colorer takes before giving up on a sat.
+max_coloring_steps = 2000
+
+#%% Conflict graph
+
+def conflict_graph(directions) -> list:
+    """
+    Given unit vectors from a sat towards each of its users, returns: the
+    adjacency sets of the graph linking users within self_interference_max of
+    each other, as seen from that sat.
+    """
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    conflicts = directions @ directions.T > cos_self_interference_max - cos_margin
+    np.fill_diagonal(conflicts, False)
+    return [set(np.flatnonzero(row).tolist()) for row in conflicts]
+
+#%% DSatur coloring
+
+def dsatur_coloring(adjacency: list, n_colors: int, max_steps: int = max_coloring_steps):
+    """
+    Colors the graph with at most n_colors colors, so no two adjacent vertices
+    share one.
+
+    Vertices are picked DSatur-style (most distinct neighbor colors first,
+    then most uncolored neighbors), and the search backtracks when a vertex
+    has no color left. A new color is only ever opened one past the highest
+    used so far, which skips color-permuted copies of the same coloring.
+
+    Returns: a list of color indices per vertex, or None if no coloring was
+    found within max_steps.
+    """
+    n = len(adjacency)
+    colors = [-1] * n
+    # neighbor_colors[v][c] = how many neighbors of v have color c.
+    neighbor_colors = [[0] * n_colors for _ in range(n)]
+    steps = [0]
+
+    def pick_vertex() -> int:
+        best = -1
+        best_key = None
+        for v in range(n):
+            if colors[v] >= 0:
+                continue
+            saturation = sum(1 for c in neighbor_colors[v] if c)
+            degree = sum(1 for w in adjacency[v] if colors[w] < 0)
+            key = (saturation, degree)
+            if best_key is None or key > best_key:
+                best, best_key = v, key
+        return best
+
+    def set_color(v: int, c: int, delta: int):
+        colors[v] = c if delta > 0 else -1
+        for w in adjacency[v]:
+            neighbor_colors[w][c] += delta
+
+    def search(colored: int, used: int) -> bool:
+        if colored == n:
+            return True
+        steps[0] += 1
+        if steps[0] > max_steps:
+            return False
+        v = pick_vertex()
+        for c in range(min(used + 1, n_colors)):
+            if neighbor_colors[v][c]:
+                continue
+            set_color(v, c, 1)
+            if search(colored + 1, max(used, c + 1)):
+                return True
+            set_color(v, c, -1)
+            if steps[0] > max_steps:
+                return False
+        return False
+
+    if search(0, 0):
+        return colors
+    return None
@@ -0,0 +1,127 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+from beamplanning import beams_per_satellite, valid_color_ids
+
+#%% Parameters
+
+# Marks a free beam in a BeamTable.
+no_user = -1
+
+# Color index of each color id.
+color_index = {color_id: i for i, color_id in enumerate(valid_color_ids)}
+
+#%% Beam tables
+
+class BeamTable(Mapping):
+    """
+    A solution held as fixed-size per-sat beam tables over the geometry's
+    interned rows:
+
+      users[sat, beam - 1]:  row of the user beam serves on sat row, or no_user.
+      colors[sat, beam - 1]: index of the beam's color in valid_color_ids.
+
+    It reads like the usual solution[sat_id][beam_id] = (user_id, color_id)
+    dict, building each sat's small dict on demand, so string ids only
+    appear when a solution is looked at or written out.
+
+    Pickling leaves the geometry out, so tables are cheap to send between
+    processes; bind() the receiving side's geometry before reading one.
+    """
+
+    def __init__(self, geometry, users: np.ndarray = None, colors: np.ndarray = None):
+        self.geometry = geometry
+        n_sats = len(geometry.sat_ids)
+        self.users = users if users is not None else np.full((n_sats, beams_per_satellite), no_user, dtype=np.int32)
+        self.colors = colors if colors is not None else np.zeros((n_sats, beams_per_satellite), dtype=np.int8)
+
+    @classmethod
+    def from_plan(cls, plan) -> 'BeamTable':
+        """
+        Returns: the beams of a feasibility.PlanState as a table.
+        """
+        table = cls(plan.geometry)
+        sat_index, user_index = plan.geometry.sat_index, plan.geometry.user_index
+        for sat_id, state in plan.sat_states.items():
+            row = sat_index[sat_id]
+            for beam_id, (user, color_id) in state.beams.items():
+                table.users[row, beam_id - 1] = user_index[user]
+                table.colors[row, beam_id - 1] = color_index[color_id]
+        return table
+
+    @classmethod
+    def from_solution(cls, geometry, solution) -> 'BeamTable':
+        """
+        Returns: a solution[sat_id][beam_id] = (user_id, color_id) mapping as
+        a table. Raises ValueError for a beam id outside valid_beam_ids.
+        """
+        if isinstance(solution, BeamTable):
+            return solution
+        table = cls(geometry)
+        sat_index, user_index = geometry.sat_index, geometry.user_index
+        for sat_id, beams in solution.items():
+            row = sat_index[sat_id]
+            for beam_id, (user, color_id) in beams.items():
+                beam = int(beam_id)
+                if not 1 <= beam <= beams_per_satellite:
+                    raise ValueError(f"sat {sat_id} has invalid beam id {beam_id}")
+                table.users[row, beam - 1] = user_index[user]
+                table.colors[row, beam - 1] = color_index[color_id]
+        return table
+
+    def bind(self, geometry) -> 'BeamTable':
+        self.geometry = geometry
+        return self
+
+    def __getstate__(self):
+        return {'users': self.users, 'colors': self.colors}
+
+    def __setstate__(self, state):
+        self.geometry = None
+        self.users = state['users']
+        self.colors = state['colors']
+
+    #%% Array views
+
+    def sat_rows(self) -> np.ndarray:
+        """
+        Returns: the rows of the sats with at least one beam, ascending.
+        """
+        return np.flatnonzero((self.users != no_user).any(axis=1))
+
+    def links(self):
+        """
+        Returns: matching sat row, beam id, user row and color index arrays,
+        one entry per beam, sat by sat and in beam order within each sat.
+        """
+        sats, beams = np.nonzero(self.users != no_user)
+        return sats, beams + 1, self.users[sats, beams], self.colors[sats, beams]
+
+    def beam_count(self) -> int:
+        return int(np.count_nonzero(self.users != no_user))
+
+    def covered_rows(self) -> np.ndarray:
+        """
+        Returns: the rows of the users with a beam, each once.
+        """
+        return np.unique(self.users[self.users != no_user])
+
+    #%% Mapping interface
+
+    def __getitem__(self, sat_id: str) -> dict:
+        row = self.geometry.sat_index[sat_id]
+        beams = np.flatnonzero(self.users[row] != no_user)
+        if len(beams) == 0:
+            raise KeyError(sat_id)
+        user_ids = self.geometry.user_ids
+        return {beam + 1: (user_ids[user], valid_color_ids[color])
+                for beam, user, color in zip(beams.tolist(), self.users[row, beams].tolist(),
+                                             self.colors[row, beams].tolist())}
+
+    def __iter__(self):
+        sat_ids = self.geometry.sat_ids
+        return (sat_ids[row] for row in self.sat_rows().tolist())
+
+    def __len__(self) -> int:
+        return len(self.sat_rows())
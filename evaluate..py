@@ -18,6 +18,7 @@ A=print
 import argparse as U,sys
 from collections import namedtuple as D
 from math import sqrt as N,acos,degrees as V,floor
+from validator import SolutionLinks as VL,coverage_violations as cv,visibility_violations as vv,self_interference_violations as sv,interferer_violations as iv,find_violations as fv,format_violation as fm,StreamingValidator as SV
 C=D('Vector3',['x','y','z'])
 W=C(0,0,0)
 X=32
@@ -32,62 +33,27 @@ def J(vertex,point_a,point_b):
 	if abs(M-L)>1e-06:A(f"dot_product: {L} bounded to {M}")
 	return V(acos(M))
 def d(scenario,solution):
-	O=solution;L=scenario;A('Checking no sat interferes with itself...')
-	for M in O:
-		C=O[M];D=list(C.keys());Q=L[H][M]
-		for I in K(F(C)):
-			for N in K(I+1,F(C)):
-				R=C[D[I]][1];S=C[D[N]][1]
-				if R!=S:continue
-				T=C[D[I]][0];U=C[D[N]][0];V=L[E][T];W=L[E][U];P=J(Q,V,W)
-				if P<b:A(f"\tSat {M} beams {D[I]} and {D[N]} interfere.");A(f"\t\tBeam angle: {P} degrees.");return B
+	A('Checking no sat interferes with itself...');C=sv(scenario,solution)
+	if C:_,M,I,_,N,P=C[0];A(f"\tSat {M} beams {I} and {N} interfere.");A(f"\t\tBeam angle: {P} degrees.");return B
 	A('\tNo satellite self-interferes.');return G
 def e(scenario,solution):
-	F=solution;C=scenario;A('Checking no sat interferes with a non-Starlink satellite...')
-	for D in F:
-		N=C[H][D]
-		for I in F[D]:
-			O=F[D][I][0];P=C[E][O]
-			for K in C[L]:
-				Q=C[L][K];M=J(P,N,Q)
-				if M<c:A(f"\tSat {D} beam {I} interferes with non-Starlink sat {K}.");A(f"\t\tAngle of separation: {M} degrees.");return B
+	A('Checking no sat interferes with a non-Starlink satellite...');C=iv(scenario,solution)
+	if C:_,D,I,_,K,M=C[0];A(f"\tSat {D} beam {I} interferes with non-Starlink sat {K}.");A(f"\t\tAngle of separation: {M} degrees.");return B
 	A('\tNo satellite interferes with a non-Starlink satellite!');return G
 def f(scenario,solution):
-	C=solution;A('Checking user coverage...');D=[]
-	for I in C:
-		for K in C[I]:
-			H=C[I][K][0]
-			if H in D:A(f"\tUser {H} is covered multiple times by solution!");return B
-			D.append(H)
-	J=F(scenario[E]);L=F(D);A(f"{L/J*100}% of {J} total users covered.");return G
+	A('Checking user coverage...');C=cv(scenario,solution)
+	if C:A(f"\tUser {C[0].user} is covered multiple times by solution!");return B
+	J=F(scenario[E]);L=F(solution.users) if isinstance(solution,VL) else sum(F(solution[D])for D in solution);A(f"{L/J*100}% of {J} total users covered.");return G
 def g(scenario,solution):
-	F=scenario;D=solution;A('Checking each user can see their assigned satellite...')
-	for C in D:
-		for L in D[C]:
-			I=D[C][L][0];M=F[E][I];N=F[H][C];K=J(M,W,N)
-			if K<=180.0-O:P=j(K-90);A(f"\tSat {C} outside of user {I}'s field of view.");A(f"\t\t{P} degrees elevation.");A(f"\t\t(Min: {90-O} degrees elevation.)");return B
+	A('Checking each user can see their assigned satellite...');D=vv(scenario,solution)
+	if D:_,C,_,I,_,K=D[0];P=j(K-90);A(f"\tSat {C} outside of user {I}'s field of view.");A(f"\t\t{P} degrees elevation.");A(f"\t\t(Min: {90-O} degrees elevation.)");return B
 	A("\tAll users' assigned satellites are visible.");return G
-def I(object_type,line,dest):
-	E=line;D=E.split()
-	if D[0]!=object_type or F(D)!=5:A(M+E);return B
-	else:
-		H=D[1]
-		try:I=Q(D[2]);J=Q(D[3]);K=Q(D[4])
-		except:A("Can't parse location! "+E);return B
-		dest[H]=C(I,J,K);return G
-def h(filename,scenario):
-	K='interferer';F=filename;D=scenario;A('Reading scenario file '+F);J=k(F).readlines();D[H]={};D[E]={};D[L]={}
-	for C in J:
-		if l in C:continue
-		elif C.strip()==R:continue
-		elif K in C:
-			if not I(K,C,D[L]):return B
-		elif S in C:
-			if not I(S,C,D[H]):return B
-		elif T in C:
-			if not I(T,C,D[E]):return B
-		else:A(M+C);return B
-	return G
+def h(filename,scenario,use_cache=G):
+	F=filename;D=scenario;A('Reading scenario file '+F)
+	from scenario_loader import load_scenario_arrays as LA
+	N=LA(F,use_cache)
+	if N is None:return B
+	N.fill_scenario(D,C);return G
 def P(filename,scenario,solution):
 	O=scenario;K=filename;J=solution
 	if K==R:A('Reading solution from stdin.');L=sys.stdin
@@ -109,13 +75,34 @@ def P(filename,scenario,solution):
 			J[I][N]=P,Q
 		else:A(M+D);return B
 	L.close();return G
+def s(filename,scenario,report_all):
+	K=filename;D=scenario
+	if K is None:A('Streaming solution from stdin.');L=sys.stdin
+	else:A(f"Streaming solution file {K}.");L=k(K)
+	H=SV(D);I=0
+	try:
+		for C in H.validate(L):
+			A(fm(C));I+=1
+			if C.rule in('format','id','beam')or not report_all:return-1
+	finally:
+		if L is not sys.stdin:L.close()
+	J=F(D[E]);A(f"{H.covered/J*100}% of {J} total users covered.")
+	if I:A(f"\nSolution has {I} violations.\n");return-1
+	A('\nSolution passed all checks!\n');return 0
 def i():
-	D=U.ArgumentParser(prog=f"python3.7 {sys.argv[0]}",description='Starlink beam-planning evaluation tool');D.add_argument('scenario',metavar='/path/to/scenario.txt',help='Test input scenario.');D.add_argument('solution',metavar='/path/to/solution.txt',nargs='?',help='Optional. If not provided, stdin will be read.');E=D.parse_args();B={}
-	if not h(E.scenario,B):return-1
+	D=U.ArgumentParser(prog=f"python3.7 {sys.argv[0]}",description='Starlink beam-planning evaluation tool');D.add_argument('scenario',metavar='/path/to/scenario.txt',help='Test input scenario.');D.add_argument('solution',metavar='/path/to/solution.txt',nargs='?',help='Optional. If not provided, stdin will be read.');D.add_argument('--all',action='store_true',help='Report every violation, with its sat, beam, user and angle, instead of stopping at the first.');D.add_argument('--stream',action='store_true',help='Check the solution line by line as it is read, keeping only per-sat beam tables and a bitset of covered users in memory.');D.add_argument('--no-cache',dest='use_cache',action='store_false',help="Parse the scenario text directly, without the scenario binary cache.");E=D.parse_args();B={}
+	if not h(E.scenario,B,E.use_cache):return-1
+	if E.stream:return s(E.solution,B,E.all)
 	C={}
 	if E.solution is None:
 		if not P(R,B,C):return-1
 	elif not P(E.solution,B,C):return-1
+	C=VL(B,C)
+	if E.all:
+		K=fv(B,C)
+		for H in K:A(fm(H))
+		if K:A(f"\nSolution has {F(K)} violations.\n");return-1
+		A('\nSolution passed all checks!\n');return 0
 	if not f(B,C):return-1
 	if not g(B,C):return-1
 	if not d(B,C):return-1
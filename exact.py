@@ -0,0 +1,324 @@
+import sys, time
+
+from beamplanning import beams_per_satellite, valid_color_ids
+from coloring import conflict_graph
+from feasibility import PlanState
+from partition import connected_components
+
+#%% Parameters
+
+# Most search nodes, over all components, before the search gives up.
+exact_node_limit = 500000
+
+# Seconds the search runs for when no time limit is given.
+exact_time_limit = 60.0
+
+# How often, in nodes, the time limit is checked. Nodes on large components
+# can take milliseconds each, so this stays small.
+time_check_nodes = 16
+
+# Number of colors a mask has set, for every 4-bit mask.
+mask_colors = [bin(mask).count('1') for mask in range(1 << len(valid_color_ids))]
+
+#%% Branch and bound
+
+class ComponentSearch:
+    """
+    Depth-first branch and bound over one connected component of the
+    user/sat visibility graph. Each step takes the live user with the fewest
+    (sat, color) options left and branches on each option, then on leaving
+    the user uncovered.
+
+    - Propagation: placing a user on (sat, color) strikes that color on that
+      sat from every user it conflicts with there, and a full sat from every
+      user; users left with no option stop counting.
+    - Symmetry: colors on a sat are interchangeable, so a sat only ever
+      opens the color one past the highest it already uses.
+    - Bound: users covered so far plus the live users left, capped by the
+      beams still free.
+
+    Every change goes on a trail, so backtracking undoes it exactly.
+    """
+
+    def __init__(self, plan: PlanState, users: list, sats: list):
+        geometry = plan.geometry
+        visibility = plan.visibility
+        self.users = users
+        self.sats = sats
+        local_user = {user: i for i, user in enumerate(users)}
+        local_sat = {sat: i for i, sat in enumerate(sats)}
+        all_colors = (1 << len(valid_color_ids)) - 1
+
+        # dom[u][s] = mask of the colors user u can still take on sat s.
+        self.dom = [{local_sat[sat]: all_colors for sat in visibility.sats_for_user(user).tolist()} for user in users]
+        # conflicts[s][u] = users that can't share a color with u on sat s.
+        self.conflicts = []
+        self.candidates = []
+        for sat in sats:
+            rows = visibility.users_for_sat(sat)
+            adjacency = conflict_graph(geometry.sat_user_directions(sat, rows))
+            members = [local_user[user] for user in rows.tolist()]
+            self.candidates.append(members)
+            self.conflicts.append({members[i]: [members[j] for j in neighbors]
+                                   for i, neighbors in enumerate(adjacency)})
+
+        self.count = [0] * len(sats)
+        self.top = [-1] * len(sats)
+        self.choice = [None] * len(users)
+        self.alive = [bool(options) for options in self.dom]
+        self.n_live = sum(self.alive)
+        self.covered = 0
+        self.free = beams_per_satellite * len(sats)
+        self.trail = []
+
+        self.best = -1
+        self.best_choice = []
+        self.nodes = 0
+        self.stopped = False
+        self.open_bound = 0
+
+    #%% Moves
+
+    def strike(self, u: int, s: int, mask: int):
+        self.trail.append(('dom', u, s, self.dom[u][s]))
+        if mask:
+            self.dom[u][s] = mask
+            return
+        del self.dom[u][s]
+        if not self.dom[u] and self.alive[u] and self.choice[u] is None:
+            self.kill(u)
+
+    def kill(self, u: int):
+        self.trail.append(('alive', u))
+        self.alive[u] = False
+        self.n_live -= 1
+
+    def assign(self, u: int, s: int, c: int):
+        self.trail.append(('assign', u, s, self.top[s]))
+        self.choice[u] = (s, c)
+        self.alive[u] = False
+        self.n_live -= 1
+        self.covered += 1
+        self.count[s] += 1
+        self.free -= 1
+        self.top[s] = max(self.top[s], c)
+        bit = 1 << c
+        for v in self.conflicts[s][u]:
+            mask = self.dom[v].get(s)
+            if mask is not None and mask & bit and self.choice[v] is None:
+                self.strike(v, s, mask & ~bit)
+        if self.count[s] >= beams_per_satellite:
+            for v in self.candidates[s]:
+                if self.choice[v] is None and s in self.dom[v]:
+                    self.strike(v, s, 0)
+
+    def undo(self, mark: int):
+        trail = self.trail
+        while len(trail) > mark:
+            entry = trail.pop()
+            if entry[0] == 'dom':
+                _, u, s, mask = entry
+                self.dom[u][s] = mask
+            elif entry[0] == 'alive':
+                u = entry[1]
+                self.alive[u] = True
+                self.n_live += 1
+            else:
+                _, u, s, top = entry
+                self.choice[u] = None
+                self.alive[u] = True
+                self.n_live += 1
+                self.covered -= 1
+                self.count[s] -= 1
+                self.free += 1
+                self.top[s] = top
+
+    #%% Search
+
+    def bound(self) -> int:
+        return self.covered + min(self.n_live, self.free)
+
+    def options(self, u: int) -> list:
+        """
+        Returns: user u's (sat, color) options, least used sat colors
+        first, with colors past a sat's next new one left out.
+        """
+        options = []
+        for s, mask in self.dom[u].items():
+            mask &= (1 << (self.top[s] + 2)) - 1
+            options.extend((s, c) for c in range(len(valid_color_ids)) if mask >> c & 1)
+        options.sort(key=lambda option: (len(self.candidates[option[0]]), option[1]))
+        return options
+
+    def pick_user(self):
+        best, best_key = None, None
+        for u, alive in enumerate(self.alive):
+            if not alive:
+                continue
+            key = (sum(mask_colors[mask] for mask in self.dom[u].values()), -len(self.dom[u]))
+            if best_key is None or key < best_key:
+                best, best_key = u, key
+        return best
+
+    def open_node(self):
+        """
+        Returns: the search frame for the current node, or None if it's a
+        leaf or can't beat the best plan.
+        """
+        bound = self.bound()
+        if bound <= self.best:
+            return None
+        u = self.pick_user()
+        if u is None:
+            self.best = self.covered
+            self.best_choice = list(self.choice)
+            return None
+        return [u, self.options(u) + [None], 0, len(self.trail), bound]
+
+    def run(self, deadline: float, node_limit: int):
+        """
+        Searches until the component is solved, deadline (a time.monotonic()
+        value) passes or node_limit nodes have been opened. On a stop,
+        open_bound is the best any unexplored node could still reach.
+        """
+        frames = []
+        frame = self.open_node()
+        if frame is not None:
+            frames.append(frame)
+        while frames:
+            if self.nodes >= node_limit or (self.nodes % time_check_nodes == 0 and time.monotonic() >= deadline):
+                self.stopped = True
+                self.open_bound = max(frame[4] for frame in frames)
+                break
+            frame = frames[-1]
+            u, options, i, mark, bound = frame
+            self.undo(mark)
+            if i == len(options) or bound <= self.best:
+                frames.pop()
+                continue
+            frame[2] = i + 1
+            if options[i] is None:
+                self.kill(u)
+            else:
+                self.assign(u, *options[i])
+            self.nodes += 1
+            child = self.open_node()
+            if child is not None:
+                frames.append(child)
+        self.undo(0)
+
+    def upper_bound(self) -> int:
+        return max(self.best, self.open_bound) if self.stopped else self.best
+
+#%% Planner
+
+class ExactResult:
+    """
+    How the exact search went.
+
+      covered:     users the returned plan covers.
+      upper_bound: most users any plan could cover, as far as the search
+                   proved; equal to covered when optimal.
+      nodes:       search nodes opened, over all components.
+      components:  components searched, and how many of them were solved.
+    """
+
+    def __init__(self):
+        self.covered = 0
+        self.upper_bound = 0
+        self.nodes = 0
+        self.components = 0
+        self.solved = 0
+        self.elapsed_s = 0.0
+
+    @property
+    def optimal(self) -> bool:
+        return self.covered >= self.upper_bound
+
+    def describe(self, n_users: int) -> str:
+        if self.optimal:
+            return f"exact: optimal, {self.covered} of {n_users} users, {self.nodes} nodes in {self.elapsed_s:.2f}s"
+        return (f"exact: stopped after {self.nodes} nodes in {self.elapsed_s:.2f}s, "
+                f"{self.solved} of {self.components} components solved; {self.covered} of {n_users} users, "
+                f"bound {self.upper_bound}, gap {(self.upper_bound - self.covered) / n_users * 100:.2f}%")
+
+
+def place_choices(plan: PlanState, users: list, sats: list, choices: list, absolute: bool = False):
+    """
+    Adds a component's beams to plan, given choices[i] = (sat, color index)
+    for users[i], or None. Sats are positions in sats, or with absolute, sat
+    rows.
+    """
+    geometry = plan.geometry
+    for user, choice in zip(users, choices):
+        if choice is not None:
+            s, c = choice
+            sat = s if absolute else sats[s]
+            plan.sat_state(geometry.sat_ids[sat]).add_beam(geometry.user_ids[user], valid_color_ids[c])
+            plan.covered_users.add(geometry.user_ids[user])
+
+
+def exact_planning(scenario: dict, plan: PlanState = None, seed: int = None, time_limit: float = None,
+                   node_limit: int = exact_node_limit, verbose: bool = True):
+    """
+    Plans by branch and bound, one connected component at a time, smallest
+    first, starting each from the priority planner's plan as the incumbent.
+    With verbose, prints the ExactResult to stderr.
+
+    time_limit covers the whole call: the incumbent, the search and the
+    final bound. The incumbent is always planned in full; components left
+    when time runs out keep their incumbent plan unsearched, and the flow
+    bound is only worked out if time is left for it.
+
+    Returns: solution, coverage rate, ExactResult
+    """
+    from bounds import coverage_bound
+    from optimizer import PlanningContext
+    from priority import priority_planning
+
+    start = time.monotonic()
+    deadline = start + (time_limit if time_limit is not None else exact_time_limit)
+    if plan is None:
+        plan = PlanState(scenario)
+    geometry, visibility = plan.geometry, plan.visibility
+    n_users = len(geometry.user_ids)
+
+    incumbent, _ = priority_planning(scenario, PlanState(scenario, geometry, visibility), seed)
+    incumbent_choice = {}
+    for sat_id, beams in incumbent.items():
+        for user, color_id in beams.values():
+            incumbent_choice[geometry.user_index[user]] = (geometry.sat_index[sat_id], valid_color_ids.index(color_id))
+
+    result = ExactResult()
+    components = sorted(connected_components(visibility, n_users, len(geometry.sat_ids)),
+                        key=lambda component: len(component[0]))
+    result.components = len(components)
+    for users, sats in components:
+        if time.monotonic() >= deadline:
+            # Out of time: keep the incumbent, bounded by the component's size.
+            choices = [incumbent_choice.get(user) for user in users]
+            place_choices(plan, users, sats, choices, absolute=True)
+            result.upper_bound += min(len(users), beams_per_satellite * len(sats))
+            continue
+        search = ComponentSearch(plan, users, sats)
+        local_sat = {sat: i for i, sat in enumerate(sats)}
+        search.best_choice = [(local_sat[incumbent_choice[user][0]], incumbent_choice[user][1])
+                              if user in incumbent_choice else None for user in users]
+        search.best = sum(choice is not None for choice in search.best_choice)
+        if search.best < search.bound():
+            search.run(deadline, node_limit - result.nodes)
+        result.nodes += search.nodes
+        result.solved += not search.stopped
+        result.upper_bound += search.upper_bound()
+
+        place_choices(plan, users, sats, search.best_choice)
+
+    result.covered = len(plan.covered_users)
+    if not result.optimal and time.monotonic() < deadline:
+        # The flow and clique bounds may be tighter than the search's.
+        bound = coverage_bound(PlanningContext(scenario, geometry, visibility))
+        result.upper_bound = max(result.covered, min(result.upper_bound, bound.users))
+    result.elapsed_s = time.monotonic() - start
+    if verbose:
+        print(result.describe(n_users), file=sys.stderr)
+    return plan.solution(), plan.coverage_rate(), result
@@ -0,0 +1,298 @@
+import instrumentation
+from beamplanning import beams_per_satellite, valid_color_ids, self_interference_max
+from coloring import conflict_graph, dsatur_coloring
+from geometry import ScenarioGeometry, self_interferes
+from spatial import SphereGrid, local_frame
+from visibility import VisibilityIndex
+
+#%% Parameters
+
+# Cell size of each sat's angular index of its beams, degrees.
+beam_index_cell_degrees = self_interference_max
+
+# Search radius for same-sat neighbors, degrees; a little over
+# self_interference_max so rounding can't hide a conflicting beam.
+beam_index_search_degrees = self_interference_max + 0.01
+
+#%% Per-satellite state
+
+class SatelliteState:
+    """
+    The beams currently placed on a single satellite.
+
+    Answers "can this user take this color here?" by only looking at the
+    beams already on this satellite. Beams are kept in an angular index of
+    their directions as seen from the sat, with cells about
+    self_interference_max wide, so a check only looks at the beams in the
+    neighboring cells.
+
+    Directions are stored in a frame local to the sat, with the sat's nadir
+    as the first axis; angles between them are the same as in ECEF.
+    """
+
+    def __init__(self, sat_id: str, geometry: ScenarioGeometry):
+        self.sat_id = sat_id
+        self.sat = geometry.sat_index[sat_id]
+        self.geometry = geometry
+        self.frame = local_frame(-geometry.sat_pos[self.sat])
+        # beams[beam_id] = (user_id, color_id), same layout as solution[sat_id].
+        self.beams = {}
+        # directions[beam_id] = unit vector from this sat towards the beam's user.
+        self.directions = {}
+        # Angular index of directions, keyed by beam id.
+        self.index = SphereGrid(beam_index_cell_degrees)
+
+    def is_full(self) -> bool:
+        return len(self.beams) >= beams_per_satellite
+
+    def next_beam_id(self) -> int:
+        """
+        Returns: the lowest beam id not yet in use on this satellite.
+        """
+        beam_id = 1
+        while beam_id in self.beams:
+            beam_id = beam_id + 1
+        return beam_id
+
+    def user_direction(self, user: str) -> tuple:
+        """
+        Returns: the unit vector from this sat towards user, in the sat's
+        local frame, as a tuple.
+        """
+        user_row = self.geometry.user_index[user]
+        return tuple((self.frame @ self.geometry.sat_user_directions(self.sat, user_row)).tolist())
+
+    def user_directions(self, users: list) -> list:
+        """
+        Returns: user_direction() for each of users, computed in one go.
+        """
+        user_index = self.geometry.user_index
+        rows = [user_index[user] for user in users]
+        return list(map(tuple, (self.geometry.sat_user_directions(self.sat, rows) @ self.frame.T).tolist()))
+
+    def nearby_beams(self, direction: tuple) -> list:
+        """
+        Returns: the ids of the beams on this satellite pointed within
+        self_interference_max degrees of direction.
+        """
+        x, y, z = direction
+        return [beam_id for beam_id, (ox, oy, oz) in self.index.query(direction, beam_index_search_degrees)
+                if self_interferes(x * ox + y * oy + z * oz)]
+
+    def blocked_colors(self, direction: tuple) -> set:
+        """
+        Returns: the colors of the beams within self_interference_max degrees of direction.
+        """
+        return {self.beams[beam_id][1] for beam_id in self.nearby_beams(direction)}
+
+    def color_conflicts(self, user: str, color_id: str, direction: tuple = None) -> bool:
+        """
+        Returns: whether a beam of the same color on this satellite is pointed
+        within self_interference_max degrees of user.
+        """
+        if direction is None:
+            direction = self.user_direction(user)
+        return color_id in self.blocked_colors(direction)
+
+    def free_color(self, user: str, direction: tuple = None):
+        """
+        Returns: the first color user can take on this satellite without
+        moving any other beam, or None.
+        """
+        if direction is None:
+            direction = self.user_direction(user)
+        blocked = self.blocked_colors(direction)
+        for color_id in valid_color_ids:
+            if color_id not in blocked:
+                return color_id
+        return None
+
+    def recolor_with(self, user: str, direction: tuple = None):
+        """
+        Tries to fit user on this satellite by recoloring every beam on it,
+        with a backtracking DSatur search over the sat's conflict graph.
+
+        Returns: the new color for user, or None if no coloring was found. On
+        success the existing beams have already been recolored.
+        """
+        if direction is None:
+            direction = self.user_direction(user)
+        beam_ids = list(self.beams)
+        directions = [self.directions[beam_id] for beam_id in beam_ids] + [direction]
+        colors = dsatur_coloring(conflict_graph(directions), len(valid_color_ids))
+        if colors is None:
+            return None
+        for beam_id, color in zip(beam_ids, colors):
+            self.beams[beam_id] = (self.beams[beam_id][0], valid_color_ids[color])
+        return valid_color_ids[colors[-1]]
+
+    def choose_color(self, user: str, direction: tuple = None):
+        """
+        Returns: a color for user on this satellite, recoloring the other
+        beams if that's the only way to fit it, or None if it can't fit.
+        """
+        if direction is None:
+            direction = self.user_direction(user)
+        color_id = self.free_color(user, direction)
+        if color_id is None:
+            color_id = self.recolor_with(user, direction)
+            if instrumentation.enabled:
+                instrumentation.count_check('recolor', color_id is not None, color_id is None)
+        return color_id
+
+    def add_beam(self, user: str, color_id: str, direction: tuple = None, beam_id: int = None) -> int:
+        """
+        Places a beam for user without checking it, on beam_id or else the
+        lowest free beam. Returns: the beam id used.
+        """
+        if direction is None:
+            direction = self.user_direction(user)
+        if beam_id is None:
+            beam_id = self.next_beam_id()
+        self.beams[beam_id] = (user, color_id)
+        self.directions[beam_id] = direction
+        self.index.insert(beam_id, direction)
+        return beam_id
+
+    def remove_beam(self, beam_id: int):
+        self.beams.pop(beam_id)
+        self.directions.pop(beam_id)
+        self.index.remove(beam_id)
+
+    def snapshot(self) -> tuple:
+        """
+        Returns: a copy of this satellite's beams, for restore().
+        """
+        return dict(self.beams), dict(self.directions)
+
+    def restore(self, snapshot: tuple):
+        beams, directions = snapshot
+        self.beams = dict(beams)
+        self.directions = dict(directions)
+        self.index = SphereGrid(beam_index_cell_degrees)
+        for beam_id, direction in self.directions.items():
+            self.index.insert(beam_id, direction)
+
+#%% Whole-plan state
+
+class PlanState:
+    """
+    Incremental feasibility engine for a plan under construction.
+
+    Keeps one SatelliteState per satellite plus the set of covered users. The
+    static (user, sat) link checks, visibility and non-Starlink interference,
+    don't depend on the rest of the plan, so they come from a precomputed
+    VisibilityIndex.
+    """
+
+    def __init__(self, scenario: dict, geometry: ScenarioGeometry = None,
+                 visibility: VisibilityIndex = None):
+        self.scenario = scenario
+        self.geometry = geometry if geometry is not None else ScenarioGeometry(scenario)
+        self.visibility = visibility if visibility is not None else VisibilityIndex(self.geometry)
+        self.sat_states = {}
+        self.covered_users = set()
+
+    def sat_state(self, sat_id: str) -> SatelliteState:
+        state = self.sat_states.get(sat_id)
+        if state is None:
+            state = SatelliteState(sat_id, self.geometry)
+            self.sat_states[sat_id] = state
+        return state
+
+    def link_ok(self, user: str, sat_id: str) -> bool:
+        """
+        Returns: whether the (user, sat) link passes the static constraints:
+        visibility and non-Starlink interference.
+        """
+        return self.visibility.has_link(self.geometry.user_index[user], self.geometry.sat_index[sat_id])
+
+    def candidate_users(self, sat_id: str) -> list:
+        """
+        Returns: the ids of every user sat_id could serve, as far as the static
+        constraints go.
+        """
+        user_ids = self.geometry.user_ids
+        return [user_ids[u] for u in self.visibility.users_for_sat(self.geometry.sat_index[sat_id]).tolist()]
+
+    def can_assign(self, user: str, sat_id: str, color_id: str) -> bool:
+        """
+        Returns: whether user can take a color_id beam on sat_id given the
+        beams placed so far.
+        """
+        if user in self.covered_users:
+            return False
+        state = self.sat_state(sat_id)
+        if state.is_full():
+            return False
+        link_ok = self.link_ok(user, sat_id)
+        if instrumentation.enabled:
+            instrumentation.count_check('link', link_ok, not link_ok)
+        if not link_ok:
+            return False
+        conflicts = state.color_conflicts(user, color_id)
+        if instrumentation.enabled:
+            instrumentation.count_check('color', not conflicts, conflicts)
+        return not conflicts
+
+    def assign(self, user: str, sat_id: str, color_id: str) -> int:
+        """
+        Places the beam. Callers are expected to have checked can_assign first.
+
+        Returns: the beam id used.
+        """
+        self.covered_users.add(user)
+        return self.sat_state(sat_id).add_beam(user, color_id)
+
+    def try_assign(self, user: str, sat_id: str):
+        """
+        Places a beam for user on sat_id if it fits with some color, picking
+        the color (and recoloring the sat's other beams) as needed.
+
+        Returns: the beam id used, or None if user can't be served there.
+        """
+        if user in self.covered_users:
+            return None
+        state = self.sat_state(sat_id)
+        if state.is_full():
+            return None
+        link_ok = self.link_ok(user, sat_id)
+        if instrumentation.enabled:
+            instrumentation.count_check('link', link_ok, not link_ok)
+        if not link_ok:
+            return None
+        direction = state.user_direction(user)
+        color_id = state.choose_color(user, direction)
+        if instrumentation.enabled:
+            instrumentation.count_check('color', color_id is not None, color_id is None)
+        if color_id is None:
+            return None
+        self.covered_users.add(user)
+        return state.add_beam(user, color_id, direction)
+
+    def load_solution(self, solution: dict):
+        """
+        Places every beam of an existing solution[sat_id][beam_id] =
+        (user_id, color_id) plan, keeping its beam ids and colors. The plan is
+        assumed to be valid.
+        """
+        for sat_id, beams in solution.items():
+            state = self.sat_state(sat_id)
+            for beam_id, (user, color_id) in beams.items():
+                state.add_beam(user, color_id, beam_id=int(beam_id))
+                self.covered_users.add(user)
+
+    def unassign(self, sat_id: str, beam_id: int):
+        state = self.sat_states[sat_id]
+        user = state.beams[beam_id][0]
+        state.remove_beam(beam_id)
+        self.covered_users.discard(user)
+
+    def coverage_rate(self) -> float:
+        return len(self.covered_users) / len(self.scenario['users'])
+
+    def solution(self) -> dict:
+        """
+        Returns: the plan in the usual solution[sat_id][beam_id] = (user_id, color_id) format.
+        """
+        return {sat_id: dict(state.beams) for sat_id, state in self.sat_states.items() if state.beams}
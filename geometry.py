@@ -0,0 +1,313 @@
+from math import cos, radians
+
+import numpy as np
+
+from beamplanning import (self_interference_max, non_starlink_interference_max,
+                          max_user_visible_angle)
+
+#%% Parameters
+
+# All angle comparisons are done on cosines of the angles, so no acos runs in
+# the hot loops. A smaller angle means a larger cosine.
+
+# Cosine of the self-interference angle.
+cos_self_interference_max = cos(radians(self_interference_max))
+
+# Cosine of the non-Starlink interference angle.
+cos_non_starlink_interference_max = cos(radians(non_starlink_interference_max))
+
+# Cosine of the max user to Starlink beam angle from vertical.
+cos_max_user_visible_angle = cos(radians(max_user_visible_angle))
+
+# Cosines within this much of a threshold are treated as violating it, so
+# rounding differences against calculate_angle_degrees can never let a
+# borderline beam through.
+cos_margin = 1e-9
+
+# Rows per block when a batched computation would otherwise build a huge
+# temporary matrix.
+chunk_rows = 4096
+
+#%% Array helpers
+
+def positions_array(objects: dict) -> np.ndarray:
+    """
+    Given a dict of id -> Vector3, returns: a contiguous (N,3) float64 array of
+    the positions, in the dict's order.
+    """
+    if not objects:
+        return np.zeros((0, 3), dtype=np.float64)
+    return np.ascontiguousarray(list(objects.values()), dtype=np.float64)
+
+
+def unit_vectors(vectors: np.ndarray) -> np.ndarray:
+    """
+    Returns: each row of vectors (..., 3) scaled to unit length.
+    """
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+#%% Scenario geometry
+
+class ScenarioGeometry:
+    """
+    Array-backed copy of a scenario.
+
+    Sats, users and interferers are held as contiguous (N,3) float64 position
+    arrays, in the scenario dicts' order, with *_index mapping ids to rows.
+    """
+
+    def __init__(self, scenario: dict):
+        self.sat_ids = list(scenario['sats'])
+        self.user_ids = list(scenario['users'])
+        self.interferer_ids = list(scenario['interferers'])
+
+        self.sat_index = {ident: i for i, ident in enumerate(self.sat_ids)}
+        self.user_index = {ident: i for i, ident in enumerate(self.user_ids)}
+
+        self.sat_pos = positions_array(scenario['sats'])
+        self.user_pos = positions_array(scenario['users'])
+        self.interferer_pos = positions_array(scenario['interferers'])
+
+        # User normals all pass through the center of the earth.
+        self.user_up = unit_vectors(self.user_pos)
+
+        # Built on first use by interferer_index(), for large catalogs.
+        self.interferer_lookup = None
+
+    def subset(self, users, sats) -> 'ScenarioGeometry':
+        """
+        Returns: the geometry of only the given user and sat rows, in that
+        order, and every interferer, sliced from this one's arrays.
+        """
+        users = np.asarray(users, dtype=np.intp)
+        sats = np.asarray(sats, dtype=np.intp)
+        part = ScenarioGeometry.__new__(ScenarioGeometry)
+        part.sat_ids = [self.sat_ids[sat] for sat in sats.tolist()]
+        part.user_ids = [self.user_ids[user] for user in users.tolist()]
+        part.interferer_ids = list(self.interferer_ids)
+        part.sat_index = {ident: i for i, ident in enumerate(part.sat_ids)}
+        part.user_index = {ident: i for i, ident in enumerate(part.user_ids)}
+        part.sat_pos = self.sat_pos[sats]
+        part.user_pos = self.user_pos[users]
+        part.interferer_pos = self.interferer_pos.copy()
+        part.user_up = self.user_up[users]
+        part.interferer_lookup = None
+        return part
+
+    #%% Updates
+
+    def set_user(self, user_id: str, position) -> int:
+        """
+        Moves user_id to position, adding it as a new row if it's new.
+
+        Returns: the user's row.
+        """
+        row = self.user_index.get(user_id)
+        if row is None:
+            row = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.user_index[user_id] = row
+            self.user_pos = np.vstack([self.user_pos, np.zeros((1, 3))])
+            self.user_up = np.vstack([self.user_up, np.zeros((1, 3))])
+        self.user_pos[row] = position
+        self.user_up[row] = unit_vectors(self.user_pos[row])
+        return row
+
+    def set_sat(self, sat_id: str, position) -> int:
+        """
+        Moves sat_id to position, adding it as a new row if it's new.
+
+        Returns: the sat's row.
+        """
+        row = self.sat_index.get(sat_id)
+        if row is None:
+            row = len(self.sat_ids)
+            self.sat_ids.append(sat_id)
+            self.sat_index[sat_id] = row
+            self.sat_pos = np.vstack([self.sat_pos, np.zeros((1, 3))])
+        self.sat_pos[row] = position
+        return row
+
+    def set_interferer(self, interferer_id: str, position) -> int:
+        """
+        Moves interferer_id to position, adding it as a new row if it's new.
+
+        Returns: the interferer's row.
+        """
+        if interferer_id in self.interferer_ids:
+            row = self.interferer_ids.index(interferer_id)
+        else:
+            row = len(self.interferer_ids)
+            self.interferer_ids.append(interferer_id)
+            self.interferer_pos = np.vstack([self.interferer_pos, np.zeros((1, 3))])
+        self.interferer_pos[row] = position
+        self.interferer_lookup = None
+        return row
+
+    def interferer_index(self):
+        """
+        Returns: an interferer_index.InterfererIndex over the interferers, or
+        None if there are too few for one to pay off.
+        """
+        from interferer_index import InterfererIndex, indexed_interferer_min
+
+        if len(self.interferer_ids) < indexed_interferer_min:
+            return None
+        if self.interferer_lookup is None:
+            self.interferer_lookup = InterfererIndex(self)
+        return self.interferer_lookup
+
+    #%% Batched angle matrices
+
+    def elevation_cos(self, user_idx=slice(None), sat_idx=slice(None)) -> np.ndarray:
+        """
+        Returns: a (users, sats) matrix of the cosine of the angle between each
+        user's vertical and the direction from that user to each sat.
+        """
+        user_pos = np.atleast_2d(self.user_pos[user_idx])
+        user_up = np.atleast_2d(self.user_up[user_idx])
+        sat_pos = np.atleast_2d(self.sat_pos[sat_idx])
+
+        # Process in blocks of users so the (users, sats, 3) temporary stays small.
+        elevation = np.empty((len(user_pos), len(sat_pos)), dtype=np.float64)
+        for start in range(0, len(user_pos), chunk_rows):
+            stop = start + chunk_rows
+            to_sat = unit_vectors(sat_pos[None, :, :] - user_pos[start:stop, None, :])
+            elevation[start:stop] = np.einsum('usk,uk->us', to_sat, user_up[start:stop])
+        return elevation
+
+    def user_separation_cos(self, sat: int, users_a, users_b) -> np.ndarray:
+        """
+        Returns: a (len(users_a), len(users_b)) matrix of the cosine of the
+        angle sat sees between each pair of users.
+        """
+        sat_loc = self.sat_pos[sat]
+        dir_a = unit_vectors(self.user_pos[users_a] - sat_loc)
+        dir_b = unit_vectors(self.user_pos[users_b] - sat_loc)
+        return dir_a @ dir_b.T
+
+    def interferer_separation_cos(self, users, sats, interferer_pos: np.ndarray = None) -> np.ndarray:
+        """
+        Given matching arrays of user and sat rows (one per link), returns: a
+        (links, interferers) matrix of the cosine of the angle each user sees
+        between its sat and each interferer, the scenario's or those at
+        interferer_pos.
+        """
+        users = np.asarray(users, dtype=np.intp)
+        sats = np.asarray(sats, dtype=np.intp)
+        if interferer_pos is None:
+            interferer_pos = self.interferer_pos
+        user_pos = self.user_pos[users]
+        to_sat = unit_vectors(self.sat_pos[sats] - user_pos)
+        to_interferer = unit_vectors(interferer_pos[None, :, :] - user_pos[:, None, :])
+        return np.einsum('lik,lk->li', to_interferer, to_sat)
+
+    def interferer_pairs(self, users, sats, floor: float):
+        """
+        Given matching arrays of user and sat rows (one per link), finds every
+        (link, interferer) pair whose interferer_separation_cos is above floor,
+        looking large catalogs up through interferer_index() rather than
+        testing every interferer. floor must be within the index's reach,
+        i.e. at most a hair below cos_non_starlink_interference_max.
+
+        Returns: matching arrays of link positions, interferer rows and
+        cosines, in (link, interferer) order.
+        """
+        users = np.asarray(users, dtype=np.intp)
+        sats = np.asarray(sats, dtype=np.intp)
+        index = self.interferer_index()
+        link_parts, interferer_parts, cos_parts = [], [], []
+        for start in range(0, len(users), chunk_rows):
+            stop = start + chunk_rows
+            if index is None:
+                sep = self.interferer_separation_cos(users[start:stop], sats[start:stop])
+                links, interferers = np.nonzero(sep > floor)
+                sep = sep[links, interferers]
+            else:
+                links, interferers = index.candidate_pairs(users[start:stop], sats[start:stop])
+                user_pos = self.user_pos[users[start:stop][links]]
+                to_sat = unit_vectors(self.sat_pos[sats[start:stop][links]] - user_pos)
+                to_interferer = unit_vectors(self.interferer_pos[interferers] - user_pos)
+                sep = np.einsum('pk,pk->p', to_interferer, to_sat)
+                keep = sep > floor
+                links, interferers, sep = links[keep], interferers[keep], sep[keep]
+            link_parts.append(start + links)
+            interferer_parts.append(interferers)
+            cos_parts.append(sep)
+        if not link_parts:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty, np.zeros(0)
+        return np.concatenate(link_parts), np.concatenate(interferer_parts), np.concatenate(cos_parts)
+
+    #%% Constraint masks
+
+    def visible_mask(self, user_idx=slice(None), sat_idx=slice(None)) -> np.ndarray:
+        """
+        Returns: a (users, sats) bool matrix, True where the sat is within
+        max_user_visible_angle of the user's vertical.
+        """
+        return self.elevation_cos(user_idx, sat_idx) > cos_max_user_visible_angle + cos_margin
+
+    def interferer_blocked_mask(self, users, sats, interferer_pos: np.ndarray = None) -> np.ndarray:
+        """
+        Given matching arrays of user and sat rows, returns: a bool array, True
+        where the user would see its sat within non_starlink_interference_max
+        of any non-Starlink satellite, the scenario's or those at
+        interferer_pos. Large catalogs of the scenario's own are looked up
+        through interferer_index().
+        """
+        users = np.asarray(users, dtype=np.intp)
+        sats = np.asarray(sats, dtype=np.intp)
+        blocked = np.zeros(len(users), dtype=bool)
+        if interferer_pos is None:
+            if self.interferer_index() is not None:
+                links, _, _ = self.interferer_pairs(users, sats, cos_non_starlink_interference_max - cos_margin)
+                blocked[links] = True
+                return blocked
+            interferer_pos = self.interferer_pos
+        if len(interferer_pos) == 0:
+            return blocked
+
+        # Process in blocks so the (links, interferers, 3) temporary stays small.
+        for start in range(0, len(users), chunk_rows):
+            stop = start + chunk_rows
+            sep = self.interferer_separation_cos(users[start:stop], sats[start:stop], interferer_pos)
+            blocked[start:stop] = (sep > cos_non_starlink_interference_max - cos_margin).any(axis=1)
+        return blocked
+
+    def link_elevation_cos(self, users, sats) -> np.ndarray:
+        """
+        Given matching arrays of user and sat rows (one per link), returns: the
+        cosine of the angle between each user's vertical and its sat.
+        """
+        users = np.asarray(users, dtype=np.intp)
+        sats = np.asarray(sats, dtype=np.intp)
+        to_sat = unit_vectors(self.sat_pos[sats] - self.user_pos[users])
+        return np.einsum('lk,lk->l', to_sat, self.user_up[users])
+
+    def link_ok_mask(self, users, sats) -> np.ndarray:
+        """
+        Given matching arrays of user and sat rows, returns: a bool array, True
+        where the link passes the static (visibility and non-Starlink
+        interference) constraints.
+        """
+        users = np.asarray(users, dtype=np.intp)
+        sats = np.asarray(sats, dtype=np.intp)
+        ok = self.link_elevation_cos(users, sats) > cos_max_user_visible_angle + cos_margin
+        visible = np.flatnonzero(ok)
+        if len(visible):
+            ok[visible[self.interferer_blocked_mask(users[visible], sats[visible])]] = False
+        return ok
+
+    def sat_user_directions(self, sat: int, users) -> np.ndarray:
+        """
+        Returns: unit vectors from sat towards each of users.
+        """
+        return unit_vectors(self.user_pos[users] - self.sat_pos[sat])
+
+
+def self_interferes(cos_separation) -> bool:
+    """
+    Returns: whether a sat-relative user/user cosine is within self_interference_max.
+    """
+    return cos_separation > cos_self_interference_max - cos_margin
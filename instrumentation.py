@@ -0,0 +1,205 @@
+import os, sys, time, json, signal
+
+#%% Parameters
+
+# Whether phases and checks are being recorded. Off by default; every hook
+# checks this first, so a disabled run only pays for that test.
+enabled = False
+
+# Interval between samples of the sampling profiler, seconds.
+sample_interval = 0.005
+
+# Functions listed in a profile summary.
+profile_top = 25
+
+#%% Recorded state
+
+# phase_times[name] = [seconds, calls]
+phase_times = {}
+
+# checks[name] = [accepted, rejected]
+checks = {}
+
+# time.perf_counter() when recording was last enabled or reset.
+started = time.perf_counter()
+
+# The running profiler, if any: a cProfile.Profile or a Sampler.
+profiler = None
+
+
+def enable(on: bool = True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    global started
+    phase_times.clear()
+    checks.clear()
+    started = time.perf_counter()
+
+#%% Phases and checks
+
+class Phase:
+    """
+    Context manager adding the time spent in its block to phase_times[name].
+    Does nothing unless recording was enabled when the block started.
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is not None:
+            totals = phase_times.get(self.name)
+            if totals is None:
+                totals = phase_times[self.name] = [0.0, 0]
+            totals[0] += time.perf_counter() - self.start
+            totals[1] += 1
+            self.start = None
+        return False
+
+
+def phase(name: str) -> Phase:
+    return Phase(name)
+
+
+def count_check(name: str, accepted: int, rejected: int = 0):
+    """
+    Adds accepted and rejected outcomes to the counts of check name. Hot
+    paths test enabled before calling this.
+    """
+    counts = checks.get(name)
+    if counts is None:
+        counts = checks[name] = [0, 0]
+    counts[0] += accepted
+    counts[1] += rejected
+
+#%% Profiling
+
+class Sampler:
+    """
+    A statistical profiler: every sample_interval seconds of CPU time, notes
+    which function is running (self) and every function on the stack
+    (inclusive). Needs SIGPROF, so Unix only, and samples the main thread.
+    """
+
+    def __init__(self, interval: float = sample_interval):
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = {}
+        self.inclusive_counts = {}
+
+    @staticmethod
+    def label(code) -> str:
+        return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+    def sample(self, signum, frame):
+        self.samples += 1
+        if frame is None:
+            return
+        label = self.label(frame.f_code)
+        self.self_counts[label] = self.self_counts.get(label, 0) + 1
+        seen = set()
+        while frame is not None:
+            label = self.label(frame.f_code)
+            if label not in seen:
+                seen.add(label)
+                self.inclusive_counts[label] = self.inclusive_counts.get(label, 0) + 1
+            frame = frame.f_back
+
+    def enable(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def summary(self) -> dict:
+        top = sorted(self.inclusive_counts.items(), key=lambda item: -item[1])[:profile_top]
+        return {'mode': 'sample', 'interval_s': self.interval, 'samples': self.samples,
+                'top': [{'function': label, 'self_samples': self.self_counts.get(label, 0),
+                         'inclusive_samples': count} for label, count in top]}
+
+
+def cprofile_summary(profile) -> dict:
+    import pstats
+
+    stats = pstats.Stats(profile).stats
+    # stats[(file, line, name)] = (primitive calls, calls, self time, cumulative time, callers)
+    top = sorted(stats.items(), key=lambda item: -item[1][3])[:profile_top]
+    return {'mode': 'cprofile',
+            'top': [{'function': f"{os.path.basename(filename)}:{line}({name})", 'calls': calls,
+                     'self_s': self_time, 'cumulative_s': cumulative}
+                    for (filename, line, name), (_, calls, self_time, cumulative, _) in top]}
+
+
+def start_profile(mode: str):
+    """
+    Starts a profiler: 'cprofile' for exact per-function times, 'sample'
+    for a low-overhead sampling profile.
+    """
+    global profiler
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+    elif mode == 'sample':
+        if not hasattr(signal, 'setitimer'):
+            print("Sampling profiler needs SIGPROF; not profiling.", file=sys.stderr)
+            return
+        profiler = Sampler()
+    else:
+        raise ValueError(f"Unknown profile mode: {mode}")
+    profiler.enable()
+
+
+def stop_profile():
+    """
+    Returns: the summary of the running profiler, which is stopped, or None.
+    """
+    global profiler
+    if profiler is None:
+        return None
+    profiler.disable()
+    result = profiler.summary() if isinstance(profiler, Sampler) else cprofile_summary(profiler)
+    profiler = None
+    return result
+
+#%% Summary
+
+def summary(profile: dict = None) -> dict:
+    """
+    Returns: everything recorded since the last reset, as a JSON-ready dict.
+    Phases and checks only cover this process, not planner worker processes.
+    """
+    result = {
+        'wall_s': time.perf_counter() - started,
+        'phases': {name: {'seconds': seconds, 'calls': calls}
+                   for name, (seconds, calls) in phase_times.items()},
+        'checks': {name: {'accepted': accepted, 'rejected': rejected}
+                   for name, (accepted, rejected) in checks.items()},
+    }
+    if profile is not None:
+        result['profile'] = profile
+    return result
+
+
+def write_summary(destination: str, profile: dict = None):
+    """
+    Writes summary() as JSON to destination, a file path or '-' for stderr.
+    """
+    text = json.dumps(summary(profile), indent=2)
+    if destination == '-':
+        print(text, file=sys.stderr)
+    else:
+        with open(destination, 'w') as f:
+            f.write(text + '\n')
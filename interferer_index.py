@@ -0,0 +1,169 @@
+from math import cos, radians, sqrt
+
+import numpy as np
+
+from beamplanning import non_starlink_interference_max
+from geometry import unit_vectors
+from spatial import PackedSphereGrid
+
+#%% Parameters
+
+# Catalogs with at least this many interferers are checked through an
+# InterfererIndex; smaller ones are cheaper to check against every interferer.
+indexed_interferer_min = 200
+
+# Size of the lat/lon cells users are grouped into, degrees. Each region
+# indexes the interferers as seen from its center.
+interferer_region_degrees = 5.0
+
+# Cell size of each region's grid of interferer directions, degrees.
+interferer_cell_degrees = 10.0
+
+# Links are grouped by the lat/lon cell of their direction to the sat, this
+# many degrees wide, and each group looks its interferers up once.
+link_cell_degrees = 2.0
+
+# Extra degrees added to every search cone, to absorb rounding.
+interferer_slack_degrees = 0.01
+
+#%% Interferer index
+
+class RegionInterferers:
+    """
+    The interferers as seen from the center of one region of users.
+
+    Seen from a user up to radius km from the center, an interferer distance
+    km away from the center moves by at most asin(radius / distance), its
+    parallax margin; an interferer closer than 2 * radius could be anywhere
+    in the user's sky, so it is always a candidate.
+    """
+
+    def __init__(self, center: np.ndarray, radius: float, interferer_pos: np.ndarray):
+        offsets = interferer_pos - center
+        distance = np.linalg.norm(offsets, axis=1)
+        far = distance > 2 * radius
+        self.near = np.flatnonzero(~far)
+        self.far = np.flatnonzero(far)
+        self.directions = unit_vectors(offsets[self.far])
+        # Largest angle from the center's view of each far interferer that a
+        # blocked link can have, less the link cell size.
+        margins = np.degrees(np.arcsin(radius / distance[self.far]))
+        self.max_margin = float(margins.max()) if len(margins) else 0.0
+        self.cos_reach = np.cos(np.radians(np.minimum(
+            180.0, non_starlink_interference_max + margins + link_cell_degrees + interferer_slack_degrees)))
+        self.grid = PackedSphereGrid(self.directions, interferer_cell_degrees)
+
+    def candidates(self, direction: tuple) -> np.ndarray:
+        """
+        Returns: the rows of the interferers that could be within
+        non_starlink_interference_max of a sat seen in direction, within
+        link_cell_degrees, by any user of the region.
+        """
+        reach = non_starlink_interference_max + self.max_margin + link_cell_degrees + interferer_slack_degrees
+        if reach >= 180.0:
+            found = np.arange(len(self.far))
+        else:
+            found = self.grid.query_rows(direction, reach)
+            found = found[self.directions[found] @ np.asarray(direction) > self.cos_reach[found]]
+        return np.concatenate([self.near, self.far[np.sort(found)]])
+
+
+class InterfererIndex:
+    """
+    Indexes a geometry's interferers by direction, as seen from regions of
+    users, so "is sat S within non_starlink_interference_max of any
+    interferer, seen from user U?" only tests the interferers near S in U's
+    sky rather than the whole catalog.
+
+    Users are grouped into lat/lon cells of interferer_region_degrees. Each
+    region builds a grid of the interferers' directions from its center on
+    first use, with a parallax margin covering every user in it. Links are
+    then grouped by region and by the cell of their sat's direction, and
+    each group looks up its candidate interferers once.
+
+    The index must be rebuilt when interferers change. It covers the radii
+    of the users it was built with, and widens itself (dropping its regions)
+    if users turn up outside them.
+    """
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        self.regions = PackedSphereGrid(np.zeros((0, 3)), interferer_region_degrees)
+        self.links = PackedSphereGrid(np.zeros((0, 3)), link_cell_degrees)
+        self.radius_range = (np.inf, -np.inf)
+        self.cache = {}
+        self.candidate_cache = {}
+        if len(geometry.user_pos):
+            self.fit_radii(np.arange(len(geometry.user_pos)))
+
+    def fit_radii(self, users: np.ndarray):
+        """
+        Widens the user radii the region margins cover to take in users,
+        dropping the regions built for the narrower range.
+        """
+        radii = np.linalg.norm(self.geometry.user_pos[users], axis=1)
+        low, high = self.radius_range
+        if radii.min() < low or radii.max() > high:
+            self.radius_range = (min(low, float(radii.min())), max(high, float(radii.max())))
+            self.cache = {}
+            self.candidate_cache = {}
+
+    def region(self, key: int) -> RegionInterferers:
+        region = self.cache.get(key)
+        if region is None:
+            low, high = self.radius_range
+            center_radius = (low + high) / 2
+            # Users of the region are within its cell size of the center's direction.
+            angle = radians(self.regions.cell_degrees)
+            radius = max(sqrt(max(0.0, r * r + center_radius * center_radius - 2 * r * center_radius * cos(angle)))
+                         for r in (low, high))
+            center = center_radius * np.array(self.regions.cell_center(key))
+            region = RegionInterferers(center, radius, self.geometry.interferer_pos)
+            self.cache[key] = region
+        return region
+
+    def candidates(self, region_key: int, link_key: int) -> np.ndarray:
+        found = self.candidate_cache.get((region_key, link_key))
+        if found is None:
+            found = self.region(region_key).candidates(self.links.cell_center(link_key))
+            self.candidate_cache[region_key, link_key] = found
+        return found
+
+    def candidate_pairs(self, users, sats):
+        """
+        Given matching arrays of user and sat rows (one per link), returns:
+        matching arrays of link positions and interferer rows, sorted, for
+        every (link, interferer) pair that could be within
+        non_starlink_interference_max. Every pair that is, is included.
+        """
+        users = np.asarray(users, dtype=np.intp)
+        sats = np.asarray(sats, dtype=np.intp)
+        empty = np.zeros(0, dtype=np.intp)
+        if len(users) == 0:
+            return empty, empty
+        self.fit_radii(users)
+        geometry = self.geometry
+        region_keys = self.regions.cell_keys(geometry.user_up[users])
+        link_keys = self.links.cell_keys(unit_vectors(geometry.sat_pos[sats] - geometry.user_pos[users]))
+
+        # Sort links into (region, link cell) groups.
+        keys = region_keys * (self.links.lat_cells * self.links.lon_cells) + link_keys
+        order = np.argsort(keys, kind='stable')
+        _, starts = np.unique(keys[order], return_index=True)
+        stops = np.append(starts[1:], len(order))
+        link_parts = []
+        interferer_parts = []
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            first = order[start]
+            found = self.candidates(int(region_keys[first]), int(link_keys[first]))
+            if len(found) == 0:
+                continue
+            group = order[start:stop]
+            link_parts.append(np.repeat(group, len(found)))
+            interferer_parts.append(np.tile(found, len(group)))
+        if not link_parts:
+            return empty, empty
+        links = np.concatenate(link_parts)
+        interferers = np.concatenate(interferer_parts)
+        order = np.lexsort((interferers, links))
+        return links[order], interferers[order]
@@ -0,0 +1,186 @@
+import random, time
+
+from beamplanning import valid_color_ids
+from feasibility import PlanState
+
+#%% Parameters
+
+# How many beams ejection chains try evicting per sat.
+max_ejection_candidates = 8
+
+# How many evictions deep an ejection chain may go.
+max_chain_depth = 2
+
+# Share of iterations spent trying to cover one more user; the rest are
+# neutral moves that reshuffle the plan without losing coverage.
+cover_move_probability = 0.5
+
+#%% Undoable moves
+
+class Move:
+    """
+    Records the sats a move touches so it can be rolled back.
+
+    Every change a move makes must be to a sat passed to touch() first.
+    """
+
+    def __init__(self, plan: PlanState):
+        self.plan = plan
+        self.saved = {}
+
+    def touch(self, sat_id: str):
+        if sat_id not in self.saved:
+            self.saved[sat_id] = self.plan.sat_state(sat_id).snapshot()
+
+    def rollback(self):
+        users_before = set()
+        users_after = set()
+        for sat_id, snapshot in self.saved.items():
+            state = self.plan.sat_state(sat_id)
+            users_after.update(user for user, _ in state.beams.values())
+            users_before.update(user for user, _ in snapshot[0].values())
+            state.restore(snapshot)
+        self.plan.covered_users -= users_after - users_before
+        self.plan.covered_users |= users_before - users_after
+        self.saved = {}
+
+#%% Local search
+
+class LocalSearch:
+    """
+    Improves a valid plan in place by local moves that never break a
+    constraint and never lose coverage:
+
+    - cover: place an uncovered user on a visible sat, directly or through an
+      ejection chain that evicts a beam and re-homes its user elsewhere.
+    - reassign: move a covered user to another visible sat with a free beam.
+    - recolor: give a beam another color that is free on its sat.
+
+    Because coverage never drops, the plan is the best found so far after
+    every move, and can be taken at any time.
+    """
+
+    def __init__(self, plan: PlanState, seed: int = None):
+        self.plan = plan
+        self.rng = random.Random(seed)
+        geometry = plan.geometry
+        visibility = plan.visibility
+        self.sat_ids = geometry.sat_ids
+        self.user_row = geometry.user_index
+        # Every user with at least one usable sat; only these can be covered.
+        self.coverable = [geometry.user_ids[u] for u in range(len(geometry.user_ids))
+                          if len(visibility.sats_for_user(u))]
+
+    def sats_of(self, user: str) -> list:
+        """
+        Returns: the ids of the sats that can serve user, in random order.
+        """
+        sats = self.plan.visibility.sats_for_user(self.user_row[user]).tolist()
+        self.rng.shuffle(sats)
+        return [self.sat_ids[sat] for sat in sats]
+
+    def cover(self, user: str, depth: int, banned_sats: frozenset = frozenset()) -> bool:
+        """
+        Tries to cover user, evicting and re-homing up to depth other users.
+        Leaves the plan unchanged on failure.
+
+        Returns: success or failure.
+        """
+        plan = self.plan
+        sats = [sat_id for sat_id in self.sats_of(user) if sat_id not in banned_sats]
+        for sat_id in sats:
+            if plan.try_assign(user, sat_id) is not None:
+                return True
+        if depth <= 0:
+            return False
+
+        for sat_id in sats:
+            state = plan.sat_state(sat_id)
+            if not state.beams:
+                continue
+            beam_ids = list(state.beams)
+            self.rng.shuffle(beam_ids)
+            for beam_id in beam_ids[:max_ejection_candidates]:
+                evicted = state.beams[beam_id][0]
+                move = Move(plan)
+                move.touch(sat_id)
+                plan.unassign(sat_id, beam_id)
+                if plan.try_assign(user, sat_id) is not None and \
+                        self.cover(evicted, depth - 1, banned_sats | {sat_id}):
+                    return True
+                move.rollback()
+        return False
+
+    def reassign(self) -> bool:
+        """
+        Moves a random covered user to another of its sats. Returns: whether it moved.
+        """
+        plan = self.plan
+        loaded = [sat_id for sat_id, state in plan.sat_states.items() if state.beams]
+        if not loaded:
+            return False
+        sat_id = self.rng.choice(loaded)
+        beam_id = self.rng.choice(list(plan.sat_states[sat_id].beams))
+        user = plan.sat_states[sat_id].beams[beam_id][0]
+        for other_id in self.sats_of(user):
+            if other_id == sat_id or plan.sat_state(other_id).is_full():
+                continue
+            move = Move(plan)
+            move.touch(sat_id)
+            move.touch(other_id)
+            plan.unassign(sat_id, beam_id)
+            if plan.try_assign(user, other_id) is not None:
+                return True
+            move.rollback()
+        return False
+
+    def recolor(self) -> bool:
+        """
+        Gives a random beam another free color. Returns: whether it changed.
+        """
+        plan = self.plan
+        loaded = [state for state in plan.sat_states.values() if state.beams]
+        if not loaded:
+            return False
+        state = self.rng.choice(loaded)
+        beam_id = self.rng.choice(list(state.beams))
+        user, color_id = state.beams[beam_id]
+        colors = [c for c in valid_color_ids if c != color_id]
+        self.rng.shuffle(colors)
+        for other_color in colors:
+            if not state.color_conflicts(user, other_color, state.directions[beam_id]):
+                state.beams[beam_id] = (user, other_color)
+                return True
+        return False
+
+    def run(self, deadline: float):
+        """
+        Searches until deadline, a time.monotonic() value, or until every
+        coverable user is covered.
+
+        Yields: the coverage rate each time it improves. The plan holds the
+        matching solution at each yield, so a caller can stop at any point.
+        """
+        plan = self.plan
+        # Moves never uncover anyone, so this list only ever shrinks.
+        uncovered = [user for user in self.coverable if user not in plan.covered_users]
+        while uncovered and time.monotonic() < deadline:
+            if self.rng.random() < cover_move_probability:
+                i = self.rng.randrange(len(uncovered))
+                if self.cover(uncovered[i], max_chain_depth):
+                    uncovered[i] = uncovered[-1]
+                    uncovered.pop()
+                    yield plan.coverage_rate()
+            elif self.rng.random() < 0.5:
+                self.reassign()
+            else:
+                self.recolor()
+
+
+def improve(plan: PlanState, deadline: float, seed: int = None):
+    """
+    Runs LocalSearch on plan until deadline, a time.monotonic() value.
+
+    Yields: the coverage rate each time it improves; plan is valid throughout.
+    """
+    return LocalSearch(plan, seed).run(deadline)
@@ -0,0 +1,168 @@
+from collections import deque
+
+from beamplanning import beams_per_satellite
+from feasibility import PlanState
+
+#%% Max-flow
+
+class FlowNetwork:
+    """
+    Directed graph with integer edge capacities, solved for max flow with
+    Dinic's algorithm. On the unit-capacity user -> sat graph that is
+    Hopcroft-Karp generalized to sats with several beams.
+
+    Edges are stored as flat lists; edge e and e ^ 1 are a forward edge and
+    its residual twin.
+    """
+
+    def __init__(self, n_nodes: int):
+        self.n_nodes = n_nodes
+        self.head = [-1] * n_nodes
+        self.to = []
+        self.cap = []
+        self.next = []
+
+    def add_edge(self, u: int, v: int, capacity: int) -> int:
+        """
+        Returns: the index of the new forward edge.
+        """
+        edge = len(self.to)
+        self.to.extend((v, u))
+        self.cap.extend((capacity, 0))
+        self.next.extend((self.head[u], self.head[v]))
+        self.head[u] = edge
+        self.head[v] = edge + 1
+        return edge
+
+    def levels_from(self, source: int, sink: int):
+        """
+        Returns: BFS distance from source over edges with spare capacity, or
+        None if sink can't be reached.
+        """
+        level = [-1] * self.n_nodes
+        level[source] = 0
+        queue = deque([source])
+        to, cap, nxt = self.to, self.cap, self.next
+        while queue:
+            u = queue.popleft()
+            e = self.head[u]
+            while e != -1:
+                v = to[e]
+                if cap[e] > 0 and level[v] < 0:
+                    level[v] = level[u] + 1
+                    queue.append(v)
+                e = nxt[e]
+        return level if level[sink] >= 0 else None
+
+    def blocking_flow(self, source: int, sink: int, level: list) -> int:
+        """
+        Pushes flow along shortest augmenting paths until none are left in the
+        level graph. Returns: the flow pushed.
+        """
+        to, cap, nxt = self.to, self.cap, self.next
+        current = list(self.head)
+        pushed = 0
+        while True:
+            # Walk forward from source on the level graph, keeping the path.
+            path = []
+            u = source
+            while u != sink:
+                e = current[u]
+                while e != -1 and not (cap[e] > 0 and level[to[e]] == level[u] + 1):
+                    e = nxt[e]
+                current[u] = e
+                if e == -1:
+                    # Dead end: drop u from the level graph and step back.
+                    if u == source:
+                        return pushed
+                    level[u] = -1
+                    e = path.pop()
+                    u = to[e ^ 1]
+                    current[u] = nxt[current[u]]
+                    continue
+                path.append(e)
+                u = to[e]
+
+            amount = min(cap[e] for e in path)
+            for e in path:
+                cap[e] -= amount
+                cap[e ^ 1] += amount
+            pushed += amount
+
+    def max_flow(self, source: int, sink: int) -> int:
+        flow = 0
+        while True:
+            level = self.levels_from(source, sink)
+            if level is None:
+                return flow
+            flow += self.blocking_flow(source, sink, level)
+
+#%% Matching planner
+
+def max_flow_assignment(visibility, n_users: int, n_sats: int,
+                        capacity: int = beams_per_satellite) -> dict:
+    """
+    Solves the capacitated bipartite matching of users to the sats they can
+    see, each sat taking at most capacity users. Colors and self-interference
+    are ignored.
+
+    Returns: assigned[sat_row] = list of user rows.
+    """
+    source = n_users + n_sats
+    sink = source + 1
+    network = FlowNetwork(n_users + n_sats + 2)
+    user_edges = []
+    for user in range(n_users):
+        sats = visibility.sats_for_user(user).tolist()
+        if not sats:
+            continue
+        network.add_edge(source, user, 1)
+        for sat in sats:
+            user_edges.append((network.add_edge(user, n_users + sat, 1), user, sat))
+    for sat in range(n_sats):
+        if len(visibility.users_for_sat(sat)):
+            network.add_edge(n_users + sat, sink, capacity)
+
+    network.max_flow(source, sink)
+
+    assigned = {}
+    for edge, user, sat in user_edges:
+        if network.cap[edge] == 0:
+            assigned.setdefault(sat, []).append(user)
+    return assigned
+
+
+def matching_planning(scenario: dict, plan: PlanState = None):
+    """
+    Plans by max-flow: first the best user -> sat assignment ignoring colors,
+    then a repair pass that colors each sat, drops the users that can't be
+    fitted, and re-homes them onto other visible sats with spare beams.
+
+    Returns: solution, coverage rate
+    """
+    if plan is None:
+        plan = PlanState(scenario)
+    geometry = plan.geometry
+    visibility = plan.visibility
+
+    assigned = max_flow_assignment(visibility, len(geometry.user_ids), len(geometry.sat_ids))
+
+    # Repair: place each sat's matched users, coloring as we go. Users that
+    # can't be colored in are dropped for now.
+    for sat, users in assigned.items():
+        sat_id = geometry.sat_ids[sat]
+        for user in users:
+            plan.try_assign(geometry.user_ids[user], sat_id)
+
+    # Re-home the dropped users, along with anyone the matching left out, now
+    # that the drops have freed some beams. Fewest options first.
+    uncovered = [user for user, user_id in enumerate(geometry.user_ids)
+                 if user_id not in plan.covered_users]
+    uncovered.sort(key=lambda user: len(visibility.sats_for_user(user)))
+    for user in uncovered:
+        user_id = geometry.user_ids[user]
+        for sat in visibility.sats_for_user(user).tolist():
+            if plan.try_assign(user_id, geometry.sat_ids[sat]) is not None:
+                break
+
+    return plan.solution(), plan.coverage_rate()
@@ -0,0 +1,131 @@
+import random, time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import instrumentation
+from beamplanning import beam_planning
+from compact import BeamTable
+from feasibility import PlanState
+from geometry import ScenarioGeometry
+from visibility import VisibilityIndex
+
+#%% Shared planning context
+
+class PlanningContext:
+    """
+    The read-only inputs every restart shares: the scenario plus its
+    precomputed geometry and visibility index.
+    """
+
+    def __init__(self, scenario: dict, geometry: ScenarioGeometry = None,
+                 visibility: VisibilityIndex = None):
+        self.scenario = scenario
+        with instrumentation.phase('geometry'):
+            self.geometry = geometry if geometry is not None else ScenarioGeometry(scenario)
+        with instrumentation.phase('visibility'):
+            self.visibility = visibility if visibility is not None else VisibilityIndex(self.geometry)
+
+    def new_plan(self) -> PlanState:
+        return PlanState(self.scenario, self.geometry, self.visibility)
+
+
+# The context a pool worker plans against. Installed once per worker by
+# init_worker; with the fork start method it's inherited, never pickled.
+worker_context = None
+
+def init_worker(context: PlanningContext):
+    global worker_context
+    worker_context = context
+
+#%% Restarts
+
+def greedy_restart(context: PlanningContext, seed: int):
+    """
+    One greedy pass over a seeded shuffle of the sats and users.
+
+    Returns: coverage rate, solution as a compact.BeamTable, seed
+    """
+    rng = random.Random(seed)
+    sat_list = list(context.scenario['sats'])
+    usr_list = list(context.scenario['users'])
+    rng.shuffle(sat_list)
+    rng.shuffle(usr_list)
+    plan = context.new_plan()
+    _, coverage_rate = beam_planning(context.scenario, usr_list, sat_list, plan)
+    return coverage_rate, BeamTable.from_plan(plan), seed
+
+
+def worker_restart(seed: int):
+    return greedy_restart(worker_context, seed)
+
+
+def run_restarts(context: PlanningContext, restarts: int = 1, workers: int = 1,
+                 deadline: float = None, seed: int = None, target: int = None):
+    """
+    Runs up to restarts greedy passes, each with its own seed (seed, seed + 1,
+    ...), on workers processes, and keeps the best.
+
+    deadline is a time.monotonic() value; no new restart is started after it,
+    though at least one always runs. Restarts already running when it passes
+    are allowed to finish. Likewise once the best plan covers target users,
+    an upper bound such as bounds.CoverageBound.users, since no restart
+    can beat it.
+
+    Returns: best coverage rate, best solution as a compact.BeamTable
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    restarts = max(1, restarts)
+    best_coverage_rate, best_solution = -1.0, BeamTable(context.geometry)
+
+    def keep_best(result):
+        nonlocal best_coverage_rate, best_solution
+        coverage_rate, solution, _ = result
+        if coverage_rate > best_coverage_rate:
+            # Tables come back from workers without their geometry.
+            best_coverage_rate, best_solution = coverage_rate, solution.bind(context.geometry)
+
+    def out_of_time() -> bool:
+        return deadline is not None and time.monotonic() >= deadline
+
+    def should_stop() -> bool:
+        n_users = len(context.scenario['users'])
+        return out_of_time() or (target is not None and round(best_coverage_rate * n_users) >= target)
+
+    if workers <= 1 or restarts == 1:
+        for i in range(restarts):
+            if i > 0 and should_stop():
+                break
+            keep_best(greedy_restart(context, seed + i))
+        return best_coverage_rate, best_solution
+
+    # Fork shares the context with the workers for free where it's available;
+    # elsewhere it's pickled once per worker through the initializer.
+    start_method = 'fork' if 'fork' in mp.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(start_method),
+                             initializer=init_worker, initargs=(context,)) as pool:
+        pending = set()
+        submitted = 0
+        while True:
+            # Keep every worker busy, with one task queued behind it.
+            while submitted < restarts and len(pending) < 2 * workers and \
+                    (submitted == 0 or not should_stop()):
+                pending.add(pool.submit(worker_restart, seed + submitted))
+                submitted += 1
+            if not pending:
+                break
+            # Wake up at the deadline to stop submitting; after that, just
+            # wait for whatever is still running.
+            timeout = None
+            if deadline is not None and submitted < restarts:
+                timeout = max(0.0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                keep_best(future.result())
+            if should_stop():
+                # Drop queued restarts, keep the ones already running.
+                for future in pending:
+                    future.cancel()
+                submitted = restarts
+                pending = {future for future in pending if not future.cancelled()}
+    return best_coverage_rate, best_solution
@@ -0,0 +1,371 @@
+import sys, json, time, random
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import argparse as argp
+
+import numpy as np
+
+import beamplanning as bp
+from compact import BeamTable
+from optimizer import PlanningContext
+from planning_service import ChangeLog
+from validator import find_violations, format_violation
+
+#%% Parameters
+
+# Sats per random outage set when --random is given without --size.
+default_outage_size = 10
+
+#%% Outage sets
+
+class OutageCase:
+    """
+    One what-if question: sats that go dark and interferers that appear.
+
+      sats:        ids of the failed sats.
+      interferers: interferers[interferer_id] = (x, y, z) of the new ones.
+    """
+
+    def __init__(self, name: str, sats: list = (), interferers: dict = None):
+        self.name = name
+        self.sats = list(sats)
+        self.interferers = dict(interferers or {})
+
+    @classmethod
+    def from_json(cls, request: dict, default_name: str) -> 'OutageCase':
+        """
+        Returns: the case described by a {"name", "sats", "interferers"} JSON
+        object; interferers maps ids to [x, y, z]. Raises ValueError if it's
+        malformed.
+        """
+        if not isinstance(request, dict):
+            raise ValueError('an outage set must be a JSON object')
+        interferers = request.get('interferers', {})
+        if not isinstance(interferers, dict):
+            raise ValueError('interferers must map ids to [x, y, z]')
+        return cls(str(request.get('name', default_name)), [str(sat) for sat in request.get('sats', [])],
+                   {str(ident): bp.Vector3(*map(float, position)) for ident, position in interferers.items()})
+
+
+class OutageReport:
+    """
+    What one outage set did to the plan.
+
+      lost:       users whose beam was removed: on a failed sat, or on a link
+                  a new interferer blocks.
+      recovered:  those of them re-homed on another sat.
+      changes:    the beams removed and added, as ChangeLog.changes() gives them.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.failed_sats = 0
+        self.new_interferers = 0
+        self.users = 0
+        self.coverage_before = 0.0
+        self.coverage_after = 0.0
+        self.lost = 0
+        self.recovered = 0
+        self.elapsed_s = 0.0
+        self.changes = []
+        self.error = None
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+#%% What-if view of the links
+
+class OutageVisibility:
+    """
+    A VisibilityIndex as seen during an outage: links to failed sats are
+    gone, and so are links a new interferer blocks. Only the links asked
+    about are tested against the new interferers.
+
+    Offers the same lookups as VisibilityIndex, so a PlanState can use it.
+    """
+
+    def __init__(self, index, failed: set, interferer_pos: np.ndarray):
+        self.index = index
+        self.geometry = index.geometry
+        self.failed = failed
+        self.interferer_pos = interferer_pos
+
+    def usable(self, users: np.ndarray, sats: np.ndarray) -> np.ndarray:
+        ok = np.array([sat not in self.failed for sat in sats.tolist()], dtype=bool)
+        if len(self.interferer_pos) and ok.any():
+            rows = np.flatnonzero(ok)
+            ok[rows[self.geometry.interferer_blocked_mask(users[rows], sats[rows], self.interferer_pos)]] = False
+        return ok
+
+    def sats_for_user(self, user: int) -> np.ndarray:
+        sats = self.index.sats_for_user(user)
+        return sats[self.usable(np.full(len(sats), user, dtype=np.intp), sats)]
+
+    def users_for_sat(self, sat: int) -> np.ndarray:
+        users = self.index.users_for_sat(sat)
+        return users[self.usable(users, np.full(len(users), sat, dtype=np.intp))]
+
+    def has_link(self, user: int, sat: int) -> bool:
+        if not self.index.has_link(user, sat):
+            return False
+        return bool(self.usable(np.array([user], dtype=np.intp), np.array([sat], dtype=np.intp))[0])
+
+#%% What-if engine
+
+class WhatIf:
+    """
+    Answers outage what-ifs against one loaded scenario and plan.
+
+    Each case only touches the beams it invalidates and the sats its
+    displaced users are re-homed on; those sats are snapshotted first and
+    put back afterwards, so the base plan is the same for every case.
+    """
+
+    def __init__(self, scenario: dict, solution, context: PlanningContext = None):
+        self.scenario = scenario
+        self.context = context if context is not None else PlanningContext(scenario)
+        self.geometry = self.context.geometry
+        self.plan = self.context.new_plan()
+        self.plan.load_solution(solution)
+        # The base plan's beams as arrays, for testing them against new interferers.
+        self.table = BeamTable.from_plan(self.plan)
+        self.sat_rows, self.beams, self.user_rows, _ = self.table.links()
+
+    def evaluate(self, case: OutageCase) -> OutageReport:
+        """
+        Removes the beams case invalidates, and re-homes their users on the
+        sats left that have a spare beam and a compatible color, fewest
+        options first and the sat with the most spare beams first.
+
+        Returns: the case's OutageReport. The base plan is left as it was.
+        """
+        start = time.perf_counter()
+        report = OutageReport(case.name)
+        geometry = self.geometry
+        plan = self.plan
+        unknown = [sat_id for sat_id in case.sats if sat_id not in geometry.sat_index]
+        if unknown:
+            report.error = f"unknown sat {unknown[0]}"
+            return report
+        report.failed_sats = len(set(case.sats))
+        report.new_interferers = len(case.interferers)
+        report.users = len(self.scenario['users'])
+        report.coverage_before = plan.coverage_rate()
+
+        failed = {geometry.sat_index[sat_id] for sat_id in case.sats}
+        interferer_pos = np.array(list(case.interferers.values()), dtype=np.float64).reshape(-1, 3)
+        view = OutageVisibility(self.context.visibility, failed, interferer_pos)
+        log = ChangeLog(plan)
+        snapshots = {}
+
+        def touch(sat_id: str):
+            if sat_id not in snapshots:
+                state = plan.sat_states.get(sat_id)
+                snapshots[sat_id] = state.snapshot() if state is not None else None
+            log.touch(sat_id)
+
+        # Beams on failed sats, then beams on links the new interferers block.
+        hit = np.array([sat in failed for sat in self.sat_rows.tolist()], dtype=bool)
+        if len(interferer_pos) and len(hit):
+            rest = np.flatnonzero(~hit)
+            hit[rest[geometry.interferer_blocked_mask(self.user_rows[rest], self.sat_rows[rest],
+                                                      interferer_pos)]] = True
+        displaced = []
+        for i in np.flatnonzero(hit).tolist():
+            sat_id = geometry.sat_ids[self.sat_rows[i]]
+            touch(sat_id)
+            plan.unassign(sat_id, int(self.beams[i]))
+            displaced.append(int(self.user_rows[i]))
+        report.lost = len(displaced)
+
+        plan.visibility = view
+        recovered = []
+        try:
+            options = {user: view.sats_for_user(user) for user in displaced}
+            for user in sorted(displaced, key=lambda user: len(options[user])):
+                user_id = geometry.user_ids[user]
+                sats = [geometry.sat_ids[sat] for sat in options[user].tolist()]
+                sats.sort(key=lambda sat_id: len(plan.sat_states[sat_id].beams) if sat_id in plan.sat_states else 0)
+                for sat_id in sats:
+                    touch(sat_id)
+                    if plan.try_assign(user_id, sat_id) is not None:
+                        recovered.append(user_id)
+                        break
+            report.recovered = len(recovered)
+            report.coverage_after = plan.coverage_rate()
+            report.changes = log.changes()
+        finally:
+            # Put the base plan back.
+            plan.visibility = self.context.visibility
+            for user_id in recovered:
+                plan.covered_users.discard(user_id)
+            for user in displaced:
+                plan.covered_users.add(geometry.user_ids[user])
+            for sat_id, snapshot in snapshots.items():
+                if snapshot is None:
+                    plan.sat_states.pop(sat_id, None)
+                else:
+                    plan.sat_states[sat_id].restore(snapshot)
+        report.elapsed_s = time.perf_counter() - start
+        return report
+
+
+# The WhatIf a pool worker evaluates against. Installed once per worker by
+# init_worker; with the fork start method it's inherited, never pickled.
+worker_whatif = None
+
+def init_worker(whatif: WhatIf):
+    global worker_whatif
+    worker_whatif = whatif
+
+
+def worker_evaluate(case: OutageCase) -> OutageReport:
+    return worker_whatif.evaluate(case)
+
+
+def evaluate_all(whatif: WhatIf, cases: list, workers: int = 1):
+    """
+    Evaluates every case, on workers processes.
+
+    Yields: an OutageReport per case, in order.
+    """
+    if workers <= 1 or len(cases) <= 1:
+        for case in cases:
+            yield whatif.evaluate(case)
+        return
+    start_method = 'fork' if 'fork' in mp.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(start_method),
+                             initializer=init_worker, initargs=(whatif,)) as pool:
+        yield from pool.map(worker_evaluate, cases)
+
+#%% Input
+
+def read_solution(filename: str, scenario: dict) -> dict:
+    """
+    Reads a solution file written by beamplanning.py.
+
+    Returns: solution[sat_id][beam_id] = (user_id, color_id). Raises
+    ValueError on a malformed line or an id the scenario doesn't have; the
+    plan itself is checked by main().
+    """
+    solution = {}
+    with open(filename) as f:
+        for line in f:
+            parts = line.split()
+            if '#' in line or not parts:
+                continue
+            if len(parts) != 8 or parts[0] != 'sat' or parts[2] != 'beam' or parts[4] != 'user' or parts[6] != 'color':
+                raise ValueError(f"invalid line: {line.strip()}")
+            sat_id, beam_id, user_id, color_id = parts[1], parts[3], parts[5], parts[7]
+            if sat_id not in scenario['sats'] or user_id not in scenario['users'] \
+                    or beam_id not in bp.valid_beam_ids or color_id not in bp.valid_color_ids:
+                raise ValueError(f"invalid id in line: {line.strip()}")
+            solution.setdefault(sat_id, {})[int(beam_id)] = (user_id, color_id)
+    return solution
+
+
+def read_cases(filename: str) -> list:
+    """
+    Returns: the outage sets in a file of JSON lines, one OutageCase.from_json
+    object per line.
+    """
+    cases = []
+    with (sys.stdin if filename == '-' else open(filename)) as f:
+        for line in f:
+            if line.strip():
+                cases.append(OutageCase.from_json(json.loads(line), f"set{len(cases) + 1}"))
+    return cases
+
+
+def random_cases(scenario: dict, count: int, size: int, seed: int = 0) -> list:
+    """
+    Returns: count outage sets of size random sats each.
+    """
+    rng = random.Random(seed)
+    sat_ids = list(scenario['sats'])
+    return [OutageCase(f"random{i + 1}", rng.sample(sat_ids, min(size, len(sat_ids)))) for i in range(count)]
+
+#%% Main
+
+def main() -> int:
+    """
+    Entry point. Plans the scenario, or reads its solution, then reports what
+    each outage set would cost and how much of it re-homing recovers.
+
+    Returns: exit code.
+    """
+    argu = argp.ArgumentParser(prog=f"python3.7 {sys.argv[0]}", description='Starlink sat outage what-ifs')
+    argu.add_argument('scenario', metavar='/path/to/scenario.txt', help='Scenario the plan is for.')
+    argu.add_argument('--solution', help='Existing solution file; planned from scratch if not given.')
+    argu.add_argument('--fail', action='append', metavar='SAT[,SAT...]',
+                      help='Sats that go dark together, as one outage set; repeat for several.')
+    argu.add_argument('--outages', metavar='FILE',
+                      help="JSON-line outage sets, {\"name\", \"sats\": [...], \"interferers\": {id: [x, y, z]}}, "
+                           "or '-' for stdin.")
+    argu.add_argument('--random', type=int, default=0, metavar='N', help='Also try N random outage sets.')
+    argu.add_argument('--size', type=int, default=default_outage_size,
+                      help=f'Sats per random outage set (default: {default_outage_size}).')
+    argu.add_argument('--planner', choices=bp.planners, default='greedy',
+                      help='Planner when no --solution is given (default: greedy).')
+    argu.add_argument('--seed', type=int, default=0, help='Planner and random outage seed (default: 0).')
+    argu.add_argument('--workers', type=int, default=1, help='Evaluate outage sets in this many processes (default: 1).')
+    argu.add_argument('--json', metavar='FILE', help="Write the reports, with their beam changes, as JSON ('-' for stdout).")
+    argu.add_argument('--no-cache', dest='use_cache', action='store_false', help="Don't use the scenario binary cache.")
+    argup = argu.parse_args()
+
+    scenario = {}
+    if not bp.read_scenario(argup.scenario, scenario, argup.use_cache):
+        return -1
+    try:
+        cases = [OutageCase(f"fail{i + 1}", sats.split(',')) for i, sats in enumerate(argup.fail or [])]
+        if argup.outages:
+            cases += read_cases(argup.outages)
+        cases += random_cases(scenario, argup.random, argup.size, argup.seed)
+        solution = read_solution(argup.solution, scenario) if argup.solution else None
+    except (OSError, ValueError, TypeError) as error:
+        print(error, file=sys.stderr)
+        return -1
+    if not cases:
+        print("No outage sets given; use --fail, --outages or --random.", file=sys.stderr)
+        return -1
+
+    context = PlanningContext(scenario)
+    if solution is None:
+        _, solution = bp.planning_optimizer(scenario, argup.planner, seed=argup.seed, context=context)
+    else:
+        # The what-ifs start from the plan as it stands, so it has to be valid.
+        violations = find_violations(scenario, solution, context.geometry)
+        if violations:
+            for violation in violations:
+                print(format_violation(violation), file=sys.stderr)
+            print(f"{argup.solution}: {len(violations)} violations; fix the plan or leave out --solution.",
+                  file=sys.stderr)
+            return -1
+    whatif = WhatIf(scenario, solution, context)
+
+    print(f"{'outage':16s} {'sats':>5s} {'intf':>5s} {'lost':>6s} {'recovered':>9s} {'before':>8s} "
+          f"{'after':>8s} {'ms':>8s}", file=sys.stderr)
+    reports = []
+    failed = 0
+    for report in evaluate_all(whatif, cases, argup.workers):
+        reports.append(report)
+        if report.error:
+            failed += 1
+            print(f"{report.name:16s} error: {report.error}", file=sys.stderr)
+            continue
+        print(f"{report.name:16s} {report.failed_sats:5d} {report.new_interferers:5d} {report.lost:6d} "
+              f"{report.recovered:9d} {report.coverage_before:8.4f} {report.coverage_after:8.4f} "
+              f"{report.elapsed_s * 1000:8.1f}", file=sys.stderr)
+
+    if argup.json:
+        text = json.dumps([report.as_dict() for report in reports], indent=1)
+        if argup.json == '-':
+            print(text)
+        else:
+            with open(argup.json, 'w') as f:
+                f.write(text + '\n')
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import random
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from math import asin, atan2, degrees, floor
+
+from beamplanning import beam_planning
+from feasibility import PlanState
+
+#%% Parameters
+
+# Components with more users than this are split further on a lat/lon grid.
+max_part_users = 2500
+
+# Size of the lat/lon grid cells used to split large components, degrees.
+part_cell_degrees = 20.0
+
+#%% Partitioning
+
+def connected_components(visibility, n_users: int, n_sats: int) -> list:
+    """
+    Splits the user/sat visibility graph into connected components. Users
+    with no usable sat are left out.
+
+    Returns: a list of (user rows, sat rows) per component.
+    """
+    # Union-find over users (0..n_users-1) and sats (n_users..).
+    parent = list(range(n_users + n_sats))
+
+    def find(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for user in range(n_users):
+        root = find(user)
+        for sat in visibility.sats_for_user(user).tolist():
+            other = find(n_users + sat)
+            if other != root:
+                parent[other] = root
+
+    components = {}
+    for user in range(n_users):
+        if len(visibility.sats_for_user(user)):
+            components.setdefault(find(user), ([], set()))[0].append(user)
+    for sat in range(n_sats):
+        if len(visibility.users_for_sat(sat)):
+            root = find(n_users + sat)
+            components[root][1].add(sat)
+    return [(users, sorted(sats)) for users, sats in components.values()]
+
+
+def grid_cells(geometry, visibility, users: list, cell_degrees: float = part_cell_degrees) -> list:
+    """
+    Splits users on a lat/lon grid. A sat visible from more than one cell
+    goes to the one where most users can see it, so no two cells plan the
+    same sat's beams; users near a boundary only plan onto their own cell's
+    sats, and are re-homed across it when the plans are merged.
+
+    Returns: a list of (user rows, sat rows) per non-empty cell.
+    """
+    cells = {}
+    for user in users:
+        x, y, z = geometry.user_up[user].tolist()
+        lat = degrees(asin(min(1.0, max(-1.0, z))))
+        lon = degrees(atan2(y, x))
+        cells.setdefault((floor(lat / cell_degrees), floor(lon / cell_degrees)), []).append(user)
+
+    # Each sat goes to the cell with the most users that can see it.
+    sat_counts = {}
+    for cell, cell_users in enumerate(cells.values()):
+        for user in cell_users:
+            for sat in visibility.sats_for_user(user).tolist():
+                counts = sat_counts.setdefault(sat, {})
+                counts[cell] = counts.get(cell, 0) + 1
+    cell_sats = [[] for _ in cells]
+    for sat, counts in sorted(sat_counts.items()):
+        cell_sats[max(counts, key=lambda cell: (counts[cell], -cell))].append(sat)
+    return [(cell_users, sats) for cell_users, sats in zip(cells.values(), cell_sats)]
+
+
+def partition_scenario(geometry, visibility, max_users: int = max_part_users) -> list:
+    """
+    Returns: (user rows, sat rows) parts that can be planned separately:
+    the connected components of the visibility graph, with any component
+    larger than max_users split on a lat/lon grid.
+    """
+    parts = []
+    for users, sats in connected_components(visibility, len(geometry.user_ids), len(geometry.sat_ids)):
+        if len(users) > max_users:
+            parts.extend(grid_cells(geometry, visibility, users))
+        else:
+            parts.append((users, sats))
+    return parts
+
+#%% Planning
+
+def sub_scenario(scenario: dict, geometry, users: list, sats: list) -> dict:
+    """
+    Returns: a scenario holding only the given user and sat rows, and every interferer.
+    """
+    return {
+        'sats': {geometry.sat_ids[s]: scenario['sats'][geometry.sat_ids[s]] for s in sats},
+        'users': {geometry.user_ids[u]: scenario['users'][geometry.user_ids[u]] for u in users},
+        'interferers': scenario['interferers'],
+    }
+
+
+def plan_part(part_scenario: dict, geometry, visibility, planner: str, seed: int,
+              time_limit: float = None) -> dict:
+    """
+    Plans one part on its own, against its geometry and visibility index,
+    sliced from the whole scenario's. time_limit is the part's share of the
+    exact planner's search time.
+
+    Returns: the part's solution.
+    """
+    plan = PlanState(part_scenario, geometry, visibility)
+    if planner == 'matching':
+        from matching import matching_planning
+        solution, _ = matching_planning(part_scenario, plan)
+        return solution
+    if planner == 'priority':
+        from priority import priority_planning
+        solution, _ = priority_planning(part_scenario, plan, seed)
+        return solution
+    if planner == 'exact':
+        from exact import exact_planning
+        solution, _, _ = exact_planning(part_scenario, plan, seed, time_limit, verbose=False)
+        return solution
+    rng = random.Random(seed)
+    sat_list = list(part_scenario['sats'])
+    usr_list = list(part_scenario['users'])
+    rng.shuffle(sat_list)
+    rng.shuffle(usr_list)
+    solution, _ = beam_planning(part_scenario, usr_list, sat_list, plan)
+    return solution
+
+
+def plan_part_args(args) -> dict:
+    return plan_part(*args)
+
+
+def partitioned_planning(context, planner: str = 'greedy', workers: int = 1, seed: int = 0,
+                         deadline: float = None):
+    """
+    Plans each part of the scenario separately, on workers processes, then
+    merges the parts' plans into one. The exact planner's search time,
+    deadline seconds or exact_time_limit, is split across the parts by how
+    many users each has.
+
+    Parts never share a sat, so their plans are loaded as they are; then
+    the users they left uncovered, such as those by a cell boundary whose
+    sats went to the next cell, are re-homed most constrained first onto the
+    emptiest sats they can see. The boundaries still cost some coverage
+    against planning the whole scenario at once; partitioning trades it for
+    time.
+
+    Returns: solution, coverage rate
+    """
+    scenario, geometry, visibility = context.scenario, context.geometry, context.visibility
+    parts = partition_scenario(geometry, visibility)
+    time_limit = None
+    if planner == 'exact':
+        from exact import exact_time_limit
+        time_limit = deadline if deadline is not None else exact_time_limit
+    n_part_users = sum(len(users) for users, _ in parts)
+    tasks = []
+    for i, (users, sats) in enumerate(parts):
+        part_geometry = geometry.subset(users, sats)
+        part_limit = time_limit * len(users) / n_part_users if time_limit is not None else None
+        tasks.append((sub_scenario(scenario, geometry, users, sats), part_geometry,
+                      visibility.subset(part_geometry, users, sats), planner, seed + i, part_limit))
+
+    if workers > 1 and len(tasks) > 1:
+        start_method = 'fork' if 'fork' in mp.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(start_method)) as pool:
+            part_solutions = list(pool.map(plan_part_args, tasks))
+    else:
+        part_solutions = [plan_part_args(task) for task in tasks]
+
+    # The parts plan disjoint sats and users, so their plans just add up.
+    plan = context.new_plan()
+    plan.load_solution({sat_id: beams for part_solution in part_solutions for sat_id, beams in part_solution.items()})
+
+    # Cover whoever the parts left uncovered, e.g. users by a boundary whose
+    # cell owns none of their sats: most constrained first, onto the emptiest
+    # sats they can see first.
+    uncovered = [user for user, user_id in enumerate(geometry.user_ids)
+                 if user_id not in plan.covered_users and len(visibility.sats_for_user(user))]
+    uncovered.sort(key=lambda user: len(visibility.sats_for_user(user)))
+    for user in uncovered:
+        sat_ids = [geometry.sat_ids[sat] for sat in visibility.sats_for_user(user).tolist()]
+        sat_ids.sort(key=lambda sat_id: len(plan.sat_states[sat_id].beams) if sat_id in plan.sat_states else 0)
+        for sat_id in sat_ids:
+            if plan.try_assign(geometry.user_ids[user], sat_id) is not None:
+                break
+
+    return plan.solution(), plan.coverage_rate()
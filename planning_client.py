@@ -0,0 +1,148 @@
+import sys, json, time, random, asyncio
+from math import cos, sin, radians
+import argparse as argp
+
+import beamplanning as bp
+
+#%% Parameters
+
+# Share of each kind of random delta, in order: join, leave, move_sat, add_interferer.
+random_mix = [0.4, 0.3, 0.29, 0.01]
+
+# How far a random move_sat turns a sat about the earth's axis, degrees.
+random_sat_step = 0.05
+
+# Radius of the orbit random interferers are put in, km (GEO).
+random_interferer_radius = 42164.0
+
+#%% Random deltas
+
+def random_requests(scenario: dict, count: int, seed: int = 0):
+    """
+    Yields: count random delta requests against scenario: new users near
+    existing ones, users leaving, sats stepping along their orbit and, rarely,
+    a new GEO interferer.
+    """
+    rng = random.Random(seed)
+    users = list(scenario['users'])
+    sats = dict(scenario['sats'])
+    next_id = 0
+    for _ in range(count):
+        kind = rng.choices(['join', 'leave', 'move_sat', 'add_interferer'], random_mix)[0]
+        if kind == 'join' or (kind == 'leave' and not users):
+            x, y, z = scenario['users'][rng.choice(users)] if users else (6371.0, 0.0, 0.0)
+            user = f"client-{seed}-{next_id}"
+            next_id += 1
+            users.append(user)
+            scenario['users'][user] = bp.Vector3(x + rng.uniform(-20, 20), y + rng.uniform(-20, 20), z)
+            yield {'op': 'join', 'user': user, 'position': list(scenario['users'][user])}
+        elif kind == 'leave':
+            user = users.pop(rng.randrange(len(users)))
+            yield {'op': 'leave', 'user': user}
+        elif kind == 'move_sat':
+            sat = rng.choice(list(sats))
+            x, y, z = sats[sat]
+            c, s = cos(radians(random_sat_step)), sin(radians(random_sat_step))
+            sats[sat] = bp.Vector3(c * x - s * y, s * x + c * y, z)
+            yield {'op': 'move_sat', 'sat': sat, 'position': list(sats[sat])}
+        else:
+            angle = radians(rng.uniform(0, 360))
+            interferer = f"client-{seed}-{next_id}"
+            next_id += 1
+            yield {'op': 'add_interferer', 'interferer': interferer,
+                   'position': [random_interferer_radius * cos(angle), random_interferer_radius * sin(angle), 0.0]}
+
+#%% Client
+
+async def send_all(path: str, requests, verbose: bool) -> list:
+    """
+    Sends requests, dicts or ready-made JSON lines, to the planning service
+    on the Unix socket at path, one at a time, waiting for each response.
+
+    Returns: a list of (request, response, round trip seconds).
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    results = []
+    try:
+        for request in requests:
+            start = time.perf_counter()
+            line = request if isinstance(request, str) else json.dumps(request)
+            writer.write((line + '\n').encode())
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                print("Service closed the connection.", file=sys.stderr)
+                break
+            response = json.loads(line)
+            results.append((request, response, time.perf_counter() - start))
+            if verbose:
+                print(json.dumps(response))
+    finally:
+        writer.close()
+    return results
+
+
+def read_requests(stream):
+    """
+    Yields: each non-empty line of stream, sent to the service as it is.
+    """
+    for line in stream:
+        if line.strip():
+            yield line.strip()
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+#%% Main
+
+def main() -> int:
+    """
+    Entry point. Sends requests to a running planning_service.py and prints
+    the responses, or with --random, sends random deltas and reports latency.
+
+    Returns: exit code.
+    """
+    argu = argp.ArgumentParser(prog=f"python3.7 {sys.argv[0]}", description='Test client for planning_service.py')
+    argu.add_argument('socket', help="The service's Unix socket.")
+    argu.add_argument('--requests', default='-', help="File of JSON-line requests, or '-' for stdin (default).")
+    argu.add_argument('--random', type=int, default=0, metavar='N',
+                      help='Send N random deltas against --scenario instead, and report latency.')
+    argu.add_argument('--scenario', help='The scenario the service was started with, for --random.')
+    argu.add_argument('--seed', type=int, default=0, help='Seed for --random (default: 0).')
+    argup = argu.parse_args()
+
+    if argup.random:
+        if not argup.scenario:
+            print("--random needs --scenario.", file=sys.stderr)
+            return -1
+        scenario = {}
+        if not bp.read_scenario(argup.scenario, scenario):
+            return -1
+        requests = random_requests(scenario, argup.random, argup.seed)
+        results = asyncio.run(send_all(argup.socket, requests, False))
+    elif argup.requests == '-':
+        results = asyncio.run(send_all(argup.socket, read_requests(sys.stdin), True))
+    else:
+        with open(argup.requests) as f:
+            results = asyncio.run(send_all(argup.socket, read_requests(f), True))
+
+    failed = [response for _, response, _ in results if not response.get('ok')]
+    for response in failed:
+        print(f"error: {response.get('error')}", file=sys.stderr)
+    if argup.random and results:
+        by_op = {}
+        for request, response, round_trip in results:
+            by_op.setdefault(request['op'], []).append((response.get('elapsed_ms', 0.0), round_trip * 1000))
+        print(f"{'op':16s} {'count':>6s} {'median ms':>10s} {'p95 ms':>8s} {'max ms':>8s} {'round trip ms':>14s}")
+        for op, timings in by_op.items():
+            service_ms = [t for t, _ in timings]
+            print(f"{op:16s} {len(timings):6d} {percentile(service_ms, 0.5):10.2f} {percentile(service_ms, 0.95):8.2f} "
+                  f"{max(service_ms):8.2f} {percentile([t for _, t in timings], 0.5):14.2f}")
+        print(f"coverage after {len(results)} deltas: {results[-1][1].get('coverage', 0.0):.4f}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
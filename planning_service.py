@@ -0,0 +1,370 @@
+import sys, os, json, time, asyncio
+import argparse as argp
+
+import numpy as np
+
+import beamplanning as bp
+from feasibility import PlanState, SatelliteState
+from optimizer import PlanningContext
+from replan import keep_beams
+from visibility import MutableVisibility
+
+#%% Parameters
+
+# Requests the service understands, and the fields each one needs.
+request_fields = {
+    'join': ['user', 'position'],
+    'leave': ['user'],
+    'move_sat': ['sat', 'position'],
+    'add_interferer': ['interferer', 'position'],
+    'stats': [],
+    'solution': [],
+    'shutdown': [],
+}
+
+#%% Change tracking
+
+class ChangeLog:
+    """
+    Records the beams of every sat an update touches, so the update can be
+    reported as the beams it removed and added.
+
+    Every change to a sat must come after touch() was called for it.
+    """
+
+    def __init__(self, plan: PlanState):
+        self.plan = plan
+        self.before = {}
+
+    def touch(self, sat_id: str):
+        if sat_id not in self.before:
+            state = self.plan.sat_states.get(sat_id)
+            self.before[sat_id] = dict(state.beams) if state is not None else {}
+
+    def changes(self) -> list:
+        """
+        Returns: one {'action': 'remove'|'add', 'sat', 'beam', 'user', 'color'}
+        dict per beam that differs, removals first.
+        """
+        removed = []
+        added = []
+        for sat_id, before in self.before.items():
+            state = self.plan.sat_states.get(sat_id)
+            after = state.beams if state is not None else {}
+            for beam_id, beam in before.items():
+                if after.get(beam_id) != beam:
+                    removed.append(beam_entry('remove', sat_id, beam_id, beam))
+            for beam_id, beam in after.items():
+                if before.get(beam_id) != beam:
+                    added.append(beam_entry('add', sat_id, beam_id, beam))
+        return removed + added
+
+
+def beam_entry(action: str, sat_id: str, beam_id: int, beam: tuple) -> dict:
+    user_id, color_id = beam
+    return {'action': action, 'sat': sat_id, 'beam': beam_id, 'user': user_id, 'color': color_id}
+
+def read_position(position) -> bp.Vector3:
+    """
+    Returns: position, a request's [x, y, z], as a Vector3. Raises ValueError
+    unless it is three finite numbers away from the center of the earth,
+    which the angle checks need.
+    """
+    try:
+        values = [float(value) for value in position]
+    except (TypeError, ValueError):
+        raise ValueError(f"position must be [x, y, z] numbers, not {position!r}") from None
+    if len(values) != 3 or not all(np.isfinite(values)):
+        raise ValueError(f"position must be 3 finite numbers, not {position!r}")
+    if not any(values):
+        raise ValueError("position can't be the center of the earth, [0, 0, 0]")
+    return bp.Vector3(*values)
+
+#%% Planning service
+
+class PlanningService:
+    """
+    Keeps a scenario, its geometry and a plan in memory, and applies changes
+    to the scenario as they arrive, reworking only the parts of the plan they
+    affect.
+    """
+
+    def __init__(self, scenario: dict, planner: str = 'greedy', seed: int = 0):
+        self.scenario = scenario
+        context = PlanningContext(scenario)
+        _, solution = bp.planning_optimizer(scenario, planner, seed=seed, context=context)
+        self.geometry = context.geometry
+        self.visibility = MutableVisibility(context.visibility)
+        self.plan = PlanState(scenario, self.geometry, self.visibility)
+        self.plan.load_solution(solution)
+        # Which sat each covered user is on.
+        self.user_sat = {user: sat_id for sat_id, beams in solution.items() for user, _ in beams.values()}
+
+    #%% Plan edits
+
+    def unassign_user(self, log: ChangeLog, user: str):
+        sat_id = self.user_sat.pop(user, None)
+        if sat_id is None:
+            return
+        log.touch(sat_id)
+        state = self.plan.sat_states[sat_id]
+        for beam_id, (beam_user, _) in state.beams.items():
+            if beam_user == user:
+                self.plan.unassign(sat_id, beam_id)
+                return
+
+    def place(self, log: ChangeLog, user: str) -> bool:
+        """
+        Puts an uncovered user on any sat that can take it.
+
+        Returns: success or failure.
+        """
+        if user in self.plan.covered_users or user not in self.scenario['users']:
+            return False
+        row = self.geometry.user_index[user]
+        for sat in self.visibility.sats_for_user(row).tolist():
+            sat_id = self.geometry.sat_ids[sat]
+            log.touch(sat_id)
+            if self.plan.try_assign(user, sat_id) is not None:
+                self.user_sat[user] = sat_id
+                return True
+        return False
+
+    def fill_sat(self, log: ChangeLog, sat: int):
+        """
+        Offers sat's spare beams to the uncovered users it can serve.
+        """
+        sat_id = self.geometry.sat_ids[sat]
+        state = self.plan.sat_state(sat_id)
+        user_ids = self.geometry.user_ids
+        for user in self.visibility.users_for_sat(sat).tolist():
+            if state.is_full():
+                break
+            user_id = user_ids[user]
+            if user_id in self.plan.covered_users:
+                continue
+            log.touch(sat_id)
+            if self.plan.try_assign(user_id, sat_id) is not None:
+                self.user_sat[user_id] = sat_id
+
+    #%% Requests
+
+    def join(self, log: ChangeLog, user: str, position) -> dict:
+        """
+        Adds a user, or moves one that's already there, and tries to serve it.
+        """
+        position = read_position(position)
+        self.unassign_user(log, user)
+        self.scenario['users'][user] = position
+        row = self.geometry.set_user(user, position)
+        self.visibility.refresh_user(row)
+        return {'covered': self.place(log, user)}
+
+    def leave(self, log: ChangeLog, user: str) -> dict:
+        """
+        Removes a user, then offers its freed beam to the sat's uncovered users.
+        """
+        if user not in self.scenario['users']:
+            raise ValueError(f"unknown user {user}")
+        sat_id = self.user_sat.get(user)
+        self.unassign_user(log, user)
+        del self.scenario['users'][user]
+        self.visibility.remove_user(self.geometry.user_index[user])
+        if sat_id is not None:
+            self.fill_sat(log, self.geometry.sat_index[sat_id])
+        return {}
+
+    def move_sat(self, log: ChangeLog, sat_id: str, position) -> dict:
+        """
+        Moves a sat, or adds a new one. Its beams that still fit are kept as
+        they are, the users it had to drop are re-homed, and any spare beams
+        go to uncovered users it now sees.
+        """
+        position = read_position(position)
+        log.touch(sat_id)
+        old_beams = {}
+        if sat_id in self.plan.sat_states:
+            old_beams = dict(self.plan.sat_states[sat_id].beams)
+            for user, _ in old_beams.values():
+                self.plan.covered_users.discard(user)
+                self.user_sat.pop(user, None)
+        self.scenario['sats'][sat_id] = position
+        sat = self.geometry.set_sat(sat_id, position)
+        live_users = [self.geometry.user_index[user] for user in self.scenario['users']]
+        self.visibility.refresh_sat(sat, live_users)
+
+        # The sat's frame and beam directions all changed; start it afresh.
+        self.plan.sat_states[sat_id] = SatelliteState(sat_id, self.geometry)
+        broken = keep_beams(self.plan, sat_id, old_beams)
+        for user, _ in self.plan.sat_states[sat_id].beams.values():
+            self.user_sat[user] = sat_id
+        rehomed = sum(self.place(log, user) for user, _ in broken)
+        self.fill_sat(log, sat)
+        return {'kept': len(old_beams) - len(broken), 'dropped': len(broken), 'rehomed': rehomed}
+
+    def add_interferer(self, log: ChangeLog, interferer_id: str, position) -> dict:
+        """
+        Adds an interferer, dropping the links it now blocks and re-homing
+        the users whose beams were on them.
+        """
+        if interferer_id in self.scenario['interferers']:
+            raise ValueError(f"interferer {interferer_id} already exists")
+        position = read_position(position)
+        self.scenario['interferers'][interferer_id] = position
+        self.geometry.set_interferer(interferer_id, position)
+        dropped = self.visibility.recheck_links(np.array([position], dtype=np.float64))
+        user_ids, sat_ids = self.geometry.user_ids, self.geometry.sat_ids
+        broken = [user_ids[user] for user, sat in dropped if self.user_sat.get(user_ids[user]) == sat_ids[sat]]
+        freed = {self.user_sat[user] for user in broken}
+        for user in broken:
+            self.unassign_user(log, user)
+        rehomed = sum(self.place(log, user) for user in broken)
+        for sat_id in freed:
+            self.fill_sat(log, self.geometry.sat_index[sat_id])
+        return {'blocked_links': len(dropped), 'dropped': len(broken), 'rehomed': rehomed}
+
+    def handle(self, request: dict) -> dict:
+        """
+        Applies one request.
+
+        Returns: the response: 'ok', the beam 'changes' for updates, the
+        coverage rate and how long it took, or 'error' on a bad request.
+        """
+        start = time.perf_counter()
+        op = request.get('op')
+        if op not in request_fields:
+            return {'ok': False, 'error': f"unknown op {op!r}"}
+        missing = [field for field in request_fields[op] if field not in request]
+        if missing:
+            return {'ok': False, 'error': f"{op} needs {', '.join(missing)}"}
+
+        response = {'ok': True}
+        if op == 'solution':
+            response['beams'] = [beam_entry('add', sat_id, beam_id, beam)
+                                 for sat_id, beams in self.plan.solution().items()
+                                 for beam_id, beam in beams.items()]
+        elif op in ('join', 'leave', 'move_sat', 'add_interferer'):
+            log = ChangeLog(self.plan)
+            try:
+                if op == 'join':
+                    response.update(self.join(log, str(request['user']), request['position']))
+                elif op == 'leave':
+                    response.update(self.leave(log, str(request['user'])))
+                elif op == 'move_sat':
+                    response.update(self.move_sat(log, str(request['sat']), request['position']))
+                else:
+                    response.update(self.add_interferer(log, str(request['interferer']), request['position']))
+            except (ValueError, TypeError) as error:
+                response = {'ok': False, 'error': str(error)}
+            response['changes'] = log.changes()
+        response['coverage'] = self.plan.coverage_rate() if self.scenario['users'] else 0.0
+        response['users'] = len(self.scenario['users'])
+        response['elapsed_ms'] = (time.perf_counter() - start) * 1000
+        return response
+
+#%% Transports
+
+async def serve_stream(service: PlanningService, reader, write, lock: asyncio.Lock) -> bool:
+    """
+    Answers JSON-line requests from reader, one response line each, through
+    write(bytes).
+
+    Returns: whether a shutdown was requested.
+    """
+    while True:
+        line = await reader.readline()
+        if not line:
+            return False
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            request = None
+            response = {'ok': False, 'error': f"bad JSON: {error}"}
+        else:
+            if not isinstance(request, dict):
+                response = {'ok': False, 'error': 'request must be a JSON object'}
+            else:
+                async with lock:
+                    response = service.handle(request)
+        await write((json.dumps(response) + '\n').encode())
+        if response.get('ok') and isinstance(request, dict) and request.get('op') == 'shutdown':
+            return True
+
+
+async def serve_socket(service: PlanningService, path: str):
+    """
+    Serves clients on a Unix socket at path until one asks for a shutdown.
+    """
+    lock = asyncio.Lock()
+    stopped = asyncio.Event()
+
+    async def client(reader, writer):
+        async def write(data: bytes):
+            writer.write(data)
+            await writer.drain()
+        try:
+            if await serve_stream(service, reader, write, lock):
+                stopped.set()
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.remove(path)
+    server = await asyncio.start_unix_server(client, path)
+    print(f"Planning service listening on {path}", file=sys.stderr)
+    async with server:
+        await stopped.wait()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def serve_stdio(service: PlanningService):
+    """
+    Serves requests from stdin, answering on stdout, until stdin closes or a
+    shutdown is requested.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    async def write(data: bytes):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    await serve_stream(service, reader, write, asyncio.Lock())
+
+#%% Main
+
+def main() -> int:
+    """
+    Entry point. Plans the scenario, then serves delta updates to it.
+
+    Returns: exit code.
+    """
+    argu = argp.ArgumentParser(prog=f"python3.7 {sys.argv[0]}", description='Starlink beam-planning service')
+    argu.add_argument('scenario', metavar='/path/to/scenario.txt', help='Initial scenario.')
+    argu.add_argument('--socket', help='Serve on this Unix socket instead of stdin/stdout.')
+    argu.add_argument('--planner', choices=bp.planners, default='greedy',
+                      help='Planner for the initial plan (default: greedy).')
+    argu.add_argument('--seed', type=int, default=0, help='Planner seed (default: 0).')
+    argu.add_argument('--no-cache', dest='use_cache', action='store_false', help="Don't use the scenario binary cache.")
+    argup = argu.parse_args()
+
+    scenario = {}
+    if not bp.read_scenario(argup.scenario, scenario, argup.use_cache):
+        return -1
+    service = PlanningService(scenario, argup.planner, argup.seed)
+    print(f"Initial plan covers {service.plan.coverage_rate() * 100:.2f}% of {len(scenario['users'])} users",
+          file=sys.stderr)
+
+    if argup.socket:
+        asyncio.run(serve_socket(service, argup.socket))
+    else:
+        asyncio.run(serve_stdio(service))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
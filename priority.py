@@ -0,0 +1,155 @@
+import heapq, random
+
+import numpy as np
+
+from beamplanning import beams_per_satellite, valid_color_ids
+from compact import color_index
+from feasibility import PlanState
+from geometry import cos_self_interference_max, cos_margin
+
+#%% Priority greedy
+
+class PriorityPlanner:
+    """
+    Greedy planner that always places the most constrained user next: the
+    uncovered user with the fewest sats it could still fit on.
+
+    A sat stops counting for a user once it is full, or once every color is
+    taken by a beam within self_interference_max of the user; it counts
+    again if recoloring the sat frees a color. The heap is updated lazily:
+    each change pushes a fresh entry, and stale entries are skipped when
+    popped.
+
+    The popped user goes to the sat with the most slack, spare beams minus
+    the uncovered users still counting on it, so busy sats are saved for
+    the users that need them.
+    """
+
+    def __init__(self, plan: PlanState, seed: int = None):
+        self.plan = plan
+        self.rng = random.Random(seed)
+        geometry = plan.geometry
+        visibility = plan.visibility
+        n_users = len(geometry.user_ids)
+        n_sats = len(geometry.sat_ids)
+
+        # options[u] = sats user row u could still fit on; blocked[u] = the others.
+        self.options = [set(visibility.sats_for_user(u).tolist()) for u in range(n_users)]
+        self.blocked = [set() for _ in range(n_users)]
+        # demand[s] = uncovered users sat row s still counts for.
+        self.demand = [len(visibility.users_for_sat(s)) for s in range(n_sats)]
+        # Users placed, or found not to fit anywhere.
+        self.done = np.zeros(n_users, dtype=bool)
+        self.heap = []
+
+    def push(self, user: int):
+        heapq.heappush(self.heap, (len(self.options[user]), self.rng.random(), user))
+
+    def drop_option(self, user: int, sat: int):
+        self.options[user].discard(sat)
+        self.blocked[user].add(sat)
+        self.demand[sat] -= 1
+        self.push(user)
+
+    def add_option(self, user: int, sat: int):
+        self.blocked[user].discard(sat)
+        self.options[user].add(sat)
+        self.demand[sat] += 1
+        self.push(user)
+
+    def slack(self, sat: int) -> int:
+        sat_id = self.plan.geometry.sat_ids[sat]
+        state = self.plan.sat_states.get(sat_id)
+        used = len(state.beams) if state is not None else 0
+        return beams_per_satellite - used - self.demand[sat]
+
+    def after_placing(self, user: int, sat: int, beam_id: int, recolored: bool = False):
+        """
+        Updates the counts after user row was placed on sat row, on beam_id,
+        recoloring the sat's other beams if recolored.
+        """
+        self.done[user] = True
+        for other in self.options[user]:
+            self.demand[other] -= 1
+
+        geometry = self.plan.geometry
+        state = self.plan.sat_state(geometry.sat_ids[sat])
+        users = self.plan.visibility.users_for_sat(sat)
+        users = users[~self.done[users]]
+        if state.is_full():
+            for other in users.tolist():
+                if sat in self.options[other]:
+                    self.drop_option(other, sat)
+            return
+
+        # Only users pointed near the new beam can have lost a color, unless
+        # the sat was recolored, which moves colors all over it. For those,
+        # check every color at once against all of the sat's beams.
+        directions = geometry.sat_user_directions(sat, users) @ state.frame.T
+        if recolored:
+            near = np.arange(len(users))
+        else:
+            new_direction = np.asarray(state.directions[beam_id])
+            near = np.flatnonzero(directions @ new_direction > cos_self_interference_max - cos_margin)
+        if len(near) == 0:
+            return
+        beam_ids = list(state.beams)
+        beam_directions = np.array([state.directions[beam_id] for beam_id in beam_ids])
+        beam_colors = np.zeros((len(beam_ids), len(valid_color_ids)))
+        for i, beam_id in enumerate(beam_ids):
+            beam_colors[i, color_index[state.beams[beam_id][1]]] = 1.0
+        interferes = directions[near] @ beam_directions.T > cos_self_interference_max - cos_margin
+        no_color = ((interferes @ beam_colors) > 0).all(axis=1)
+        for other, lost in zip(users[near].tolist(), no_color.tolist()):
+            if lost and sat in self.options[other]:
+                self.drop_option(other, sat)
+            elif not lost and sat in self.blocked[other]:
+                self.add_option(other, sat)
+
+    def place(self, user: int) -> bool:
+        """
+        Tries user row on its sats, most slack first, then on its blocked
+        ones, where recoloring the sat might still make room.
+
+        Returns: success or failure.
+        """
+        geometry = self.plan.geometry
+        user_id = geometry.user_ids[user]
+        sats = sorted(self.options[user], key=lambda sat: (-self.slack(sat), sat))
+        sats += sorted(self.blocked[user])
+        for sat in sats:
+            state = self.plan.sat_state(geometry.sat_ids[sat])
+            colors = [color_id for _, color_id in state.beams.values()]
+            beam_id = self.plan.try_assign(user_id, state.sat_id)
+            if beam_id is not None:
+                # New beams go last, so the old ones' colors come first.
+                recolored = [color_id for _, color_id in state.beams.values()][:len(colors)] != colors
+                self.after_placing(user, sat, beam_id, recolored)
+                return True
+        return False
+
+    def run(self):
+        for user in range(len(self.options)):
+            if self.options[user]:
+                self.push(user)
+        while self.heap:
+            count, _, user = heapq.heappop(self.heap)
+            if self.done[user] or count != len(self.options[user]):
+                continue
+            if not self.place(user):
+                # Nowhere to go; stop counting this user against its sats.
+                self.done[user] = True
+                for sat in self.options[user]:
+                    self.demand[sat] -= 1
+
+
+def priority_planning(scenario: dict, plan: PlanState = None, seed: int = None):
+    """
+    Plans with PriorityPlanner: one greedy pass, most constrained users first.
+
+    Returns: solution, coverage rate
+    """
+    if plan is None:
+        plan = PlanState(scenario)
+    PriorityPlanner(plan, seed).run()
+    return plan.solution(), plan.coverage_rate()
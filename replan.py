@@ -0,0 +1,242 @@
+import sys, os, glob, time
+import argparse as argp
+
+import beamplanning as bp
+from optimizer import PlanningContext
+from coloring import conflict_graph
+from feasibility import PlanState
+
+#%% Parameters
+
+# Epochs whose warm start keeps less than this share of the previous
+# epoch's beams are planned from scratch instead; re-homing nearly every
+# user one by one is slower than a fresh plan.
+warm_keep_min = 0.25
+
+#%% Warm start
+
+class EpochReport:
+    """
+    What replanning one snapshot did.
+
+      kept:      beams carried over from the previous epoch as they were.
+      recolored: users kept on their previous sat under a new beam or color.
+      handovers: users served by a different sat than in the previous epoch.
+      dropped:   users covered in the previous epoch and not in this one.
+      replanned: users searched for a new sat: those whose beam broke and
+                 who couldn't stay on their sat, and those new or uncovered
+                 last epoch; every user when the epoch was planned cold.
+      warm:      whether the epoch was warm-started, rather than planned
+                 from scratch for keeping too few beams.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.users = 0
+        self.coverage_rate = 0.0
+        self.kept = 0
+        self.recolored = 0
+        self.handovers = 0
+        self.dropped = 0
+        self.replanned = 0
+        self.warm = False
+        self.read_s = 0.0
+        self.plan_s = 0.0
+        self.cold_plan_s = None
+        self.cold_coverage_rate = None
+
+
+def keep_beams(plan: PlanState, sat_id: str, beams: dict) -> list:
+    """
+    Re-places a sat's beams from the previous epoch, beams[beam_id] =
+    (user_id, color_id), with the same beam ids and colors wherever the user
+    and sat still exist and the beam still passes every check.
+
+    Returns: the (user_id, sat_id) of each beam that couldn't be kept.
+    """
+    geometry = plan.geometry
+    if sat_id not in geometry.sat_index:
+        return [(user, sat_id) for user, _ in beams.values()]
+    state = plan.sat_state(sat_id)
+    keep = []
+    broken = []
+    for beam_id, (user, color_id) in beams.items():
+        if user in geometry.user_index and user not in plan.covered_users and plan.link_ok(user, sat_id):
+            keep.append((int(beam_id), user, color_id))
+        else:
+            broken.append((user, sat_id))
+
+    # The previous epoch's beams were conflict-free, so check them against
+    # each other all at once and keep each one no earlier kept beam of its
+    # color now interferes with.
+    directions = state.user_directions([user for _, user, _ in keep])
+    adjacency = conflict_graph(directions)
+    kept = set()
+    for i, (beam_id, user, color_id) in enumerate(keep):
+        if any(keep[j][2] == color_id for j in adjacency[i] if j in kept):
+            broken.append((user, sat_id))
+            continue
+        kept.add(i)
+        state.add_beam(user, color_id, directions[i], beam_id)
+        plan.covered_users.add(user)
+    return broken
+
+
+def warm_start(plan: PlanState, previous: dict, report: EpochReport, keep_min: float = warm_keep_min) -> bool:
+    """
+    Fills an empty plan for the new epoch from the previous epoch's solution.
+
+    Beams that still pass every check are kept as they were. Users whose beam
+    broke first try to stay on their sat, recoloring it if needed; the ones
+    that can't, and users new or uncovered last epoch, are then placed on any
+    sat that can serve them, those with the fewest options first.
+
+    Returns: False, leaving the plan part-filled, if fewer than keep_min of
+    the previous beams could be kept; True once the plan is filled.
+    """
+    geometry = plan.geometry
+    visibility = plan.visibility
+
+    broken = []
+    for sat_id, beams in previous.items():
+        broken.extend(keep_beams(plan, sat_id, beams))
+    report.kept = len(plan.covered_users)
+    if report.kept < keep_min * (report.kept + len(broken)):
+        return False
+
+    for user, sat_id in broken:
+        if user in geometry.user_index and sat_id in geometry.sat_index \
+                and plan.try_assign(user, sat_id) is not None:
+            report.recolored += 1
+
+    uncovered = [user for user, user_id in enumerate(geometry.user_ids)
+                 if user_id not in plan.covered_users and len(visibility.sats_for_user(user))]
+    uncovered.sort(key=lambda user: len(visibility.sats_for_user(user)))
+    report.replanned = len(uncovered)
+    for user in uncovered:
+        user_id = geometry.user_ids[user]
+        for sat in visibility.sats_for_user(user).tolist():
+            if plan.try_assign(user_id, geometry.sat_ids[sat]) is not None:
+                break
+    return True
+
+
+def count_handovers(previous: dict, solution, report: EpochReport):
+    """
+    Counts the users solution moved to another sat or dropped, relative to
+    the previous epoch's solution.
+    """
+    previous_sat = {user: sat_id for sat_id, beams in previous.items() for user, _ in beams.values()}
+    current_sat = {user: sat_id for sat_id, beams in solution.items() for user, _ in beams.values()}
+    for user, sat_id in previous_sat.items():
+        if user not in current_sat:
+            report.dropped += 1
+        elif current_sat[user] != sat_id:
+            report.handovers += 1
+
+#%% Epochs
+
+def scenario_files(paths: list) -> list:
+    """
+    Returns: the scenario files to replan, in order: each path as given, or
+    for a directory, the *.txt files in it sorted by name.
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, '*.txt'))))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def replan_epochs(filenames: list, planner: str = 'greedy', seed: int = 0, use_cache: bool = True,
+                  cold: bool = False):
+    """
+    Plans the first snapshot in full, then warm-starts each later one from
+    the solution before it, or plans it in full too if too little of that
+    solution still holds. With cold, every later snapshot is also planned
+    from scratch, for comparison.
+
+    Yields: (EpochReport, solution) per snapshot; stops at one that can't be read.
+    """
+    previous = None
+    for filename in filenames:
+        report = EpochReport(filename)
+        start = time.perf_counter()
+        scenario = {}
+        if not bp.read_scenario(filename, scenario, use_cache):
+            print(f"Can't read {filename}; stopping.", file=sys.stderr)
+            return
+        read_done = time.perf_counter()
+        report.read_s = read_done - start
+        report.users = len(scenario['users'])
+
+        context = PlanningContext(scenario)
+        if previous is not None:
+            plan = context.new_plan()
+            report.warm = warm_start(plan, previous, report)
+        if report.warm:
+            solution, report.coverage_rate = plan.solution(), plan.coverage_rate()
+        else:
+            report.coverage_rate, solution = bp.planning_optimizer(scenario, planner, seed=seed, context=context)
+            report.kept, report.replanned = 0, report.users
+        if previous is not None:
+            count_handovers(previous, solution, report)
+        report.plan_s = time.perf_counter() - read_done
+
+        if cold and previous is not None:
+            cold_start = time.perf_counter()
+            report.cold_coverage_rate, _ = bp.planning_optimizer(scenario, planner, seed=seed, context=context)
+            report.cold_plan_s = time.perf_counter() - cold_start
+
+        previous = solution
+        yield report, solution
+
+#%% Main
+
+def main() -> int:
+    """
+    Entry point. Replans a sequence of scenario snapshots, reporting each
+    epoch on stderr and optionally writing each epoch's solution.
+
+    Returns: exit code.
+    """
+    argu = argp.ArgumentParser(prog=f"python3.7 {sys.argv[0]}", description='Starlink beam replanning over time')
+    argu.add_argument('snapshots', nargs='+', metavar='/path/to/scenario.txt',
+                      help='Scenario snapshots in time order, or directories of them.')
+    argu.add_argument('--planner', choices=bp.planners, default='greedy',
+                      help='Planner for the first epoch (default: greedy).')
+    argu.add_argument('--seed', type=int, default=0, help='Planner seed (default: 0).')
+    argu.add_argument('--no-cache', dest='use_cache', action='store_false', help="Don't use scenario binary caches.")
+    argu.add_argument('--output-dir', help='Write each epoch\'s solution here, named after its snapshot.')
+    argu.add_argument('--cold', action='store_true', help='Also plan every epoch from scratch and report the difference.')
+    argup = argu.parse_args()
+
+    filenames = scenario_files(argup.snapshots)
+    if not filenames:
+        print("No snapshots found.", file=sys.stderr)
+        return -1
+    if argup.output_dir:
+        os.makedirs(argup.output_dir, exist_ok=True)
+
+    print(f"{'epoch':>5s} {'snapshot':32s} {'coverage':>8s} {'kept':>6s} {'handover':>8s} {'dropped':>7s} "
+          f"{'replan':>6s} {'start':>5s} {'read s':>7s} {'plan s':>7s}" + (f" {'cold s':>7s} {'cold cov':>8s}" if argup.cold else ''),
+          file=sys.stderr)
+    epochs = 0
+    for epoch, (report, solution) in enumerate(replan_epochs(filenames, argup.planner, argup.seed,
+                                                             argup.use_cache, argup.cold)):
+        epochs += 1
+        line = f"{epoch:5d} {os.path.basename(report.filename):32s} {report.coverage_rate:8.4f} {report.kept:6d} " \
+               f"{report.handovers:8d} {report.dropped:7d} {report.replanned:6d} {'warm' if report.warm else 'cold':>5s} {report.read_s:7.3f} {report.plan_s:7.3f}"
+        if report.cold_plan_s is not None:
+            line += f" {report.cold_plan_s:7.3f} {report.cold_coverage_rate:8.4f}"
+        print(line, file=sys.stderr)
+        if argup.output_dir:
+            base = os.path.splitext(os.path.basename(report.filename))[0]
+            bp.output_results(solution, os.path.join(argup.output_dir, base + '.solution.txt'))
+    return 0 if epochs == len(filenames) else -1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
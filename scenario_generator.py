@@ -0,0 +1,226 @@
+import sys
+import argparse as argp
+
+import numpy as np
+
+from solution_writer import write_buffer_bytes
+
+#%% Parameters
+
+# Radius of the (spherical) earth, km.
+earth_radius = 6371.0
+
+# Radius of geostationary orbit, km.
+geo_radius = 42164.0
+
+# Orbital shell used when none is given: planes, sats per plane, altitude
+# (km), inclination (degrees), like the shipped 09_/10_ cases.
+default_shell = '36:20:550:53'
+
+# User density models selectable with --user-model.
+user_models = ['uniform', 'clusters', 'bands']
+
+# Latitude band used by the 'bands' model when none is given, degrees.
+default_band = '40:55'
+
+# Clusters and their spread, km, for the 'clusters' model.
+default_clusters = 50
+default_cluster_spread = 200.0
+
+# Digits after the decimal point in written positions (1e-6 km = 1 mm).
+position_decimals = 6
+
+#%% Shapes
+
+def unit_from_lat_lon(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Returns: (N,3) ECEF unit vectors for latitudes and longitudes in radians.
+    """
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def shell_positions(planes: int, per_plane: int, altitude: float, inclination: float,
+                    phasing: int = 1) -> np.ndarray:
+    """
+    Returns: the positions of a Walker-delta shell: planes evenly spread in
+    right ascension, per_plane sats evenly spread in each, and neighboring
+    planes offset by phasing / (planes * per_plane) of a turn.
+    """
+    radius = earth_radius + altitude
+    inclination = np.radians(inclination)
+    plane = np.repeat(np.arange(planes), per_plane)
+    slot = np.tile(np.arange(per_plane), planes)
+    raan = 2 * np.pi * plane / planes
+    anomaly = 2 * np.pi * (slot / per_plane + phasing * plane / (planes * per_plane))
+    # Position in the orbital plane, tilted by the inclination, then turned to its RAAN.
+    x_orbit = np.cos(anomaly)
+    y_orbit = np.sin(anomaly) * np.cos(inclination)
+    z = np.sin(anomaly) * np.sin(inclination)
+    x = x_orbit * np.cos(raan) - y_orbit * np.sin(raan)
+    y = x_orbit * np.sin(raan) + y_orbit * np.cos(raan)
+    return radius * np.column_stack([x, y, z])
+
+
+def uniform_users(rng, count: int, min_lat: float = -90.0, max_lat: float = 90.0) -> np.ndarray:
+    """
+    Returns: count user positions spread evenly by area between two
+    latitudes, in degrees.
+    """
+    low, high = np.sin(np.radians(min_lat)), np.sin(np.radians(max_lat))
+    lat = np.arcsin(rng.uniform(low, high, count))
+    lon = rng.uniform(-np.pi, np.pi, count)
+    return earth_radius * unit_from_lat_lon(lat, lon)
+
+
+def band_users(rng, count: int, bands: list) -> np.ndarray:
+    """
+    Returns: count user positions spread evenly by area over the given
+    (min_lat, max_lat) bands, in degrees, each band weighted by its area.
+    """
+    areas = np.array([np.sin(np.radians(high)) - np.sin(np.radians(low)) for low, high in bands])
+    counts = rng.multinomial(count, areas / areas.sum())
+    return np.vstack([uniform_users(rng, n, low, high) for (low, high), n in zip(bands, counts)])
+
+
+def cluster_users(rng, count: int, clusters: int, spread: float, max_lat: float = 60.0) -> np.ndarray:
+    """
+    Returns: count user positions in clusters, a rough stand-in for
+    population centers: cluster sizes follow a heavy-tailed (Zipf-like)
+    law, and users scatter around their center with a Gaussian of spread km.
+    Centers lie within max_lat degrees of the equator.
+    """
+    centers = uniform_users(rng, clusters, -max_lat, max_lat) / earth_radius
+    weights = 1.0 / np.arange(1, clusters + 1)
+    which = rng.choice(clusters, size=count, p=weights / weights.sum())
+    # Scatter in the tangent plane at each center, then back onto the sphere.
+    up = centers[which]
+    helper = np.where(np.abs(up[:, 2:3]) < 0.9, [[0.0, 0.0, 1.0]], [[1.0, 0.0, 0.0]])
+    east = np.cross(helper, up)
+    east /= np.linalg.norm(east, axis=1, keepdims=True)
+    north = np.cross(up, east)
+    offsets = rng.normal(0.0, spread / earth_radius, size=(count, 2))
+    points = up + offsets[:, :1] * east + offsets[:, 1:] * north
+    return earth_radius * points / np.linalg.norm(points, axis=1, keepdims=True)
+
+
+def geo_belt(count: int, offset: float = 0.0, radius: float = geo_radius) -> np.ndarray:
+    """
+    Returns: count interferers evenly spaced around the equator at radius
+    km, the first at offset degrees east.
+    """
+    lon = np.radians(offset) + 2 * np.pi * np.arange(count) / max(count, 1)
+    return radius * unit_from_lat_lon(np.zeros(count), lon)
+
+#%% Writing
+
+def parse_numbers(text: str, count: int, name: str) -> list:
+    """
+    Returns: the colon-separated numbers in text. Raises ValueError if
+    there aren't count of them.
+    """
+    parts = text.split(':')
+    if len(parts) != count:
+        raise ValueError(f"{name} needs {count} colon-separated numbers, got {text!r}")
+    return [float(part) for part in parts]
+
+
+def write_objects(f, object_type: str, positions: np.ndarray, first_id: int = 1):
+    """
+    Writes one '<object_type> <id> <x> <y> <z>' line per position.
+    """
+    if len(positions) == 0:
+        return
+    ids = np.arange(first_id, first_id + len(positions))
+    rows = np.column_stack([ids, positions])
+    fmt = f"{object_type} %d %.{position_decimals}f %.{position_decimals}f %.{position_decimals}f"
+    np.savetxt(f, rows, fmt=fmt)
+
+
+def generate(args) -> tuple:
+    """
+    Returns: sat, user and interferer position arrays, and the comment lines
+    describing them, for parsed command-line args.
+    """
+    rng = np.random.default_rng(args.seed)
+    notes = [f"Generated by scenario_generator.py with seed {args.seed}."]
+
+    shells = args.shell or [default_shell]
+    sats = []
+    for shell in shells:
+        planes, per_plane, altitude, inclination = parse_numbers(shell, 4, '--shell')
+        sats.append(shell_positions(int(planes), int(per_plane), altitude, inclination, args.phasing))
+        notes.append(f"{int(planes)} planes of {int(per_plane)} satellites at {altitude:g} km, "
+                     f"{inclination:g} degrees inclination.")
+    sats = np.vstack(sats)
+
+    if args.user_model == 'uniform':
+        users = uniform_users(rng, args.users)
+        notes.append(f"{args.users} users spread evenly over the globe.")
+    elif args.user_model == 'bands':
+        bands = [tuple(parse_numbers(band, 2, '--band')) for band in (args.band or [default_band])]
+        users = band_users(rng, args.users, bands)
+        notes.append(f"{args.users} users spread evenly over latitude bands "
+                     + ', '.join(f"{low:g} to {high:g}" for low, high in bands) + ".")
+    else:
+        users = cluster_users(rng, args.users, args.clusters, args.cluster_spread)
+        notes.append(f"{args.users} users in {args.clusters} population clusters "
+                     f"of {args.cluster_spread:g} km spread.")
+    # Shuffle, so ids don't give away which band or cluster a user is in.
+    users = users[rng.permutation(len(users))]
+
+    interferers = []
+    for belt in args.geo_belt or []:
+        count, offset = parse_numbers(belt, 2, '--geo-belt') if ':' in belt else (float(belt), 0.0)
+        interferers.append(geo_belt(int(count), offset))
+        notes.append(f"A belt of {int(count)} geostationary non-Starlink satellites.")
+    interferers = np.vstack(interferers) if interferers else np.zeros((0, 3))
+
+    notes.append(f"{len(sats)} Satellites, {len(users)} Users, {len(interferers)} Interferers")
+    return sats, users, interferers, notes
+
+#%% Main
+
+def main() -> int:
+    """
+    Entry point. Writes a synthetic scenario file.
+
+    Returns: exit code.
+    """
+    argu = argp.ArgumentParser(prog=f"python3.7 {sys.argv[0]}", description='Synthetic Starlink scenario generator')
+    argu.add_argument('output', nargs='?', default='-', help="Scenario file to write, or '-' for stdout (default).")
+    argu.add_argument('--seed', type=int, default=0, help='Random seed; the same arguments and seed give the same file (default: 0).')
+    argu.add_argument('--shell', action='append', metavar='PLANES:PER_PLANE:ALT_KM:INCL_DEG',
+                      help=f'An orbital shell; repeat for several (default: {default_shell}).')
+    argu.add_argument('--phasing', type=int, default=1, help='Walker phasing factor between planes (default: 1).')
+    argu.add_argument('--users', type=int, default=10000, help='Number of users (default: 10000).')
+    argu.add_argument('--user-model', choices=user_models, default='bands', help='How users are spread (default: bands).')
+    argu.add_argument('--band', action='append', metavar='MIN_LAT:MAX_LAT',
+                      help=f"Latitude band for the 'bands' model; repeat for several (default: {default_band}).")
+    argu.add_argument('--clusters', type=int, default=default_clusters,
+                      help=f"Population clusters for the 'clusters' model (default: {default_clusters}).")
+    argu.add_argument('--cluster-spread', type=float, default=default_cluster_spread,
+                      help=f"Cluster spread, km (default: {default_cluster_spread:g}).")
+    argu.add_argument('--geo-belt', action='append', metavar='COUNT[:OFFSET_DEG]',
+                      help='A belt of evenly spaced GEO interferers; repeat for several.')
+    argup = argu.parse_args()
+
+    try:
+        sats, users, interferers, notes = generate(argup)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return -1
+
+    f = sys.stdout if argup.output == '-' else open(argup.output, 'w', buffering=write_buffer_bytes)
+    try:
+        f.write(''.join(f"# {note}\n" for note in notes) + "\n")
+        write_objects(f, 'sat', sats)
+        write_objects(f, 'user', users)
+        write_objects(f, 'interferer', interferers)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
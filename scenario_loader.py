@@ -0,0 +1,153 @@
+import os, hashlib, tempfile
+from array import array
+
+import numpy as np
+
+#%% Parameters
+
+# Sidecar cache directory, created next to each scenario file.
+cache_dir_name = '__scenariocache__'
+
+# Object types, in the order lines are matched against them, and the
+# scenario dict key each one is stored under.
+object_types = [('interferer', 'interferers'), ('sat', 'sats'), ('user', 'users')]
+
+#%% Scenario arrays
+
+class ScenarioArrays:
+    """
+    A scenario as typed arrays: for each scenario key ('sats', 'users',
+    'interferers'), a list of ids and a matching (N,3) float64 position array.
+    """
+
+    def __init__(self, ids: dict, positions: dict):
+        self.ids = ids
+        self.positions = positions
+
+    def fill_scenario(self, scenario: dict, point_type):
+        """
+        Populates scenario[key][id] = point_type(x, y, z) for every object.
+        """
+        for _, key in object_types:
+            scenario[key] = dict(zip(self.ids[key], map(point_type._make, self.positions[key].tolist())))
+
+#%% Text parsing
+
+def parse_scenario(filename: str):
+    """
+    Streams a scenario file straight into typed arrays, validating each line
+    the same way read_scenario always has.
+
+    Returns: ScenarioArrays, or None on failure.
+    """
+    ids = {key: [] for _, key in object_types}
+    coords = {key: array('d') for _, key in object_types}
+
+    with open(filename) as scenariofile:
+        for line in scenariofile:
+            if "#" in line:
+                # Comment.
+                continue
+            if line.strip() == "":
+                # Whitespace or empty line.
+                continue
+
+            for object_type, key in object_types:
+                if object_type in line:
+                    break
+            else:
+                print("Invalid line! " + line)
+                return None
+
+            parts = line.split()
+            if parts[0] != object_type or len(parts) != 5:
+                print("Invalid line! " + line)
+                return None
+            try:
+                x = float(parts[2])
+                y = float(parts[3])
+                z = float(parts[4])
+            except ValueError:
+                print("Can't parse location! " + line)
+                return None
+            ids[key].append(parts[1])
+            coords[key].extend((x, y, z))
+
+    positions = {key: np.frombuffer(coords[key], dtype=np.float64).reshape(-1, 3).copy()
+                 for _, key in object_types}
+    return ScenarioArrays(ids, positions)
+
+#%% Binary cache
+
+def cache_path(filename: str) -> str:
+    """
+    Returns: the sidecar cache file for filename. Its name hashes the file's
+    absolute path, mtime and size, so any edit to the scenario misses the cache.
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    key = f"{path}\0{stat.st_mtime_ns}\0{stat.st_size}".encode()
+    digest = hashlib.sha1(key).hexdigest()[:16]
+    directory, base = os.path.split(path)
+    return os.path.join(directory, cache_dir_name, f"{base}.{digest}.npz")
+
+
+def read_cache(path: str):
+    """
+    Returns: the ScenarioArrays stored at path, or None if there's no usable cache.
+    """
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            ids = {key: data[key + '_ids'].tolist() for _, key in object_types}
+            positions = {key: data[key + '_pos'] for _, key in object_types}
+    except (OSError, KeyError, ValueError):
+        return None
+    return ScenarioArrays(ids, positions)
+
+
+def write_cache(path: str, arrays: ScenarioArrays):
+    """
+    Atomically writes arrays to path and drops stale caches of the same
+    scenario. Caching is best effort: failures are ignored.
+    """
+    directory, name = os.path.split(path)
+    base = name.rsplit('.', 2)[0]
+    contents = {}
+    for _, key in object_types:
+        contents[key + '_ids'] = np.array(arrays.ids[key], dtype=str)
+        contents[key + '_pos'] = arrays.positions[key]
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **contents)
+            os.replace(tmp_path, path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+        for other in os.listdir(directory):
+            if other != name and other.startswith(base + '.') and other.endswith('.npz') \
+                    and other.rsplit('.', 2)[0] == base:
+                os.remove(os.path.join(directory, other))
+    except OSError:
+        pass
+
+
+def load_scenario_arrays(filename: str, use_cache: bool = True):
+    """
+    Loads a scenario file as typed arrays, from its binary cache when the
+    file hasn't changed since the cache was written.
+
+    Returns: ScenarioArrays, or None on failure.
+    """
+    path = cache_path(filename) if use_cache else None
+    if path is not None:
+        arrays = read_cache(path)
+        if arrays is not None:
+            return arrays
+
+    arrays = parse_scenario(filename)
+    if arrays is not None and path is not None:
+        write_cache(path, arrays)
+    return arrays
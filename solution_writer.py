@@ -0,0 +1,103 @@
+import os, sys, tempfile
+
+from beamplanning import valid_color_ids
+from compact import BeamTable
+
+#%% Parameters
+
+# Write buffer size, bytes.
+write_buffer_bytes = 1 << 20
+
+#%% Solution writer
+
+class SolutionWriter:
+    """
+    Writes solution lines ('sat <id> beam <id> user <id> color <id>') to
+    stdout or a file, opening the destination once and buffering the writes.
+
+    For a file, lines go to a temporary file next to it that replaces the
+    target on close(), so readers never see a half-written or stale plan.
+    Use it as a context manager; in that mode, if the block raises, the
+    target is left alone. With atomic=False the target is truncated as soon
+    as the writer is made and written in place, so a raise leaves it partly
+    written.
+    """
+
+    def __init__(self, destination: str = '-', atomic: bool = True):
+        self.destination = destination
+        self.tmp_path = None
+        if destination == '-':
+            self.file = sys.stdout
+        elif atomic:
+            directory = os.path.dirname(os.path.abspath(destination))
+            fd, self.tmp_path = tempfile.mkstemp(dir=directory, prefix='.solution-', suffix='.tmp')
+            # mkstemp makes the file private; give it normal file permissions.
+            os.chmod(self.tmp_path, 0o644)
+            self.file = os.fdopen(fd, 'w', buffering=write_buffer_bytes)
+        else:
+            self.file = open(destination, 'w', buffering=write_buffer_bytes)
+
+    def write_beam(self, sat_id, beam_id, user_id, color_id):
+        self.file.write(f"sat {sat_id} beam {beam_id} user {user_id} color {color_id}\n")
+
+    def write_sat(self, sat_id, beams: dict):
+        """
+        Writes every beam of one sat, given beams[beam_id] = (user_id, color_id).
+        """
+        self.file.write(''.join(f"sat {sat_id} beam {beam_id} user {user_id} color {color_id}\n"
+                                for beam_id, (user_id, color_id) in beams.items()))
+
+    def write_table(self, table: BeamTable):
+        """
+        Writes a compact.BeamTable straight from its arrays, looking ids up
+        by row as each line is written rather than building per-sat dicts.
+        """
+        sat_ids, user_ids = table.geometry.sat_ids, table.geometry.user_ids
+        sats, beams, users, colors = table.links()
+        self.file.write(''.join(f"sat {sat_ids[sat]} beam {beam} user {user_ids[user]} "
+                                f"color {valid_color_ids[color]}\n"
+                                for sat, beam, user, color in zip(sats.tolist(), beams.tolist(),
+                                                                  users.tolist(), colors.tolist())))
+
+    def write_solution(self, solution: dict):
+        """
+        Writes a whole solution[sat_id][beam_id] = (user_id, color_id) plan,
+        or a compact.BeamTable.
+        """
+        if isinstance(solution, BeamTable):
+            self.write_table(solution)
+            return
+        for sat_id, beams in solution.items():
+            self.write_sat(sat_id, beams)
+
+    def close(self):
+        if self.file is sys.stdout:
+            self.file.flush()
+            return
+        self.file.close()
+        if self.tmp_path is not None:
+            os.replace(self.tmp_path, self.destination)
+            self.tmp_path = None
+
+    def abort(self):
+        """
+        Stops writing. In atomic mode any existing target file is left
+        untouched; otherwise it keeps whatever was written so far.
+        """
+        if self.file is sys.stdout:
+            self.file.flush()
+            return
+        self.file.close()
+        if self.tmp_path is not None:
+            os.remove(self.tmp_path)
+            self.tmp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
@@ -0,0 +1,201 @@
+from math import asin, atan2, ceil, cos, degrees, floor, radians, sin, sqrt
+
+import numpy as np
+
+#%% Lat/lon bucket grid over unit vectors
+
+class SphereGrid:
+    """
+    Buckets unit vectors by latitude/longitude cell so that "which points are
+    within r degrees of this direction?" only has to look at nearby cells.
+
+    Queries return candidates, a superset of the true answer; callers do the
+    exact dot-product test on them. Points can be inserted and removed.
+    """
+
+    def __init__(self, cell_degrees: float):
+        # Shrink the cell size so it evenly divides 180 degrees, which keeps the
+        # longitude wrap-around exact.
+        self.lat_cells = max(1, int(ceil(180.0 / cell_degrees)))
+        self.lon_cells = 2 * self.lat_cells
+        self.cell_degrees = 180.0 / self.lat_cells
+        # buckets[(row, col)] = {key: direction}
+        self.buckets = {}
+        # cells[key] = (row, col) the key is stored in.
+        self.cells = {}
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def cell_of(self, direction) -> tuple:
+        """
+        Returns: the (row, col) cell of a unit vector.
+        """
+        x, y, z = direction
+        lat = degrees(asin(min(1.0, max(-1.0, z))))
+        lon = degrees(atan2(y, x))
+        row = min(self.lat_cells - 1, int(floor((lat + 90.0) / self.cell_degrees)))
+        col = int(floor((lon + 180.0) / self.cell_degrees)) % self.lon_cells
+        return row, col
+
+    def insert(self, key, direction):
+        direction = tuple(float(v) for v in direction)
+        cell = self.cell_of(direction)
+        self.buckets.setdefault(cell, {})[key] = direction
+        self.cells[key] = cell
+
+    def remove(self, key):
+        cell = self.cells.pop(key)
+        bucket = self.buckets[cell]
+        bucket.pop(key)
+        if not bucket:
+            del self.buckets[cell]
+
+    def query_cells(self, direction, radius_degrees: float):
+        """
+        Yields: every cell that could hold a point within radius_degrees of direction.
+        """
+        x, y, z = direction
+        lat = degrees(asin(min(1.0, max(-1.0, z))))
+        lon = degrees(atan2(y, x))
+
+        lat_lo = lat - radius_degrees
+        lat_hi = lat + radius_degrees
+        row_lo = max(0, int(floor((lat_lo + 90.0) / self.cell_degrees)))
+        row_hi = min(self.lat_cells - 1, int(floor((lat_hi + 90.0) / self.cell_degrees)))
+
+        if lat_lo <= -90.0 or lat_hi >= 90.0 or radius_degrees >= 90.0:
+            # The cap covers a pole, so it spans every longitude.
+            cols = range(self.lon_cells)
+        else:
+            # Widest longitude offset of a spherical cap centered at lat.
+            ratio = sin(radians(radius_degrees)) / cos(radians(lat))
+            half_width = 180.0 if ratio >= 1.0 else degrees(asin(ratio))
+            if 2 * half_width + 2 * self.cell_degrees >= 360.0:
+                cols = range(self.lon_cells)
+            else:
+                col_lo = int(floor((lon - half_width + 180.0) / self.cell_degrees))
+                col_hi = int(floor((lon + half_width + 180.0) / self.cell_degrees))
+                cols = [c % self.lon_cells for c in range(col_lo, col_hi + 1)]
+
+        for row in range(row_lo, row_hi + 1):
+            for col in cols:
+                yield row, col
+
+    def query(self, direction, radius_degrees: float) -> list:
+        """
+        Returns: (key, direction) for every point in a cell that could be
+        within radius_degrees of direction.
+        """
+        found = []
+        for cell in self.query_cells(direction, radius_degrees):
+            bucket = self.buckets.get(cell)
+            if bucket:
+                found.extend(bucket.items())
+        return found
+
+    def query_keys(self, direction, radius_degrees: float) -> list:
+        """
+        Returns: the keys of every point in a cell that could be within
+        radius_degrees of direction.
+        """
+        found = []
+        for cell in self.query_cells(direction, radius_degrees):
+            bucket = self.buckets.get(cell)
+            if bucket:
+                found.extend(bucket)
+        return found
+
+
+class PackedSphereGrid(SphereGrid):
+    """
+    A SphereGrid built once from an array of unit vectors, keyed by row
+    number. Cells are worked out in a few numpy calls and each cell's rows
+    are packed in one array, so building it for thousands of points is cheap;
+    it can't be changed afterwards.
+    """
+
+    def __init__(self, directions: np.ndarray, cell_degrees: float):
+        super().__init__(cell_degrees)
+        keys = self.cell_keys(directions)
+        order = np.argsort(keys, kind='stable')
+        keys, starts = np.unique(keys[order], return_index=True)
+        stops = np.append(starts[1:], len(order))
+        # rows[cell key] = rows of the points in that cell.
+        self.rows = {key: order[start:stop] for key, start, stop in zip(keys.tolist(), starts, stops)}
+        self.size = len(order)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def cell_keys(self, directions: np.ndarray) -> np.ndarray:
+        """
+        Returns: row * lon_cells + col of the cell_of() each unit vector.
+        """
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        lat = np.degrees(np.arcsin(np.clip(directions[:, 2], -1.0, 1.0)))
+        lon = np.degrees(np.arctan2(directions[:, 1], directions[:, 0]))
+        row = np.minimum(self.lat_cells - 1, np.floor((lat + 90.0) / self.cell_degrees).astype(np.intp))
+        col = np.floor((lon + 180.0) / self.cell_degrees).astype(np.intp) % self.lon_cells
+        return row * self.lon_cells + col
+
+    def cell_center(self, key: int) -> tuple:
+        """
+        Returns: the unit vector at the middle of a cell. Every point in the
+        cell is within cell_degrees of it.
+        """
+        row, col = divmod(key, self.lon_cells)
+        lat = radians((row + 0.5) * self.cell_degrees - 90.0)
+        lon = radians((col + 0.5) * self.cell_degrees - 180.0)
+        return cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat)
+
+    def insert(self, key, direction):
+        raise TypeError('a PackedSphereGrid is read-only')
+
+    def remove(self, key):
+        raise TypeError('a PackedSphereGrid is read-only')
+
+    def query_rows(self, direction, radius_degrees: float) -> np.ndarray:
+        """
+        Returns: the rows of every point in a cell that could be within
+        radius_degrees of direction.
+        """
+        found = [self.rows[key] for key in (row * self.lon_cells + col
+                                            for row, col in self.query_cells(direction, radius_degrees))
+                 if key in self.rows]
+        if not found:
+            return np.zeros(0, dtype=np.intp)
+        return np.concatenate(found)
+
+
+def local_frame(axis) -> np.ndarray:
+    """
+    Returns: a 3x3 rotation whose rows are an orthonormal basis with axis
+    (normalized) first. Rotating directions with it maps axis to latitude 0,
+    longitude 0, well away from the grid's crowded polar cells.
+    """
+    x, y, z = (float(v) for v in axis)
+    norm = sqrt(x * x + y * y + z * z)
+    x, y, z = x / norm, y / norm, z / norm
+    # e2 = e1 x (a unit vector not parallel to e1), normalized.
+    if abs(z) < 0.9:
+        # e1 x (0, 0, 1)
+        ax, ay, az = y, -x, 0.0
+    else:
+        # e1 x (1, 0, 0)
+        ax, ay, az = 0.0, z, -y
+    norm = sqrt(ax * ax + ay * ay + az * az)
+    ax, ay, az = ax / norm, ay / norm, az / norm
+    # e3 = e1 x e2
+    bx, by, bz = y * az - z * ay, z * ax - x * az, x * ay - y * ax
+    return np.array([[x, y, z], [ax, ay, az], [bx, by, bz]])
+
+
+def build_grid(directions: np.ndarray, cell_degrees: float) -> SphereGrid:
+    """
+    Returns: a SphereGrid holding each row of directions, keyed by row number.
+    """
+    grid = SphereGrid(cell_degrees)
+    for key, direction in enumerate(directions.tolist()):
+        grid.insert(key, direction)
+    return grid
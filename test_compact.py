@@ -0,0 +1,76 @@
+import os, pickle
+
+import numpy as np
+import pytest
+
+import beamplanning as bp
+from compact import BeamTable, no_user
+from optimizer import PlanningContext
+
+#%% Parameters
+
+test_case_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases', '07_eighteen_planes.txt')
+
+#%% Plans
+
+@pytest.fixture(scope='module')
+def context():
+    scenario = {}
+    assert bp.read_scenario(test_case_file, scenario, False)
+    return PlanningContext(scenario)
+
+
+@pytest.fixture(scope='module')
+def planned(context):
+    _, table = bp.planning_optimizer(context.scenario, seed=0, context=context)
+    return table
+
+
+def as_dict(solution) -> dict:
+    return {sat_id: dict(beams) for sat_id, beams in solution.items()}
+
+#%% Tests
+
+def test_table_reads_like_its_solution(context, planned):
+    solution = as_dict(planned)
+    table = BeamTable.from_solution(context.geometry, solution)
+    assert as_dict(table) == solution
+    assert len(table) == len(solution)
+    assert table.beam_count() == sum(len(beams) for beams in solution.values())
+    assert len(table.covered_rows()) == table.beam_count()
+
+    plan = context.new_plan()
+    plan.load_solution(solution)
+    assert as_dict(BeamTable.from_plan(plan)) == solution
+
+
+def test_pickle_leaves_the_geometry_out(context, planned):
+    data = pickle.dumps(planned)
+    assert len(data) < planned.users.nbytes + planned.colors.nbytes + 1024
+    table = pickle.loads(data)
+    assert table.geometry is None
+    assert np.array_equal(table.users, planned.users)
+    assert np.array_equal(table.colors, planned.colors)
+    assert as_dict(table.bind(context.geometry)) == as_dict(planned)
+
+
+def test_restarts_across_processes_match_one_process(context):
+    # Worker processes send their best tables back pickled.
+    one = bp.planning_optimizer(context.scenario, restarts=4, workers=1, seed=0, context=context)
+    two = bp.planning_optimizer(context.scenario, restarts=4, workers=2, seed=0, context=context)
+    assert one[0] == two[0]
+    assert as_dict(one[1]) == as_dict(two[1])
+
+
+def test_invalid_beam_id_is_refused(context):
+    sat_id, user_id = context.geometry.sat_ids[0], context.geometry.user_ids[0]
+    with pytest.raises(ValueError):
+        BeamTable.from_solution(context.geometry, {sat_id: {bp.beams_per_satellite + 1: (user_id, 'A')}})
+
+
+def test_empty_table(context):
+    table = BeamTable(context.geometry)
+    assert (table.users == no_user).all()
+    assert len(table) == 0 and as_dict(table) == {}
+    with pytest.raises(KeyError):
+        table[context.geometry.sat_ids[0]]
@@ -0,0 +1,73 @@
+import os, glob, time
+
+import pytest
+
+import beamplanning as bp
+from bounds import coverage_bound
+from exact import exact_planning
+from optimizer import PlanningContext
+from priority import priority_planning
+from validator import find_violations
+
+#%% Parameters
+
+test_cases = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases')
+
+# The shipped scenarios small enough to plan on every run.
+test_case_files = sorted(glob.glob(os.path.join(test_cases, '0[0-7]*.txt')))
+
+# Search time per scenario, and how far past it a run may finish, seconds.
+time_limit = 2.0
+time_slack = 0.5
+
+#%% Tests
+
+def read_context(filename: str) -> PlanningContext:
+    scenario = {}
+    assert bp.read_scenario(filename, scenario, False)
+    return PlanningContext(scenario)
+
+
+@pytest.mark.parametrize('filename', test_case_files, ids=os.path.basename)
+def test_exact_plans_are_valid_and_bounded(filename):
+    context = read_context(filename)
+    scenario = context.scenario
+    solution, coverage, result = exact_planning(scenario, context.new_plan(), 0, time_limit, verbose=False)
+    assert find_violations(scenario, solution, context.geometry) == []
+    covered = sum(len(beams) for beams in solution.values())
+    assert result.covered == covered
+    assert coverage == pytest.approx(covered / len(scenario['users']))
+
+    # Never worse than the priority plan it starts from, never past a bound.
+    _, priority_coverage = priority_planning(scenario, context.new_plan(), 0)
+    assert coverage >= priority_coverage
+    assert covered <= min(result.upper_bound, coverage_bound(context).users)
+    if result.optimal:
+        assert result.upper_bound == covered
+
+
+@pytest.mark.parametrize('name, covered', [('01_simplest_possible.txt', 1), ('03_five_users.txt', 4),
+                                           ('04_one_interferer.txt', 0), ('05_equatorial_plane.txt', 1000)])
+def test_small_scenarios_are_solved(name, covered):
+    context = read_context(os.path.join(test_cases, name))
+    _, _, result = exact_planning(context.scenario, context.new_plan(), 0, time_limit, verbose=False)
+    assert result.optimal
+    assert result.covered == covered
+
+
+def test_deadline_covers_the_whole_run():
+    context = read_context(os.path.join(test_cases, '07_eighteen_planes.txt'))
+    start = time.monotonic()
+    solution, _, result = exact_planning(context.scenario, context.new_plan(), 0, 1.0, verbose=False)
+    assert time.monotonic() - start < 1.0 + time_slack
+    assert not result.optimal
+    assert find_violations(context.scenario, solution, context.geometry) == []
+
+
+def test_node_limit_stops_the_search():
+    context = read_context(os.path.join(test_cases, '07_eighteen_planes.txt'))
+    solution, _, result = exact_planning(context.scenario, context.new_plan(), 0, 30.0, node_limit=200,
+                                         verbose=False)
+    assert result.nodes <= 200 + result.components
+    assert result.solved < result.components
+    assert find_violations(context.scenario, solution, context.geometry) == []
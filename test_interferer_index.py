@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+import pytest
+
+import beamplanning as bp
+import interferer_index
+from geometry import ScenarioGeometry, cos_margin, cos_non_starlink_interference_max
+from interferer_index import indexed_interferer_min
+from scenario_generator import geo_belt
+from validator import find_violations
+from visibility import VisibilityIndex
+
+#%% Parameters
+
+test_case_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases', '07_eighteen_planes.txt')
+
+# Catalog sizes: a GEO belt, scattered far interferers, and ones low enough
+# to be anywhere in a region's sky.
+geo_interferers = 180
+far_interferers = 60
+near_interferers = 20
+
+#%% Scenarios
+
+@pytest.fixture(scope='module')
+def scenario():
+    scenario = {}
+    assert bp.read_scenario(test_case_file, scenario, False)
+    rng = np.random.default_rng(0)
+    positions = [geo_belt(geo_interferers, 1.0)]
+    directions = rng.normal(size=(far_interferers, 3))
+    positions.append(directions / np.linalg.norm(directions, axis=1, keepdims=True)
+                     * rng.uniform(8000.0, 30000.0, size=(far_interferers, 1)))
+    # A few hundred km above random users.
+    users = np.array(list(scenario['users'].values()))[rng.choice(len(scenario['users']), near_interferers)]
+    positions.append(users * (1.0 + rng.uniform(0.02, 0.1, size=(near_interferers, 1))))
+    interferers = {f"i{i}": bp.Vector3(*position) for i, position in enumerate(np.vstack(positions).tolist())}
+    assert len(interferers) >= indexed_interferer_min
+    return {**scenario, 'interferers': interferers}
+
+
+def visible_links(geometry: ScenarioGeometry):
+    users, sats = np.nonzero(geometry.visible_mask())
+    return users, sats
+
+
+def dense(monkeypatch):
+    monkeypatch.setattr(interferer_index, 'indexed_interferer_min', 10 ** 9)
+
+#%% Tests
+
+def test_index_is_used_from_the_default_size(scenario):
+    assert ScenarioGeometry(scenario).interferer_index() is not None
+    small = {**scenario, 'interferers': dict(list(scenario['interferers'].items())[:indexed_interferer_min - 1])}
+    assert ScenarioGeometry(small).interferer_index() is None
+
+
+def test_candidates_include_every_close_pair(scenario):
+    geometry = ScenarioGeometry(scenario)
+    users, sats = visible_links(geometry)
+    links, interferers = geometry.interferer_index().candidate_pairs(users, sats)
+    candidates = set(zip(links.tolist(), interferers.tolist()))
+    sep = geometry.interferer_separation_cos(users, sats)
+    close = np.argwhere(sep > cos_non_starlink_interference_max - cos_margin)
+    assert len(close)
+    assert set(map(tuple, close.tolist())) <= candidates
+    # And the index has to narrow things down to pay off.
+    assert len(candidates) < 0.5 * sep.size
+
+
+def test_indexed_pairs_and_masks_match_the_dense_ones(scenario, monkeypatch):
+    geometry = ScenarioGeometry(scenario)
+    users, sats = visible_links(geometry)
+    floor = cos_non_starlink_interference_max - cos_margin
+    indexed_pairs = geometry.interferer_pairs(users, sats, floor)
+    indexed_mask = geometry.interferer_blocked_mask(users, sats)
+    indexed_links = VisibilityIndex(geometry).candidate_links()
+
+    dense(monkeypatch)
+    dense_geometry = ScenarioGeometry(scenario)
+    dense_pairs = dense_geometry.interferer_pairs(users, sats, floor)
+    assert np.array_equal(indexed_pairs[0], dense_pairs[0])
+    assert np.array_equal(indexed_pairs[1], dense_pairs[1])
+    assert np.allclose(indexed_pairs[2], dense_pairs[2], rtol=0.0, atol=1e-12)
+    assert indexed_mask.any()
+    assert np.array_equal(indexed_mask, dense_geometry.interferer_blocked_mask(users, sats))
+    for indexed, expected in zip(indexed_links, VisibilityIndex(dense_geometry).candidate_links()):
+        assert np.array_equal(indexed, expected)
+
+
+def test_users_outside_the_indexed_radii_are_still_covered(scenario, monkeypatch):
+    # Move every user far up or down after the index was built; it must
+    # widen its regions' margins to match the dense check.
+    geometry = ScenarioGeometry(scenario)
+    users, sats = visible_links(geometry)
+    geometry.interferer_blocked_mask(users, sats)
+    moved = {}
+    for i, user_id in enumerate(list(geometry.user_ids)):
+        scale = 2.0 if i % 2 else 0.5
+        moved[user_id] = bp.Vector3(*(scale * c for c in scenario['users'][user_id]))
+        geometry.set_user(user_id, moved[user_id])
+    mask = geometry.interferer_blocked_mask(users, sats)
+
+    dense(monkeypatch)
+    dense_geometry = ScenarioGeometry({**scenario, 'users': {**scenario['users'], **moved}})
+    assert np.array_equal(mask, dense_geometry.interferer_blocked_mask(users, sats))
+
+
+def test_plans_with_a_large_catalog_are_valid(scenario):
+    coverage, solution = bp.planning_optimizer(scenario, seed=0)
+    assert coverage > 0
+    assert find_violations(scenario, solution) == []
@@ -0,0 +1,111 @@
+import os, time
+
+import pytest
+
+import beamplanning as bp
+from local_search import LocalSearch, Move, improve, max_chain_depth
+from optimizer import PlanningContext
+from validator import find_violations
+
+#%% Parameters
+
+# A scenario whose greedy plan leaves users uncovered for the search to try.
+test_case_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases', '07_eighteen_planes.txt')
+
+# Uncovered users cover() is tried on.
+cover_attempts = 40
+
+#%% Plans
+
+@pytest.fixture(scope='module')
+def context():
+    scenario = {}
+    assert bp.read_scenario(test_case_file, scenario, False)
+    return PlanningContext(scenario)
+
+
+def greedy_plan(context):
+    """
+    Returns: a PlanState holding a seeded greedy plan of context's scenario.
+    """
+    _, solution = bp.planning_optimizer(context.scenario, seed=0, context=context)
+    plan = context.new_plan()
+    plan.load_solution(solution)
+    return plan
+
+
+def uncovered_users(plan) -> list:
+    return [user for user in plan.scenario['users'] if user not in plan.covered_users]
+
+#%% Tests
+
+def test_move_rollback_restores_the_plan(context):
+    plan = greedy_plan(context)
+    before = plan.solution()
+    covered = set(plan.covered_users)
+
+    # On the loaded sat most uncovered users can see: move some of its users
+    # onto other sats, which may recolor the beams there, drop a few more,
+    # and give the freed beams to uncovered users.
+    geometry, visibility = plan.geometry, plan.visibility
+    uncovered = uncovered_users(plan)
+    sat_id = max(before, key=lambda sat_id: sum(visibility.has_link(geometry.user_index[user],
+                                                                    geometry.sat_index[sat_id])
+                                                for user in uncovered))
+    move = Move(plan)
+    move.touch(sat_id)
+    for i, beam_id in enumerate(list(plan.sat_states[sat_id].beams)[:8]):
+        user = plan.sat_states[sat_id].beams[beam_id][0]
+        plan.unassign(sat_id, beam_id)
+        for other in visibility.sats_for_user(geometry.user_index[user]).tolist():
+            other_id = geometry.sat_ids[other]
+            if i % 2 == 0 and other_id != sat_id:
+                move.touch(other_id)
+                if plan.try_assign(user, other_id) is not None:
+                    break
+    assert sum(plan.try_assign(user, sat_id) is not None for user in uncovered) > 0
+    assert plan.solution() != before
+
+    touched = list(move.saved)
+    move.rollback()
+    assert plan.solution() == before
+    assert plan.covered_users == covered
+    # Each touched sat's direction index must hold its restored beams.
+    for sat_id in touched:
+        state = plan.sat_states[sat_id]
+        assert {key: direction for bucket in state.index.buckets.values()
+                for key, direction in bucket.items()} == state.directions
+
+    # And the plan answers placements just as one freshly loaded with it does.
+    fresh = context.new_plan()
+    fresh.load_solution(before)
+    for user in uncovered:
+        for sat in visibility.sats_for_user(geometry.user_index[user]).tolist():
+            plan.try_assign(user, geometry.sat_ids[sat])
+            fresh.try_assign(user, geometry.sat_ids[sat])
+    assert plan.solution() == fresh.solution()
+
+
+def test_cover_leaves_the_plan_unchanged_on_failure(context):
+    plan = greedy_plan(context)
+    search = LocalSearch(plan, seed=0)
+    for user in uncovered_users(plan)[:cover_attempts]:
+        before = plan.solution()
+        covered = len(plan.covered_users)
+        if search.cover(user, max_chain_depth):
+            assert user in plan.covered_users
+            assert len(plan.covered_users) == covered + 1
+        else:
+            assert plan.solution() == before
+            assert len(plan.covered_users) == covered
+    assert find_violations(context.scenario, plan.solution(), context.geometry) == []
+
+
+def test_improve_never_loses_coverage(context):
+    plan = greedy_plan(context)
+    rates = [plan.coverage_rate()]
+    for rate in improve(plan, time.monotonic() + 1.0, seed=0):
+        rates.append(rate)
+    assert rates == sorted(rates)
+    assert len(rates) > 1
+    assert find_violations(context.scenario, plan.solution(), context.geometry) == []
@@ -0,0 +1,47 @@
+import os, glob
+
+import pytest
+
+import beamplanning as bp
+from beamplanning import beams_per_satellite
+from bounds import link_flow
+from matching import max_flow_assignment
+from optimizer import PlanningContext
+from validator import find_violations
+
+#%% Parameters
+
+# The shipped scenarios small enough to plan on every run.
+test_case_files = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases', '0[0-7]*.txt')))
+
+#%% Tests
+
+def read(filename: str) -> dict:
+    scenario = {}
+    assert bp.read_scenario(filename, scenario, False)
+    return scenario
+
+
+@pytest.mark.parametrize('filename', test_case_files, ids=os.path.basename)
+def test_matching_plans_are_valid(filename):
+    scenario = read(filename)
+    coverage, solution = bp.planning_optimizer(scenario, 'matching', seed=0)
+    assert find_violations(scenario, solution) == []
+    covered = sum(len(beams) for beams in solution.values())
+    assert coverage == pytest.approx(covered / len(scenario['users']))
+
+
+@pytest.mark.parametrize('filename', [f for f in test_case_files if os.path.basename(f)[:2] in ('06', '07')],
+                         ids=os.path.basename)
+def test_max_flow_assignment_is_a_maximum_matching(filename):
+    context = PlanningContext(read(filename))
+    visibility = context.visibility
+    n_users, n_sats = len(context.geometry.user_ids), len(context.geometry.sat_ids)
+    assigned = max_flow_assignment(visibility, n_users, n_sats)
+
+    users = [user for sat_users in assigned.values() for user in sat_users]
+    assert len(users) == len(set(users))
+    for sat, sat_users in assigned.items():
+        assert len(sat_users) <= beams_per_satellite
+        assert all(visibility.has_link(user, sat) for user in sat_users)
+    assert len(users) == link_flow(visibility, n_users, n_sats)
@@ -0,0 +1,114 @@
+import os, sys, random
+
+import pytest
+
+import beamplanning as bp
+import outage
+from outage import OutageCase, WhatIf, evaluate_all
+from validator import find_violations
+
+#%% Parameters
+
+test_cases = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases')
+test_case_file = os.path.join(test_cases, '07_eighteen_planes.txt')
+
+# Random outage sets tried, and failed sats in each.
+case_count = 6
+case_size = 8
+
+#%% Cases
+
+@pytest.fixture(scope='module')
+def whatif():
+    scenario = {}
+    assert bp.read_scenario(test_case_file, scenario, False)
+    _, solution = bp.planning_optimizer(scenario, seed=0)
+    return WhatIf(scenario, solution)
+
+
+def random_case(whatif: WhatIf, rng: random.Random, i: int) -> OutageCase:
+    """
+    Returns: an outage set of failed sats, and on odd i an interferer right
+    behind a loaded sat, as seen from one of its users.
+    """
+    scenario = whatif.scenario
+    sats = rng.sample(sorted(scenario['sats']), case_size)
+    interferers = {}
+    if i % 2:
+        sat_id = rng.choice(sorted(whatif.plan.solution()))
+        user, _ = next(iter(whatif.plan.sat_states[sat_id].beams.values()))
+        user_loc, sat_loc = scenario['users'][user], scenario['sats'][sat_id]
+        interferers[f"intf{i}"] = bp.Vector3(*(u + 30.0 * (s - u) for u, s in zip(user_loc, sat_loc)))
+    return OutageCase(f"case{i}", sats, interferers)
+
+
+def cases(whatif: WhatIf) -> list:
+    rng = random.Random(0)
+    return [random_case(whatif, rng, i) for i in range(case_count)]
+
+
+def apply_changes(solution: dict, changes: list) -> dict:
+    solution = {sat_id: dict(beams) for sat_id, beams in solution.items()}
+    for change in changes:
+        beams = solution.setdefault(change['sat'], {})
+        if change['action'] == 'remove':
+            assert beams.pop(change['beam']) == (change['user'], change['color'])
+        else:
+            beams[change['beam']] = (change['user'], change['color'])
+    return {sat_id: beams for sat_id, beams in solution.items() if beams}
+
+#%% Tests
+
+def test_cases_leave_the_base_plan_as_it_was(whatif):
+    plan = whatif.plan
+    base = plan.solution()
+    covered = set(plan.covered_users)
+    for case in cases(whatif):
+        report = whatif.evaluate(case)
+        assert report.error is None and report.lost > 0
+        assert plan.solution() == base
+        assert plan.covered_users == covered
+        assert plan.visibility is whatif.context.visibility
+        for state in plan.sat_states.values():
+            assert {key: direction for bucket in state.index.buckets.values()
+                    for key, direction in bucket.items()} == state.directions
+
+
+def test_outage_plans_are_valid(whatif):
+    base = whatif.plan.solution()
+    for case in cases(whatif):
+        report = whatif.evaluate(case)
+        after = apply_changes(base, report.changes)
+        scenario = dict(whatif.scenario)
+        scenario['sats'] = {sat_id: loc for sat_id, loc in scenario['sats'].items() if sat_id not in case.sats}
+        scenario['interferers'] = {**scenario['interferers'], **case.interferers}
+        assert find_violations(scenario, after) == []
+
+        covered = sum(len(beams) for beams in after.values())
+        assert report.coverage_after == pytest.approx(covered / report.users)
+        assert covered == len(whatif.plan.covered_users) - report.lost + report.recovered
+        assert sum(change['action'] == 'remove' for change in report.changes) >= report.lost
+
+
+def test_workers_give_the_same_reports(whatif):
+    one = [report.as_dict() for report in evaluate_all(whatif, cases(whatif), 1)]
+    two = [report.as_dict() for report in evaluate_all(whatif, cases(whatif), 2)]
+    for report in one + two:
+        report.pop('elapsed_s')
+    assert one == two
+
+
+def test_unknown_sat_is_an_error(whatif):
+    base = whatif.plan.solution()
+    report = whatif.evaluate(OutageCase('bad', ['no such sat']))
+    assert report.error == 'unknown sat no such sat'
+    assert whatif.plan.solution() == base
+
+
+def test_invalid_solution_file_is_refused(tmp_path, monkeypatch, capsys):
+    solution_file = tmp_path / 'solution.txt'
+    solution_file.write_text("sat 1 beam 1 user 1 color A\nsat 1 beam 2 user 1 color B\n")
+    monkeypatch.setattr(sys, 'argv', ['outage.py', os.path.join(test_cases, '00_example.txt'),
+                                      '--solution', str(solution_file), '--fail', '1', '--no-cache'])
+    assert outage.main() == -1
+    assert '1 violations' in capsys.readouterr().err
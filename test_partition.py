@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import beamplanning as bp
+import partition
+from optimizer import PlanningContext
+from partition import partition_scenario, partitioned_planning
+from validator import find_violations
+
+#%% Parameters
+
+test_cases = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases')
+
+# Part size that splits test case 07 on the grid.
+small_part_users = 500
+
+#%% Scenarios
+
+def read_context(name: str) -> PlanningContext:
+    scenario = {}
+    assert bp.read_scenario(os.path.join(test_cases, name), scenario, False)
+    return PlanningContext(scenario)
+
+
+@pytest.fixture(scope='module')
+def context_07():
+    return read_context('07_eighteen_planes.txt')
+
+
+@pytest.fixture
+def small_parts(monkeypatch):
+    split = partition.partition_scenario
+    monkeypatch.setattr(partition, 'partition_scenario',
+                        lambda geometry, visibility: split(geometry, visibility, small_part_users))
+
+#%% Tests
+
+def test_parts_are_disjoint_and_cover_every_linked_user(context_07):
+    geometry, visibility = context_07.geometry, context_07.visibility
+    parts = partition_scenario(geometry, visibility, small_part_users)
+    assert len(parts) > 1
+    users = [user for part_users, _ in parts for user in part_users]
+    sats = [sat for _, part_sats in parts for sat in part_sats]
+    assert len(users) == len(set(users))
+    assert len(sats) == len(set(sats))
+    assert set(users) == {user for user in range(len(geometry.user_ids)) if len(visibility.sats_for_user(user))}
+    # Every part's sats are seen by some user of that part.
+    for part_users, part_sats in parts:
+        seen = {sat for user in part_users for sat in visibility.sats_for_user(user).tolist()}
+        assert set(part_sats) <= seen
+
+
+@pytest.mark.parametrize('planner', ['greedy', 'priority', 'matching'])
+def test_merged_plans_are_valid(context_07, small_parts, planner):
+    solution, coverage = partitioned_planning(context_07, planner, seed=0)
+    scenario = context_07.scenario
+    assert find_violations(scenario, solution, context_07.geometry) == []
+    covered = sum(len(beams) for beams in solution.values())
+    assert coverage == pytest.approx(covered / len(scenario['users']))
+
+
+def test_merge_rehomes_users_across_cell_boundaries(context_07, small_parts):
+    # With many small cells, some users can only see sats owned by another
+    # cell; only the merge can cover them.
+    geometry, visibility = context_07.geometry, context_07.visibility
+    parts = partition.partition_scenario(geometry, visibility)
+    stranded = {geometry.user_ids[user] for part_users, part_sats in parts for user in part_users
+                if not set(visibility.sats_for_user(user).tolist()) & set(part_sats)}
+    assert stranded
+    solution, _ = partitioned_planning(context_07, 'priority', seed=0)
+    covered = {user for beams in solution.values() for user, _ in beams.values()}
+    assert stranded & covered
+
+
+def test_workers_plan_the_same_parts(context_07, small_parts):
+    assert partitioned_planning(context_07, 'greedy', workers=2, seed=0) == \
+        partitioned_planning(context_07, 'greedy', workers=1, seed=0)
+
+
+def test_large_scenario_is_split_and_valid():
+    context = read_context('09_ten_thousand_users.txt')
+    assert len(partition_scenario(context.geometry, context.visibility)) > 1
+    solution, coverage = partitioned_planning(context, 'priority', seed=0)
+    assert find_violations(context.scenario, solution, context.geometry) == []
+    assert coverage > 0.9
@@ -0,0 +1,109 @@
+import os, random
+
+import pytest
+
+import beamplanning as bp
+from geometry import ScenarioGeometry
+from planning_service import PlanningService
+from validator import find_violations
+from visibility import VisibilityIndex
+
+#%% Parameters
+
+test_case_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases', '07_eighteen_planes.txt')
+
+# Random requests applied per run.
+request_count = 60
+
+#%% Requests
+
+@pytest.fixture
+def service():
+    scenario = {}
+    assert bp.read_scenario(test_case_file, scenario, False)
+    return PlanningService(scenario, seed=0)
+
+
+def random_request(service: PlanningService, rng: random.Random, i: int) -> dict:
+    """
+    Returns: a random join, leave, move_sat or add_interferer request.
+    """
+    scenario = service.scenario
+    kind = rng.choice(['join', 'join', 'leave', 'move_sat', 'add_interferer'])
+    if kind == 'join':
+        # A new user near an existing one, or an existing user moved.
+        near = scenario['users'][rng.choice(sorted(scenario['users']))]
+        user = rng.choice([f"new{i}", rng.choice(sorted(scenario['users']))])
+        return {'op': 'join', 'user': user, 'position': [c + rng.uniform(-200.0, 200.0) for c in near]}
+    if kind == 'leave':
+        return {'op': 'leave', 'user': rng.choice(sorted(scenario['users']))}
+    if kind == 'move_sat':
+        sat_id = rng.choice(sorted(scenario['sats']))
+        x, y, z = scenario['sats'][sat_id]
+        return {'op': 'move_sat', 'sat': sat_id, 'position': [x + rng.uniform(-300.0, 300.0), y, z]}
+    # Right behind a served user's sat, as seen from the user, so it blocks.
+    sat_id = rng.choice(sorted(service.plan.solution()))
+    user, _ = next(iter(service.plan.sat_states[sat_id].beams.values()))
+    user_loc, sat_loc = scenario['users'][user], scenario['sats'][sat_id]
+    return {'op': 'add_interferer', 'interferer': f"intf{i}",
+            'position': [u + 30.0 * (s - u) for u, s in zip(user_loc, sat_loc)]}
+
+
+def apply_changes(solution: dict, changes: list):
+    for change in changes:
+        beams = solution.setdefault(change['sat'], {})
+        if change['action'] == 'remove':
+            assert beams.pop(change['beam']) == (change['user'], change['color'])
+        else:
+            assert change['beam'] not in beams
+            beams[change['beam']] = (change['user'], change['color'])
+    for sat_id in [sat_id for sat_id, beams in solution.items() if not beams]:
+        del solution[sat_id]
+
+
+def beam_list(solution: dict) -> dict:
+    return {(sat_id, beam_id): beam for sat_id, beams in solution.items() for beam_id, beam in beams.items()}
+
+#%% Tests
+
+@pytest.mark.parametrize('seed', range(2))
+def test_deltas_match_a_full_revalidation(service, seed):
+    rng = random.Random(seed)
+    response = service.handle({'op': 'solution'})
+    mirror = {}
+    apply_changes(mirror, response['beams'])
+    for i in range(request_count):
+        response = service.handle(random_request(service, rng, i))
+        assert response['ok'], response
+        apply_changes(mirror, response['changes'])
+        assert beam_list(mirror) == beam_list(service.plan.solution())
+        scenario = service.scenario
+        assert response['coverage'] == pytest.approx(
+            sum(len(beams) for beams in mirror.values()) / len(scenario['users']))
+    assert find_violations(service.scenario, mirror) == []
+    assert service.user_sat == {user: sat_id for sat_id, beams in mirror.items() for user, _ in beams.values()}
+
+    # The links kept up by the deltas are the ones a fresh index finds.
+    geometry = ScenarioGeometry(service.scenario)
+    fresh = VisibilityIndex(geometry)
+    expected = {(user_id, geometry.sat_ids[sat]) for user, user_id in enumerate(geometry.user_ids)
+                for sat in fresh.sats_for_user(user).tolist()}
+    kept = {(user_id, service.geometry.sat_ids[sat]) for user_id in service.scenario['users']
+            for sat in service.visibility.sats_for_user(service.geometry.user_index[user_id]).tolist()}
+    assert kept == expected
+
+
+@pytest.mark.parametrize('position', [[0, 0, 0], [1.0, 2.0], [1.0, 'x', 3.0], 5, [float('nan'), 0.0, 6371.0]])
+def test_bad_positions_change_nothing(service, position):
+    before = service.plan.solution()
+    users = dict(service.scenario['users'])
+    for request in [{'op': 'join', 'user': 'new', 'position': position},
+                    {'op': 'move_sat', 'sat': next(iter(service.scenario['sats'])), 'position': position},
+                    {'op': 'add_interferer', 'interferer': 'new', 'position': position}]:
+        response = service.handle(request)
+        assert not response['ok']
+        assert 'position' in response['error']
+        assert response['changes'] == []
+    assert service.plan.solution() == before
+    assert service.scenario['users'] == users
+    assert 'new' not in service.scenario['interferers']
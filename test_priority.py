@@ -0,0 +1,81 @@
+import os, glob
+
+import pytest
+
+import beamplanning as bp
+from optimizer import PlanningContext
+from priority import PriorityPlanner
+from validator import find_violations
+
+#%% Parameters
+
+test_cases = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases')
+
+# The shipped scenarios small enough to plan on every run.
+test_case_files = sorted(glob.glob(os.path.join(test_cases, '0[0-7]*.txt')))
+
+# Placements between two checks of the planner's lazy counts.
+check_every = 50
+
+#%% Tests
+
+def read(filename: str) -> dict:
+    scenario = {}
+    assert bp.read_scenario(filename, scenario, False)
+    return scenario
+
+
+@pytest.mark.parametrize('filename', test_case_files, ids=os.path.basename)
+def test_priority_plans_are_valid(filename):
+    scenario = read(filename)
+    coverage, solution = bp.planning_optimizer(scenario, 'priority', seed=0)
+    assert find_violations(scenario, solution) == []
+    covered = sum(len(beams) for beams in solution.values())
+    assert coverage == pytest.approx(covered / len(scenario['users']))
+
+
+class CheckedPlanner(PriorityPlanner):
+    """
+    A PriorityPlanner that checks its lazily kept counts against the plan
+    every check_every placements.
+    """
+
+    placements = 0
+
+    def after_placing(self, user: int, sat: int, beam_id: int, recolored: bool = False):
+        super().after_placing(user, sat, beam_id, recolored)
+        self.placements += 1
+        if self.placements % check_every == 0:
+            self.check_counts()
+
+    def check_counts(self):
+        plan, geometry = self.plan, self.plan.geometry
+        demand = [0] * len(self.demand)
+        for user, options in enumerate(self.options):
+            if self.done[user]:
+                continue
+            user_id = geometry.user_ids[user]
+            for sat in plan.visibility.sats_for_user(user).tolist():
+                state = plan.sat_state(geometry.sat_ids[sat])
+                fits = not state.is_full() and state.free_color(user_id) is not None
+                assert (sat in options) == fits, (user_id, geometry.sat_ids[sat])
+            for sat in options:
+                demand[sat] += 1
+        assert demand == self.demand
+
+
+def test_lazy_counts_match_the_plan():
+    context = PlanningContext(read(os.path.join(test_cases, '06_partially_fullfillable.txt')))
+    planner = CheckedPlanner(context.new_plan(), seed=0)
+    planner.run()
+    assert planner.placements >= check_every
+    assert find_violations(context.scenario, planner.plan.solution(), context.geometry) == []
+
+
+def test_same_seed_same_plan():
+    scenario = read(os.path.join(test_cases, '07_eighteen_planes.txt'))
+    context = PlanningContext(scenario)
+    first = bp.planning_optimizer(scenario, 'priority', seed=3, context=context)
+    second = bp.planning_optimizer(scenario, 'priority', seed=3, context=context)
+    assert first[0] == second[0]
+    assert dict(first[1]) == dict(second[1])
@@ -0,0 +1,103 @@
+import os
+from math import cos, sin, radians
+
+import pytest
+
+import beamplanning as bp
+from optimizer import PlanningContext
+from replan import EpochReport, replan_epochs, warm_keep_min, warm_start
+from validator import find_violations
+
+#%% Parameters
+
+test_case_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases', '07_eighteen_planes.txt')
+
+# How far the sats move between two close snapshots, and between two that
+# share almost nothing, degrees about the earth's axis.
+small_step_degrees = 0.5
+large_step_degrees = 40.0
+
+#%% Snapshots
+
+@pytest.fixture(scope='module')
+def scenario():
+    scenario = {}
+    assert bp.read_scenario(test_case_file, scenario, False)
+    return scenario
+
+
+def rotated(scenario: dict, degrees: float) -> dict:
+    """
+    Returns: scenario with its sats turned degrees about the z axis.
+    """
+    c, s = cos(radians(degrees)), sin(radians(degrees))
+    return {**scenario, 'sats': {sat_id: bp.Vector3(c * x - s * y, s * x + c * y, z)
+                                 for sat_id, (x, y, z) in scenario['sats'].items()}}
+
+
+def write_scenario(path, scenario: dict) -> str:
+    with open(path, 'w') as f:
+        for object_type, key in [('sat', 'sats'), ('user', 'users'), ('interferer', 'interferers')]:
+            for object_id, (x, y, z) in scenario[key].items():
+                f.write(f"{object_type} {object_id} {x!r} {y!r} {z!r}\n")
+    return str(path)
+
+
+def warm_plan(scenario: dict, previous: dict):
+    plan = PlanningContext(scenario).new_plan()
+    report = EpochReport('-')
+    return plan, report, warm_start(plan, previous, report)
+
+#%% Tests
+
+def test_unchanged_snapshot_keeps_every_beam(scenario):
+    _, previous = bp.planning_optimizer(scenario, seed=0)
+    previous = {sat_id: dict(beams) for sat_id, beams in previous.items()}
+    plan, report, warm = warm_plan(scenario, previous)
+    assert warm
+    assert plan.solution() == previous
+    assert report.kept == sum(len(beams) for beams in previous.values())
+    assert report.recolored == 0
+
+
+def test_small_step_is_warm_started(scenario, tmp_path):
+    files = [write_scenario(tmp_path / f'{i}.txt', rotated(scenario, i * small_step_degrees)) for i in range(3)]
+    epochs = list(replan_epochs(files, seed=0, use_cache=False, cold=True))
+    assert len(epochs) == 3
+    for i, (report, solution) in enumerate(epochs):
+        snapshot = rotated(scenario, i * small_step_degrees)
+        assert find_violations(snapshot, dict(solution)) == []
+        if i:
+            assert report.warm
+            assert report.kept > 0.9 * report.users * report.coverage_rate
+            assert report.coverage_rate >= report.cold_coverage_rate - 0.02
+    # The first epoch is always planned in full.
+    assert not epochs[0][0].warm
+
+
+def test_large_step_falls_back_to_a_cold_plan(scenario, tmp_path):
+    files = [write_scenario(tmp_path / '0.txt', scenario),
+             write_scenario(tmp_path / '1.txt', rotated(scenario, large_step_degrees))]
+    (_, first), (report, solution) = replan_epochs(files, seed=0, use_cache=False)
+    assert not report.warm
+    assert report.kept == 0
+    assert report.replanned == report.users
+    assert find_violations(rotated(scenario, large_step_degrees), dict(solution)) == []
+
+    # A forced warm start of the same step would have kept too little.
+    _, direct, warm = warm_plan(rotated(scenario, large_step_degrees), dict(first))
+    assert not warm
+    assert direct.kept < warm_keep_min * sum(len(beams) for beams in first.values())
+
+
+def test_handovers_and_drops_are_counted(scenario, tmp_path):
+    moved = rotated(scenario, small_step_degrees)
+    gone = sorted(moved['users'])[:50]
+    moved['users'] = {user_id: loc for user_id, loc in moved['users'].items() if user_id not in gone}
+    files = [write_scenario(tmp_path / '0.txt', scenario), write_scenario(tmp_path / '1.txt', moved)]
+    (_, first), (report, solution) = replan_epochs(files, seed=0, use_cache=False)
+    before = {user: sat_id for sat_id, beams in first.items() for user, _ in beams.values()}
+    after = {user: sat_id for sat_id, beams in solution.items() for user, _ in beams.values()}
+    assert report.dropped == sum(user not in after for user in before)
+    assert report.handovers == sum(user in after and after[user] != sat_id for user, sat_id in before.items())
+    assert report.dropped >= sum(user in before for user in gone)
@@ -0,0 +1,99 @@
+import os, shutil
+
+import numpy as np
+import pytest
+
+import beamplanning as bp
+import scenario_loader
+from scenario_loader import cache_dir_name, cache_path, load_scenario_arrays
+
+#%% Parameters
+
+test_case_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases', '07_eighteen_planes.txt')
+
+#%% Scenarios
+
+@pytest.fixture
+def scenario_file(tmp_path):
+    path = tmp_path / 'scenario.txt'
+    shutil.copy(test_case_file, path)
+    return str(path)
+
+
+def cache_files(filename: str) -> list:
+    directory = os.path.join(os.path.dirname(filename), cache_dir_name)
+    return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def no_parsing(monkeypatch):
+    def parse_scenario(filename):
+        raise AssertionError(f"{filename} was parsed, not read from its cache")
+    monkeypatch.setattr(scenario_loader, 'parse_scenario', parse_scenario)
+
+
+def same_arrays(a, b) -> bool:
+    return all(a.ids[key] == b.ids[key] and np.array_equal(a.positions[key], b.positions[key])
+               for _, key in scenario_loader.object_types)
+
+#%% Tests
+
+def test_cache_is_written_then_read(scenario_file, monkeypatch):
+    parsed = load_scenario_arrays(scenario_file)
+    assert cache_files(scenario_file) == [os.path.basename(cache_path(scenario_file))]
+    no_parsing(monkeypatch)
+    assert same_arrays(load_scenario_arrays(scenario_file), parsed)
+
+
+def test_cached_scenario_matches_the_text(scenario_file):
+    parsed, cached = {}, {}
+    assert bp.read_scenario(scenario_file, parsed, False)
+    assert bp.read_scenario(scenario_file, {}, True)
+    assert bp.read_scenario(scenario_file, cached, True)
+    assert cached == parsed
+
+
+def test_edit_invalidates_the_cache(scenario_file):
+    load_scenario_arrays(scenario_file)
+    old_cache = cache_files(scenario_file)
+    with open(scenario_file, 'a') as f:
+        f.write("user extra 6371 0 0\n")
+
+    arrays = load_scenario_arrays(scenario_file)
+    assert arrays.ids['users'][-1] == 'extra'
+    # The stale cache is dropped when the new one is written.
+    assert cache_files(scenario_file) != old_cache
+    assert len(cache_files(scenario_file)) == 1
+
+
+def test_touch_alone_invalidates_the_cache(scenario_file):
+    # Same size, new mtime: the cache must still miss.
+    load_scenario_arrays(scenario_file)
+    path = cache_path(scenario_file)
+    stat = os.stat(scenario_file)
+    os.utime(scenario_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache_path(scenario_file) != path
+
+
+def test_no_cache_neither_reads_nor_writes_it(scenario_file, monkeypatch):
+    arrays = load_scenario_arrays(scenario_file, use_cache=False)
+    assert cache_files(scenario_file) == []
+    load_scenario_arrays(scenario_file)
+    calls = []
+    parse = scenario_loader.parse_scenario
+    monkeypatch.setattr(scenario_loader, 'parse_scenario', lambda filename: calls.append(filename) or parse(filename))
+    assert same_arrays(load_scenario_arrays(scenario_file, use_cache=False), arrays)
+    assert calls == [scenario_file]
+
+
+def test_corrupt_cache_is_reparsed(scenario_file):
+    parsed = load_scenario_arrays(scenario_file)
+    with open(cache_path(scenario_file), 'wb') as f:
+        f.write(b'not an npz file')
+    assert same_arrays(load_scenario_arrays(scenario_file), parsed)
+
+
+def test_invalid_line_fails(scenario_file):
+    with open(scenario_file, 'a') as f:
+        f.write("sat 1 2 3\n")
+    assert load_scenario_arrays(scenario_file) is None
+    assert cache_files(scenario_file) == []
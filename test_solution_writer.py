@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from beamplanning import Vector3
+from compact import BeamTable
+from geometry import ScenarioGeometry
+from solution_writer import SolutionWriter
+
+#%% Scenarios
+
+scenario = {
+    'sats': {'1': Vector3(0.0, 0.0, 6921.0), '2': Vector3(0.0, 6921.0, 0.0)},
+    'users': {'1': Vector3(0.0, 0.0, 6371.0), '2': Vector3(0.0, 6371.0, 0.0)},
+    'interferers': {},
+}
+
+solution = {'1': {1: ('1', 'A')}, '2': {3: ('2', 'C')}}
+
+lines = ["sat 1 beam 1 user 1 color A\n", "sat 2 beam 3 user 2 color C\n"]
+
+old_plan = "sat 9 beam 9 user 9 color D\n"
+
+#%% Targets
+
+@pytest.fixture
+def target(tmp_path):
+    path = tmp_path / 'solution.txt'
+    path.write_text(old_plan)
+    return path
+
+
+def leftovers(path) -> list:
+    return [name for name in os.listdir(path.parent) if name != path.name]
+
+#%% Tests
+
+def test_atomic_write_replaces_the_target_on_close(target):
+    with SolutionWriter(str(target)) as writer:
+        writer.write_solution(solution)
+        # Readers still see the old plan until the writer closes.
+        assert target.read_text() == old_plan
+    assert target.read_text() == ''.join(lines)
+    assert leftovers(target) == []
+    assert oct(target.stat().st_mode & 0o777) == oct(0o644)
+
+
+def test_atomic_write_leaves_the_target_alone_on_error(target):
+    with pytest.raises(RuntimeError):
+        with SolutionWriter(str(target)) as writer:
+            writer.write_solution(solution)
+            raise RuntimeError('planner failed')
+    assert target.read_text() == old_plan
+    assert leftovers(target) == []
+
+
+def test_non_atomic_write_truncates_at_once(target):
+    with pytest.raises(RuntimeError):
+        with SolutionWriter(str(target), atomic=False) as writer:
+            assert target.read_text() == ''
+            writer.write_beam('1', 1, '1', 'A')
+            raise RuntimeError('planner failed')
+    assert target.read_text() == lines[0]
+    assert leftovers(target) == []
+
+
+def test_beam_table_writes_like_its_dict(target):
+    table = BeamTable.from_solution(ScenarioGeometry(scenario), solution)
+    with SolutionWriter(str(target)) as writer:
+        writer.write_solution(table)
+    assert sorted(target.read_text().splitlines(keepends=True)) == lines
+
+
+def test_stdout(capsys):
+    with SolutionWriter() as writer:
+        writer.write_sat('1', solution['1'])
+    assert capsys.readouterr().out == lines[0]
@@ -0,0 +1,254 @@
+import os, glob, random
+from math import cos, sin, radians
+
+import numpy as np
+import pytest
+
+import beamplanning as bp
+import interferer_index
+from beamplanning import (Vector3, origin, calculate_angle_degrees, self_interference_max,
+                          non_starlink_interference_max, max_user_visible_angle, valid_color_ids)
+from coloring import conflict_graph
+from geometry import ScenarioGeometry
+from validator import StreamingValidator, find_violations
+
+#%% Parameters
+
+# The shipped scenarios.
+test_case_files = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_cases', '*.txt')))
+
+# Lines per block when streaming in small blocks.
+small_block_lines = 7
+
+# Near-threshold cases per rule, and the range of their offsets from the
+# threshold, degrees, on a log scale.
+borderline_cases = 300
+borderline_offsets = (-15, -6)
+
+#%% Scalar reference
+
+def scalar_violations(scenario: dict, solution: dict) -> set:
+    """
+    Returns: every violation of solution, found pair by pair with
+    calculate_angle_degrees the way the original checks did, as
+    (rule, sat, beams, user, other) tuples.
+    """
+    found = set()
+    seen = set()
+    for sat, beams in solution.items():
+        sat_loc = scenario['sats'][sat]
+        keys = list(beams)
+        for beam in keys:
+            user = beams[beam][0]
+            user_loc = scenario['users'][user]
+            if user in seen:
+                found.add(('coverage', None, None, user, None))
+            seen.add(user)
+            if calculate_angle_degrees(user_loc, origin, sat_loc) <= 180.0 - max_user_visible_angle:
+                found.add(('visibility', sat, str(beam), user, None))
+            for interferer, interferer_loc in scenario['interferers'].items():
+                if calculate_angle_degrees(user_loc, sat_loc, interferer_loc) < non_starlink_interference_max:
+                    found.add(('interferer', sat, str(beam), user, interferer))
+        for i in range(len(keys)):
+            for j in range(i + 1, len(keys)):
+                (user_a, color_a), (user_b, color_b) = beams[keys[i]], beams[keys[j]]
+                if color_a == color_b and calculate_angle_degrees(
+                        sat_loc, scenario['users'][user_a], scenario['users'][user_b]) < self_interference_max:
+                    found.add(('self_interference', sat, frozenset((str(keys[i]), str(keys[j]))), None, None))
+    return found
+
+
+def violation_key(violation) -> tuple:
+    """
+    Returns: a validator Violation in scalar_violations' form.
+    """
+    rule, sat, beam, user, other, _ = violation
+    if rule == 'coverage':
+        return rule, None, None, user, None
+    if rule == 'self_interference':
+        return rule, sat, frozenset((str(beam), str(other))), None, None
+    return rule, sat, str(beam), user, other
+
+
+def vector_violations(scenario: dict, solution: dict) -> set:
+    """
+    Returns: find_violations(scenario, solution) in scalar_violations' form.
+    """
+    return {violation_key(violation) for violation in find_violations(scenario, solution)}
+
+
+def streamed_violations(scenario: dict, solution: dict, seed: int, block_lines: int = None) -> set:
+    """
+    Returns: the violations StreamingValidator finds in solution's lines, fed
+    in a seeded random order, in scalar_violations' form.
+    """
+    lines = [f"sat {sat} beam {beam} user {user} color {color}\n"
+             for sat, beams in solution.items() for beam, (user, color) in beams.items()]
+    random.Random(seed).shuffle(lines)
+    validator = StreamingValidator(scenario) if block_lines is None else \
+        StreamingValidator(scenario, block_lines=block_lines)
+    found = set()
+    for line in lines:
+        found.update(map(violation_key, validator.feed(line)))
+        assert len(validator.block) < validator.block_lines
+    found.update(map(violation_key, validator.flush()))
+    return found
+
+#%% Scenarios
+
+def perturbed_solution(scenario: dict, seed: int) -> dict:
+    """
+    Returns: a greedy plan of scenario with some beams recolored alike, moved
+    to other sats or doubled up, so every rule has something to catch.
+    """
+    rng = random.Random(seed)
+    _, planned = bp.planning_optimizer(scenario, seed=seed)
+    solution = {sat: dict(beams) for sat, beams in planned.items()}
+    sat_ids = list(scenario['sats'])
+    user_ids = list(scenario['users'])
+    for sat, beams in solution.items():
+        for beam, (user, color) in list(beams.items()):
+            if rng.random() < 0.3:
+                beams[beam] = (user, valid_color_ids[0])
+    for _ in range(max(2, len(user_ids) // 50)):
+        sat = rng.choice(sat_ids)
+        beams = solution.setdefault(sat, {})
+        free = [beam for beam in range(1, bp.beams_per_satellite + 1) if beam not in beams]
+        if free:
+            beams[free[0]] = (rng.choice(user_ids), rng.choice(valid_color_ids))
+    return {sat: beams for sat, beams in solution.items() if beams}
+
+
+def point(direction, distance: float, start=(0.0, 0.0, 0.0)) -> Vector3:
+    return Vector3(*(float(s + distance * d) for s, d in zip(start, direction)))
+
+
+def tilted(axis: np.ndarray, degrees: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Returns: a unit vector degrees away from unit vector axis, in a random direction.
+    """
+    side = np.cross(axis, rng.normal(size=3))
+    side /= np.linalg.norm(side)
+    angle = radians(degrees)
+    return cos(angle) * axis + sin(angle) * side
+
+
+def borderline_scenario(seed: int, n_interferers: int = 0):
+    """
+    Returns: scenario, solution where every beam sits a tiny random offset
+    either side of one of the thresholds: its sat's zenith angle, its
+    separation from an interferer, or its separation from the sat's other
+    beam of the same color.
+    """
+    rng = np.random.default_rng(seed)
+    scenario = {'sats': {}, 'users': {}, 'interferers': {}}
+    solution = {}
+
+    def offset() -> float:
+        return float(rng.choice([-1.0, 1.0]) * 10 ** rng.uniform(*borderline_offsets))
+
+    for i in range(borderline_cases):
+        up = rng.normal(size=3)
+        up /= np.linalg.norm(up)
+        user = point(up, 6371.0)
+        rule = i % 3
+        zenith = max_user_visible_angle + offset() if rule == 0 else rng.uniform(0.0, 30.0)
+        to_sat = tilted(up, zenith, rng)
+        sat = point(to_sat, rng.uniform(550.0, 1200.0), user)
+        scenario['users'][f'u{i}'] = user
+        scenario['sats'][f's{i}'] = sat
+        beams = solution[f's{i}'] = {1: (f'u{i}', 'A')}
+        if rule == 1:
+            away = tilted(to_sat, non_starlink_interference_max + offset(), rng)
+            scenario['interferers'][f'i{i}'] = point(away, rng.uniform(20000.0, 40000.0), user)
+        elif rule == 2:
+            to_user = -to_sat
+            other = tilted(to_user, self_interference_max + offset(), rng)
+            scenario['users'][f'v{i}'] = point(other, float(np.linalg.norm(np.subtract(user, sat))), sat)
+            beams[2] = (f'v{i}', 'A')
+    # Pad the catalog with interferers near the center of the earth, far
+    # below every link, e.g. to reach the indexed path.
+    for k in range(n_interferers - len(scenario['interferers'])):
+        direction = rng.normal(size=3)
+        scenario['interferers'][f'far{k}'] = point(direction / np.linalg.norm(direction), 100.0)
+    return scenario, solution
+
+#%% Tests
+
+@pytest.mark.parametrize('filename', test_case_files, ids=os.path.basename)
+def test_matches_scalar_checks_on_test_cases(filename):
+    scenario = {}
+    assert bp.read_scenario(filename, scenario, False)
+    solution = perturbed_solution(scenario, 0)
+    assert vector_violations(scenario, solution) == scalar_violations(scenario, solution)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_scalar_checks_near_thresholds(seed):
+    scenario, solution = borderline_scenario(seed)
+    expected = scalar_violations(scenario, solution)
+    assert expected, 'some borderline cases should violate'
+    assert vector_violations(scenario, solution) == expected
+
+
+def test_indexed_interferers_match_scalar_checks(monkeypatch):
+    monkeypatch.setattr(interferer_index, 'indexed_interferer_min', 100)
+    scenario, solution = borderline_scenario(7, 300)
+    assert ScenarioGeometry(scenario).interferer_index() is not None
+    assert vector_violations(scenario, solution) == scalar_violations(scenario, solution)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_planner_masks_never_admit_a_scalar_violation(seed):
+    # The planner's masks leave cos_margin on the safe side, so every link
+    # or color they allow must pass the scalar check too.
+    scenario, solution = borderline_scenario(seed)
+    geometry = ScenarioGeometry(scenario)
+    for sat_id, beams in solution.items():
+        sat = geometry.sat_index[sat_id]
+        users = [user for user, _ in beams.values()]
+        rows = np.array([geometry.user_index[user] for user in users])
+        sat_loc = scenario['sats'][sat_id]
+
+        visible = geometry.visible_mask(rows, [sat])[:, 0]
+        blocked = geometry.interferer_blocked_mask(rows, np.full(len(rows), sat))
+        for user, ok, hit in zip(users, visible.tolist(), blocked.tolist()):
+            user_loc = scenario['users'][user]
+            if ok:
+                assert calculate_angle_degrees(user_loc, origin, sat_loc) > 180.0 - max_user_visible_angle
+            if not hit:
+                assert all(calculate_angle_degrees(user_loc, sat_loc, loc) >= non_starlink_interference_max
+                           for loc in scenario['interferers'].values())
+
+        adjacency = conflict_graph(geometry.sat_user_directions(sat, rows))
+        for i in range(len(users)):
+            for j in range(i + 1, len(users)):
+                if j not in adjacency[i]:
+                    assert calculate_angle_degrees(sat_loc, scenario['users'][users[i]],
+                                                   scenario['users'][users[j]]) >= self_interference_max
+
+
+@pytest.mark.parametrize('filename', test_case_files[:8], ids=os.path.basename)
+def test_streaming_matches_scalar_checks_on_test_cases(filename):
+    scenario = {}
+    assert bp.read_scenario(filename, scenario, False)
+    solution = perturbed_solution(scenario, 0)
+    assert streamed_violations(scenario, solution, 0) == scalar_violations(scenario, solution)
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_streaming_matches_scalar_checks_near_thresholds(seed):
+    scenario, solution = borderline_scenario(seed, 300)
+    expected = scalar_violations(scenario, solution)
+    assert streamed_violations(scenario, solution, seed) == expected
+    assert streamed_violations(scenario, solution, seed, small_block_lines) == expected
+
+
+def test_streaming_reports_bad_lines():
+    scenario, _ = borderline_scenario(0)
+    lines = ["sat s0 beam 1 user u0 color A\n", "sat s0 beam 1 user u1 color B\n", "sat s1 beam 1 user u0 color A\n",
+             "sat s0 beam 40 user u1 color A\n", "sat nope beam 2 user u1 color A\n",
+             "sat s0 beam 2 user u1 color Z\n", "sat s0 beam 2 user u1\n", "# a comment\n", "\n"]
+    line_rules = ('format', 'id', 'beam', 'coverage')
+    assert [violation.rule for violation in StreamingValidator(scenario).validate(lines)
+            if violation.rule in line_rules] == ['beam', 'coverage', 'id', 'id', 'id', 'format']
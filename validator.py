@@ -0,0 +1,380 @@
+from collections import namedtuple
+
+import numpy as np
+
+from beamplanning import (origin, beams_per_satellite, valid_beam_ids, valid_color_ids, self_interference_max,
+                          non_starlink_interference_max, max_user_visible_angle, calculate_angle_degrees)
+from compact import BeamTable
+from geometry import (ScenarioGeometry, unit_vectors, chunk_rows, cos_self_interference_max,
+                      cos_non_starlink_interference_max, cos_max_user_visible_angle)
+
+#%% Parameters
+
+# One constraint violation.
+#   rule:  'coverage', 'visibility', 'self_interference' or 'interferer';
+#          when streaming, also 'format', 'id' and 'beam' for solution lines
+#          that are malformed, name unknown ids or reuse a beam.
+#   sat, beam, user: the offending beam.
+#   other: the earlier (sat, beam) covering the same user for 'coverage', the
+#          other beam id for 'self_interference', the interferer id for
+#          'interferer', the message and solution line for 'format', 'id'
+#          and 'beam', None for 'visibility'.
+#   angle: the angle the rule compares, in degrees, as calculate_angle_degrees
+#          measures it: origin-user-sat for 'visibility', sat-relative
+#          user-user for 'self_interference', user-relative sat-interferer
+#          for 'interferer'. None for 'coverage'.
+Violation = namedtuple('Violation', ['rule', 'sat', 'beam', 'user', 'other', 'angle'])
+
+# Cosines this close to a threshold are re-checked with the scalar
+# calculate_angle_degrees, so verdicts always match it exactly.
+cos_ambiguity = 1e-9
+
+#%% Solution links
+
+class SolutionLinks:
+    """
+    A solution flattened into one entry per beam, in solution order, with the
+    matching geometry rows as arrays. A compact.BeamTable is read straight
+    from its arrays.
+    """
+
+    def __init__(self, scenario: dict, solution: dict, geometry: ScenarioGeometry = None):
+        self.scenario = scenario
+        if isinstance(solution, BeamTable) and geometry in (None, solution.geometry):
+            # Already interned: take the rows straight from the table.
+            self.geometry = solution.geometry
+            self.sat_rows, beams, self.user_rows, colors = solution.links()
+            sat_ids, user_ids = self.geometry.sat_ids, self.geometry.user_ids
+            self.sats = [sat_ids[sat] for sat in self.sat_rows.tolist()]
+            self.beams = beams.tolist()
+            self.users = [user_ids[user] for user in self.user_rows.tolist()]
+            self.colors = [valid_color_ids[color] for color in colors.tolist()]
+            return
+        self.geometry = geometry if geometry is not None else ScenarioGeometry(scenario)
+        self.sats = []
+        self.beams = []
+        self.users = []
+        self.colors = []
+        for sat in solution:
+            for beam in solution[sat]:
+                user, color = solution[sat][beam]
+                self.sats.append(sat)
+                self.beams.append(beam)
+                self.users.append(user)
+                self.colors.append(color)
+        sat_index = self.geometry.sat_index
+        user_index = self.geometry.user_index
+        self.sat_rows = np.array([sat_index[sat] for sat in self.sats], dtype=np.intp)
+        self.user_rows = np.array([user_index[user] for user in self.users], dtype=np.intp)
+
+    def __len__(self) -> int:
+        return len(self.sats)
+
+
+def links_for(scenario: dict, solution, geometry: ScenarioGeometry = None) -> SolutionLinks:
+    if isinstance(solution, SolutionLinks):
+        return solution
+    return SolutionLinks(scenario, solution, geometry)
+
+
+def resolve(cosines: np.ndarray, threshold: float, violates_above: bool, reference) -> np.ndarray:
+    """
+    Returns: a bool array, True where cosines violate threshold. Values within
+    cos_ambiguity of it are decided by reference(i), the scalar check.
+    """
+    if violates_above:
+        violated = cosines > threshold
+    else:
+        violated = cosines < threshold
+    for i in np.flatnonzero(np.abs(cosines - threshold) <= cos_ambiguity).tolist():
+        violated[i] = reference(i)
+    return violated
+
+#%% Checks
+
+def coverage_violations(scenario: dict, solution, geometry: ScenarioGeometry = None) -> list:
+    """
+    Returns: a violation for every beam covering a user already covered by an
+    earlier beam.
+    """
+    links = links_for(scenario, solution, geometry)
+    entries = zip(links.sats, links.beams, links.users)
+
+    violations = []
+    first_beam = {}
+    for sat, beam, user in entries:
+        if user in first_beam:
+            violations.append(Violation('coverage', sat, beam, user, first_beam[user], None))
+        else:
+            first_beam[user] = (sat, beam)
+    return violations
+
+
+def visibility_violations(scenario: dict, solution, geometry: ScenarioGeometry = None) -> list:
+    """
+    Returns: a violation for every beam whose sat is more than
+    max_user_visible_angle from its user's vertical.
+    """
+    links = links_for(scenario, solution, geometry)
+    if len(links) == 0:
+        return []
+    elevation = links.geometry.link_elevation_cos(links.user_rows, links.sat_rows)
+
+    def reference_angle(i: int) -> float:
+        return calculate_angle_degrees(scenario['users'][links.users[i]], origin,
+                                       scenario['sats'][links.sats[i]])
+
+    violated = resolve(elevation, cos_max_user_visible_angle, False,
+                       lambda i: reference_angle(i) <= 180.0 - max_user_visible_angle)
+    return [Violation('visibility', links.sats[i], links.beams[i], links.users[i], None, reference_angle(i))
+            for i in np.flatnonzero(violated).tolist()]
+
+
+def self_interference_violations(scenario: dict, solution, geometry: ScenarioGeometry = None) -> list:
+    """
+    Returns: a violation for every pair of same-color beams on a sat pointed
+    within self_interference_max of each other, reported on the earlier beam
+    with the later one as other.
+    """
+    links = links_for(scenario, solution, geometry)
+    if len(links) == 0:
+        return []
+    geometry = links.geometry
+    directions = unit_vectors(geometry.user_pos[links.user_rows] - geometry.sat_pos[links.sat_rows])
+
+    # Group beams by (sat, color), keeping solution order inside each group.
+    groups = {}
+    for i, key in enumerate(zip(links.sats, links.colors)):
+        groups.setdefault(key, []).append(i)
+    firsts = []
+    seconds = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        members = np.array(members, dtype=np.intp)
+        a, b = np.triu_indices(len(members), 1)
+        firsts.append(members[a])
+        seconds.append(members[b])
+    if not firsts:
+        return []
+    firsts = np.concatenate(firsts)
+    seconds = np.concatenate(seconds)
+    separation = np.einsum('pk,pk->p', directions[firsts], directions[seconds])
+
+    def reference_angle(p: int) -> float:
+        i, j = firsts[p], seconds[p]
+        return calculate_angle_degrees(scenario['sats'][links.sats[i]], scenario['users'][links.users[i]],
+                                       scenario['users'][links.users[j]])
+
+    violated = np.flatnonzero(resolve(separation, cos_self_interference_max, True,
+                                      lambda p: reference_angle(p) < self_interference_max))
+    # Report in the order a pairwise scan of the solution would find them.
+    violated = sorted(violated.tolist(), key=lambda p: (firsts[p], seconds[p]))
+    return [Violation('self_interference', links.sats[firsts[p]], links.beams[firsts[p]],
+                      links.users[firsts[p]], links.beams[seconds[p]], reference_angle(p))
+            for p in violated]
+
+
+def interferer_violations(scenario: dict, solution, geometry: ScenarioGeometry = None) -> list:
+    """
+    Returns: a violation for every (beam, interferer) pair where the user sees
+    its sat within non_starlink_interference_max of the interferer.
+    """
+    links = links_for(scenario, solution, geometry)
+    geometry = links.geometry
+    if len(links) == 0 or len(geometry.interferer_ids) == 0:
+        return []
+
+    # Pairs clearly clear of the limit can't be violations, so only the rest are looked at.
+    pairs, interferers, separation = geometry.interferer_pairs(
+        links.user_rows, links.sat_rows, cos_non_starlink_interference_max - cos_ambiguity)
+
+    def reference_angle(p: int) -> float:
+        i, k = pairs[p], interferers[p]
+        return calculate_angle_degrees(scenario['users'][links.users[i]], scenario['sats'][links.sats[i]],
+                                       scenario['interferers'][geometry.interferer_ids[k]])
+
+    violated = resolve(separation, cos_non_starlink_interference_max, True,
+                       lambda p: reference_angle(p) < non_starlink_interference_max)
+    violations = []
+    for p in np.flatnonzero(violated).tolist():
+        i, k = pairs[p], interferers[p]
+        violations.append(Violation('interferer', links.sats[i], links.beams[i], links.users[i],
+                                    geometry.interferer_ids[k], reference_angle(p)))
+    return violations
+
+
+def find_violations(scenario: dict, solution: dict, geometry: ScenarioGeometry = None) -> list:
+    """
+    Runs every check. Returns: all violations, coverage first, then
+    visibility, self-interference and interferer ones.
+    """
+    links = links_for(scenario, solution, geometry)
+    return (coverage_violations(scenario, links)
+            + visibility_violations(scenario, links)
+            + self_interference_violations(scenario, links)
+            + interferer_violations(scenario, links))
+
+
+def format_violation(violation: Violation) -> str:
+    """
+    Returns: a one-line description of a violation.
+    """
+    rule, sat, beam, user, other, angle = violation
+    if rule in ('format', 'id', 'beam'):
+        message, line = other
+        return f"{message}{line.rstrip()}"
+    if rule == 'coverage':
+        return f"coverage: sat {sat} beam {beam} user {user} is already covered by sat {other[0]} beam {other[1]}"
+    if rule == 'visibility':
+        return f"visibility: sat {sat} beam {beam} user {user} at {angle - 90} degrees elevation " \
+               f"(min: {90 - max_user_visible_angle})"
+    if rule == 'self_interference':
+        return f"self_interference: sat {sat} beam {beam} user {user} is {angle} degrees from beam {other} " \
+               f"(min: {self_interference_max})"
+    return f"interferer: sat {sat} beam {beam} user {user} is {angle} degrees from non-Starlink sat {other} " \
+           f"(min: {non_starlink_interference_max})"
+
+#%% Streaming validation
+
+class StreamingValidator:
+    """
+    Checks solution lines as they are read, without ever holding the whole
+    solution. Memory stays bounded by sats x beams, whatever the file size:
+
+    - the format, ids, and beam and user reuse are checked on each line,
+      against per-sat beam tables and a bitset of covered users;
+    - visibility and interferer rules are checked a block of lines at a
+      time, vectorized, so only one block is ever pending;
+    - self-interference compares each beam with the beams already seen on
+      its sat, whose directions are kept in the per-sat tables.
+
+    Self-interference is reported on the earlier beam, with the later one as
+    other, once the later beam is read.
+    """
+
+    def __init__(self, scenario: dict, geometry: ScenarioGeometry = None, block_lines: int = chunk_rows):
+        self.scenario = scenario
+        self.geometry = geometry if geometry is not None else ScenarioGeometry(scenario)
+        self.block_lines = block_lines
+        n_sats = len(self.geometry.sat_ids)
+        n_users = len(self.geometry.user_ids)
+        self.beam_users = np.full((n_sats, beams_per_satellite), -1, dtype=np.int32)
+        self.beam_colors = np.zeros((n_sats, beams_per_satellite), dtype=np.int8)
+        self.beam_directions = np.zeros((n_sats, beams_per_satellite, 3), dtype=np.float64)
+        self.user_bits = bytearray((n_users + 7) // 8)
+        self.covered = 0
+        # Lines whose geometric checks are pending: (sat row, beam, user row, color, sat id, user id).
+        self.block = []
+
+    def validate(self, lines):
+        """
+        Yields: the violations in lines, a solution file's lines, as they
+        are found.
+        """
+        for line in lines:
+            yield from self.feed(line)
+        yield from self.flush()
+
+    def feed(self, line: str):
+        """
+        Checks one solution line. Yields: its violations, and those of the
+        pending block once it is full.
+        """
+        parts = line.split()
+        if '#' in line or len(parts) == 0:
+            return
+        if len(parts) != 8 or parts[0] != 'sat' or parts[2] != 'beam' or parts[4] != 'user' or parts[6] != 'color':
+            yield Violation('format', None, None, None, ("Invalid line! ", line), None)
+            return
+        sat_id, beam_id, user_id, color_id = parts[1], parts[3], parts[5], parts[7]
+        sat = self.geometry.sat_index.get(sat_id)
+        user = self.geometry.user_index.get(user_id)
+        if sat is None:
+            yield Violation('id', sat_id, beam_id, user_id, ("Referenced an invalid sat id! ", line), None)
+            return
+        if user is None:
+            yield Violation('id', sat_id, beam_id, user_id, ("Referenced an invalid user id! ", line), None)
+            return
+        if beam_id not in valid_beam_ids:
+            yield Violation('id', sat_id, beam_id, user_id, ("Referenced an invalid beam id! ", line), None)
+            return
+        if color_id not in valid_color_ids:
+            yield Violation('id', sat_id, beam_id, user_id, ("Referenced an invalid color! ", line), None)
+            return
+        beam = int(beam_id)
+        if self.beam_users[sat, beam - 1] >= 0:
+            yield Violation('beam', sat_id, beam_id, user_id, ("Beam is allocated multiple times! ", line), None)
+            return
+        byte, bit = divmod(user, 8)
+        if self.user_bits[byte] & (1 << bit):
+            # Rare, so find the earlier beam by scanning the tables.
+            first_sat, first_beam = np.argwhere(self.beam_users == user)[0].tolist()
+            yield Violation('coverage', sat_id, beam_id, user_id,
+                            (self.geometry.sat_ids[first_sat], str(first_beam + 1)), None)
+        else:
+            self.user_bits[byte] |= 1 << bit
+            self.covered += 1
+        self.beam_users[sat, beam - 1] = user
+        self.beam_colors[sat, beam - 1] = valid_color_ids.index(color_id)
+
+        self.block.append((sat, beam, user, self.beam_colors[sat, beam - 1], sat_id, user_id))
+        if len(self.block) >= self.block_lines:
+            yield from self.flush()
+
+    def flush(self):
+        """
+        Runs the geometric checks on the pending block. Yields: its
+        violations, line by line.
+        """
+        if not self.block:
+            return
+        block, self.block = self.block, []
+        geometry = self.geometry
+        scenario = self.scenario
+        sats = np.array([entry[0] for entry in block], dtype=np.intp)
+        users = np.array([entry[2] for entry in block], dtype=np.intp)
+
+        def visibility_angle(i: int) -> float:
+            return calculate_angle_degrees(scenario['users'][block[i][5]], origin, scenario['sats'][block[i][4]])
+
+        hidden = resolve(geometry.link_elevation_cos(users, sats), cos_max_user_visible_angle, False,
+                         lambda i: visibility_angle(i) <= 180.0 - max_user_visible_angle)
+
+        pairs, interferers, separation = geometry.interferer_pairs(
+            users, sats, cos_non_starlink_interference_max - cos_ambiguity)
+
+        def interferer_angle(p: int) -> float:
+            i = pairs[p]
+            return calculate_angle_degrees(scenario['users'][block[i][5]], scenario['sats'][block[i][4]],
+                                           scenario['interferers'][geometry.interferer_ids[interferers[p]]])
+
+        blocked = resolve(separation, cos_non_starlink_interference_max, True,
+                          lambda p: interferer_angle(p) < non_starlink_interference_max)
+        # Each line's blocked pairs, in interferer order.
+        hits = {}
+        for p in np.flatnonzero(blocked).tolist():
+            hits.setdefault(int(pairs[p]), []).append(p)
+
+        directions = unit_vectors(geometry.user_pos[users] - geometry.sat_pos[sats])
+        for i, (sat, beam, user, color, sat_id, user_id) in enumerate(block):
+            if hidden[i]:
+                yield Violation('visibility', sat_id, str(beam), user_id, None, visibility_angle(i))
+
+            # Same-color beams read earlier on this sat.
+            others = np.flatnonzero((self.beam_users[sat] >= 0) & (self.beam_colors[sat] == color))
+            others = others[others != beam - 1]
+            self.beam_directions[sat, beam - 1] = directions[i]
+            if len(others):
+                separation = self.beam_directions[sat, others] @ directions[i]
+                for j in np.flatnonzero(separation > cos_self_interference_max - cos_ambiguity).tolist():
+                    other_user = geometry.user_ids[self.beam_users[sat, others[j]]]
+                    angle = calculate_angle_degrees(scenario['sats'][sat_id], scenario['users'][other_user],
+                                                    scenario['users'][user_id])
+                    if angle < self_interference_max:
+                        yield Violation('self_interference', sat_id, str(others[j] + 1), other_user,
+                                        str(beam), angle)
+
+            for p in hits.get(i, []):
+                yield Violation('interferer', sat_id, str(beam), user_id, geometry.interferer_ids[interferers[p]],
+                                interferer_angle(p))
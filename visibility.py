@@ -0,0 +1,241 @@
+from math import asin, degrees, radians, sin
+
+import numpy as np
+
+import instrumentation
+from beamplanning import max_user_visible_angle
+from geometry import ScenarioGeometry, unit_vectors
+from spatial import build_grid
+
+#%% Parameters
+
+# Extra degrees added to the search cone, to absorb rounding.
+search_slack_degrees = 0.01
+
+# Smallest grid cell, degrees. Keeps the grid a sane size if every sat is
+# barely above the users.
+min_cell_degrees = 1.0
+
+#%% Visibility index
+
+def max_visible_central_angle(geometry: ScenarioGeometry) -> float:
+    """
+    Returns: an upper bound, in degrees, on the earth-central angle between a
+    user and any sat it can see within max_user_visible_angle of vertical.
+
+    For a user at radius Ru and a sat at radius Rs, seen at zenith angle z,
+    the central angle is z - asin(Ru * sin(z) / Rs). That grows with z and Rs
+    and shrinks with Ru, so the smallest user radius and largest sat radius
+    at the max zenith angle give the bound.
+    """
+    if len(geometry.user_pos) == 0 or len(geometry.sat_pos) == 0:
+        return 0.0
+    user_radius = np.linalg.norm(geometry.user_pos, axis=1).min()
+    sat_radius = np.linalg.norm(geometry.sat_pos, axis=1).max()
+    zenith = radians(max_user_visible_angle)
+    ratio = user_radius * sin(zenith) / sat_radius
+    if ratio >= 1.0:
+        # No sat is high enough to be seen by anyone.
+        return 0.0
+    return degrees(zenith - asin(ratio))
+
+
+class VisibilityIndex:
+    """
+    Sparse index of the (user, sat) links that pass the static constraints.
+
+    For each user, the sats within the max_user_visible_angle cone that no
+    non-Starlink satellite blocks; and for each sat, the users it can serve.
+    Built with a lat/lon grid over the sats' directions from the center of the
+    earth, so only nearby sats are ever tested against a user.
+    """
+
+    def __init__(self, geometry: ScenarioGeometry):
+        self.geometry = geometry
+        n_users = len(geometry.user_pos)
+        n_sats = len(geometry.sat_pos)
+
+        users, sats = self.candidate_links()
+        if len(users):
+            ok = geometry.link_ok_mask(users, sats)
+            users, sats = users[ok], sats[ok]
+            if instrumentation.enabled:
+                instrumentation.count_check('candidate_link', len(users), len(ok) - len(users))
+
+        self.store_links(users, sats, n_users, n_sats)
+
+    def store_links(self, users: np.ndarray, sats: np.ndarray, n_users: int, n_sats: int):
+        """
+        Stores matching user and sat row arrays of links in both directions
+        as CSR arrays: the links of user u are
+        user_sats[user_offsets[u]:user_offsets[u + 1]], and likewise per sat.
+        """
+        order = np.lexsort((sats, users))
+        self.user_sats = sats[order]
+        self.user_offsets = np.searchsorted(users[order], np.arange(n_users + 1))
+        order = np.lexsort((users, sats))
+        self.sat_users = users[order]
+        self.sat_offsets = np.searchsorted(sats[order], np.arange(n_sats + 1))
+
+    def subset(self, geometry: ScenarioGeometry, users, sats) -> 'VisibilityIndex':
+        """
+        Returns: the index of the links between the given user and sat rows,
+        for geometry, their ScenarioGeometry.subset(), without testing any
+        link again.
+        """
+        users = np.asarray(users, dtype=np.intp)
+        sats = np.asarray(sats, dtype=np.intp)
+        sat_rows = np.full(len(self.sat_offsets) - 1, -1, dtype=np.intp)
+        sat_rows[sats] = np.arange(len(sats))
+
+        # Gather each user's run of user_sats, then keep the sats in the subset.
+        starts = self.user_offsets[users]
+        counts = self.user_offsets[users + 1] - starts
+        firsts = np.cumsum(counts) - counts
+        links = np.repeat(starts - firsts, counts) + np.arange(counts.sum())
+        part_users = np.repeat(np.arange(len(users)), counts)
+        part_sats = sat_rows[self.user_sats[links]]
+        keep = part_sats >= 0
+
+        index = VisibilityIndex.__new__(VisibilityIndex)
+        index.geometry = geometry
+        index.store_links(part_users[keep], part_sats[keep], len(users), len(sats))
+        return index
+
+    def candidate_links(self):
+        """
+        Returns: matching user and sat row arrays for every pair the sat grid
+        says might be visible.
+        """
+        geometry = self.geometry
+        radius = max_visible_central_angle(geometry)
+        if radius <= 0.0:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty
+        radius = radius + search_slack_degrees
+
+        grid = build_grid(unit_vectors(geometry.sat_pos), max(radius, min_cell_degrees))
+        users = []
+        sats = []
+        for user, up in enumerate(geometry.user_up.tolist()):
+            found = grid.query_keys(up, radius)
+            users.extend([user] * len(found))
+            sats.extend(found)
+        return np.asarray(users, dtype=np.intp), np.asarray(sats, dtype=np.intp)
+
+    def __len__(self) -> int:
+        return len(self.user_sats)
+
+    def sats_for_user(self, user: int) -> np.ndarray:
+        """
+        Returns: the rows of the sats that can serve user row, ascending.
+        """
+        return self.user_sats[self.user_offsets[user]:self.user_offsets[user + 1]]
+
+    def users_for_sat(self, sat: int) -> np.ndarray:
+        """
+        Returns: the rows of the users sat row can serve, ascending.
+        """
+        return self.sat_users[self.sat_offsets[sat]:self.sat_offsets[sat + 1]]
+
+    def has_link(self, user: int, sat: int) -> bool:
+        sats = self.sats_for_user(user)
+        i = np.searchsorted(sats, sat)
+        return bool(i < len(sats) and sats[i] == sat)
+
+
+class MutableVisibility:
+    """
+    A VisibilityIndex that can follow changes to the scenario: users joining
+    or leaving, sats moving and interferers appearing. Links are held as sets
+    per user and per sat rather than CSR arrays, so they can be updated one
+    row at a time.
+
+    Offers the same lookups as VisibilityIndex, so a PlanState can use either.
+    """
+
+    def __init__(self, index: VisibilityIndex):
+        self.geometry = index.geometry
+        self.user_links = [set(index.sats_for_user(u).tolist()) for u in range(len(index.user_offsets) - 1)]
+        self.sat_links = [set(index.users_for_sat(s).tolist()) for s in range(len(index.sat_offsets) - 1)]
+
+    def __len__(self) -> int:
+        return sum(len(sats) for sats in self.user_links)
+
+    def sats_for_user(self, user: int) -> np.ndarray:
+        if user >= len(self.user_links):
+            return np.zeros(0, dtype=np.intp)
+        return np.array(sorted(self.user_links[user]), dtype=np.intp)
+
+    def users_for_sat(self, sat: int) -> np.ndarray:
+        if sat >= len(self.sat_links):
+            return np.zeros(0, dtype=np.intp)
+        return np.array(sorted(self.sat_links[sat]), dtype=np.intp)
+
+    def has_link(self, user: int, sat: int) -> bool:
+        return user < len(self.user_links) and sat in self.user_links[user]
+
+    def grow(self):
+        """
+        Adds empty link sets for any user or sat rows the geometry gained.
+        """
+        while len(self.user_links) < len(self.geometry.user_ids):
+            self.user_links.append(set())
+        while len(self.sat_links) < len(self.geometry.sat_ids):
+            self.sat_links.append(set())
+
+    def remove_user(self, user: int):
+        for sat in self.user_links[user]:
+            self.sat_links[sat].discard(user)
+        self.user_links[user] = set()
+
+    def refresh_user(self, user: int):
+        """
+        Recomputes every link of user row against every sat.
+        """
+        self.grow()
+        self.remove_user(user)
+        sats = np.arange(len(self.geometry.sat_ids), dtype=np.intp)
+        ok = self.geometry.link_ok_mask(np.full(len(sats), user, dtype=np.intp), sats)
+        for sat in sats[ok].tolist():
+            self.user_links[user].add(sat)
+            self.sat_links[sat].add(user)
+
+    def refresh_sat(self, sat: int, users: np.ndarray):
+        """
+        Recomputes every link of sat row against the given user rows, the
+        users still in the scenario.
+        """
+        self.grow()
+        for user in self.sat_links[sat]:
+            self.user_links[user].discard(sat)
+        self.sat_links[sat] = set()
+        users = np.asarray(users, dtype=np.intp)
+        ok = self.geometry.link_ok_mask(users, np.full(len(users), sat, dtype=np.intp))
+        for user in users[ok].tolist():
+            self.user_links[user].add(sat)
+            self.sat_links[sat].add(user)
+
+    def recheck_links(self, interferer_pos: np.ndarray = None) -> list:
+        """
+        Re-tests every current link against the static constraints and drops
+        the ones that now fail. With interferer_pos, only the interferers at
+        those positions, e.g. one just added, are tested against.
+
+        Returns: the (user row, sat row) links dropped.
+        """
+        users = [user for user, sats in enumerate(self.user_links) for _ in sats]
+        sats = [sat for sats in self.user_links for sat in sats]
+        if not users:
+            return []
+        users = np.asarray(users, dtype=np.intp)
+        sats = np.asarray(sats, dtype=np.intp)
+        if interferer_pos is None:
+            failed = ~self.geometry.link_ok_mask(users, sats)
+        else:
+            failed = self.geometry.interferer_blocked_mask(users, sats, interferer_pos)
+        dropped = list(zip(users[failed].tolist(), sats[failed].tolist()))
+        for user, sat in dropped:
+            self.user_links[user].discard(sat)
+            self.sat_links[sat].discard(user)
+        return dropped